@@ -0,0 +1,156 @@
+"""Vinculação aproximada: chaves parecidas em vez de idênticas"""
+from difflib import SequenceMatcher
+
+import numpy as np
+import pandas as pd
+
+from normalizacao import NormalizacaoChave
+from vinculacao import anexar_colunas
+
+try:
+    from rapidfuzz.fuzz import ratio as _nota_rapidfuzz
+except ImportError:  # rapidfuzz é opcional: sem ele a nota vem do difflib
+    _nota_rapidfuzz = None
+
+# Coluna acrescentada ao resultado com a nota (0 a 100) da correspondência
+COLUNA_SIMILARIDADE = 'similaridade_chave'
+
+# Nota mínima padrão para aceitar uma correspondência
+LIMIAR_SIMILARIDADE = 90
+
+# Tamanho dos n-gramas do índice de bloqueio
+TAMANHO_NGRAMA = 3
+
+# Candidatos avaliados por chave do destino (os que mais compartilham n-gramas)
+MAX_CANDIDATOS = 20
+
+# Soma máxima das listas de n-gramas consultadas por chave; os n-gramas mais
+# comuns ("da", "ltda"...) são deixados de fora quando o limite é atingido
+MAX_OCORRENCIAS = 50_000
+
+# Padronização aplicada aos dois lados antes da comparação
+_PADRONIZACAO = NormalizacaoChave(('espacos', 'acentos', 'caixa'))
+
+
+def preparar_chaves(serie):
+    """Chaves em texto comparável: sem acentos, em minúsculas e sem pontuação"""
+    texto = _PADRONIZACAO.aplicar(serie)
+    return texto.str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+
+
+def ngramas(texto, tamanho=TAMANHO_NGRAMA):
+    """Conjunto de n-gramas de caracteres do texto, com bordas marcadas"""
+    texto = f" {texto} "
+    if len(texto) <= tamanho:
+        return {texto}
+    return {texto[inicio:inicio + tamanho] for inicio in range(len(texto) - tamanho + 1)}
+
+
+def similaridade(texto, outro):
+    """Nota de 0 a 100 entre dois textos"""
+    if _nota_rapidfuzz is not None:
+        return _nota_rapidfuzz(texto, outro)
+    return SequenceMatcher(None, texto, outro).ratio() * 100
+
+
+class BuscaAproximada:
+    """Índice de bloqueio por n-gramas sobre as chaves distintas da origem.
+
+    Cada n-grama aponta para as chaves que o contêm. Uma consulta reúne as
+    chaves que compartilham n-gramas com o texto procurado e só as
+    `max_candidatos` com mais n-gramas em comum recebem a nota completa,
+    evitando comparar todas as chaves entre si.
+    """
+
+    def __init__(self, chaves, limiar=LIMIAR_SIMILARIDADE, max_candidatos=MAX_CANDIDATOS):
+        self.limiar = limiar
+        self.max_candidatos = max_candidatos
+        self.chaves = list(chaves)
+        self.exatas = {}
+        listas = {}
+        for posicao, chave in enumerate(self.chaves):
+            self.exatas.setdefault(chave, posicao)
+            for ngrama in ngramas(chave):
+                listas.setdefault(ngrama, []).append(posicao)
+        self.listas = {ngrama: np.array(posicoes, dtype=np.int64) for ngrama, posicoes in listas.items()}
+
+    def buscar(self, texto):
+        """Posição da chave mais parecida e sua nota, ou (-1, nan) abaixo do limiar"""
+        posicao = self.exatas.get(texto)
+        if posicao is not None:
+            return posicao, 100.0
+        listas = sorted((self.listas[ngrama] for ngrama in ngramas(texto) if ngrama in self.listas), key=len)
+        if not listas:
+            return -1, np.nan
+        usadas = [listas[0]]
+        ocorrencias = len(listas[0])
+        for lista in listas[1:]:
+            ocorrencias += len(lista)
+            if ocorrencias > MAX_OCORRENCIAS:
+                break
+            usadas.append(lista)
+        candidatos, comuns = np.unique(np.concatenate(usadas), return_counts=True)
+        if len(candidatos) > self.max_candidatos:
+            candidatos = candidatos[np.argpartition(-comuns, self.max_candidatos)[:self.max_candidatos]]
+
+        melhor, nota_melhor = -1, np.nan
+        minimo = self.limiar
+        for candidato in candidatos:
+            nota = similaridade(texto, self.chaves[candidato])
+            if nota >= minimo:
+                melhor, nota_melhor, minimo = int(candidato), nota, nota
+        return melhor, nota_melhor
+
+
+class CorrespondenciaAproximada:
+    """Left join da origem ao destino aceitando chaves parecidas.
+
+    Envolve um `IndiceOrigem` de chave simples e única: cada chave distinta
+    do destino é procurada uma única vez na `BuscaAproximada` e a linha da
+    origem mais parecida (com nota a partir do limiar) é anexada. A nota vai
+    para a coluna `COLUNA_SIMILARIDADE`; sem correspondência, as colunas da
+    origem e a nota ficam vazias. Pode ser usada no lugar do índice em
+    `merge_csv_em_blocos`, `merge_blocos` e no lote.
+    """
+
+    def __init__(self, indice, limiar=LIMIAR_SIMILARIDADE):
+        if indice.codificador is not None:
+            raise ValueError("A vinculação aproximada aceita apenas uma coluna-chave")
+        if not indice.chave_unica:
+            raise ValueError("A vinculação aproximada exige chaves únicas na origem; "
+                             "escolha outra política para chaves repetidas")
+        self.indice = indice
+        self.chave = indice.chave
+        self.chaves = indice.chaves
+        self.limiar = limiar
+        self.busca = BuscaAproximada(preparar_chaves(indice.tabela.index.to_series()).fillna(''), limiar)
+        self._memoria = {}
+        self.correspondidas = 0
+        self.sem_correspondencia = 0
+
+    @property
+    def colunas(self):
+        return self.indice.colunas
+
+    def enriquecer(self, bloco):
+        """Aplica o left join aproximado a um bloco do destino"""
+        chaves = bloco[self.chave]
+        if self.indice.normalizacao:
+            chaves = self.indice.normalizacao.aplicar(chaves)
+        codigos, distintos = pd.factorize(preparar_chaves(chaves))
+        # Uma posição extra no fim atende o código -1 das chaves vazias
+        posicoes = np.full(len(distintos) + 1, -1, dtype=np.int64)
+        notas = np.full(len(distintos) + 1, np.nan)
+        for numero, texto in enumerate(distintos):
+            if texto not in self._memoria:
+                self._memoria[texto] = self.busca.buscar(texto) if texto else (-1, np.nan)
+            posicoes[numero], notas[numero] = self._memoria[texto]
+
+        # Posição -1 não existe no RangeIndex e vira linha vazia, como no merge
+        valores = self.indice.tabela.reset_index(drop=True).reindex(posicoes[codigos])
+        resultado = anexar_colunas(bloco, valores)
+        resultado[COLUNA_SIMILARIDADE] = notas[codigos].round(1)
+        encontradas = int((posicoes[codigos] >= 0).sum())
+        self.correspondidas += encontradas
+        self.sem_correspondencia += len(bloco) - encontradas
+        return resultado
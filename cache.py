@@ -0,0 +1,329 @@
+"""Caches de dados reaproveitados entre execuções do SAFE"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+from leitura import colunas_origem, eh_csv
+from paralelo import ler_arquivo_paralelo
+from vinculacao import IndiceOrigem
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow é opcional: sem ele o cache em disco fica desativado
+    feather = None
+
+# Memória máxima ocupada pelos DataFrames guardados em cache
+ORCAMENTO_CACHE_MB = 512
+
+# Pasta e espaço máximo do cache em disco de planilhas Excel
+DIRETORIO_CACHE_DISCO = Path.home() / '.safe_cache'
+LIMITE_CACHE_DISCO_MB = 2048
+
+# Pasta dos índices de chave da origem e quantos deles ficam também na memória
+DIRETORIO_INDICES = DIRETORIO_CACHE_DISCO / 'indices'
+MAX_INDICES_MEMORIA = 4
+
+
+def identificar_arquivo(caminho):
+    """Identidade do arquivo em disco: caminho absoluto, tamanho e modificação"""
+    estado = os.stat(caminho)
+    return (os.path.abspath(caminho), estado.st_size, estado.st_mtime_ns)
+
+
+_hashes = {}
+_trava_hashes = threading.Lock()
+
+
+def hash_conteudo(caminho):
+    """Hash do conteúdo do arquivo, recalculado apenas quando ele muda"""
+    arquivo = identificar_arquivo(caminho)
+    with _trava_hashes:
+        if arquivo in _hashes:
+            return _hashes[arquivo]
+    resumo = hashlib.blake2b(digest_size=16)
+    with open(caminho, 'rb') as origem:
+        for pedaco in iter(lambda: origem.read(1024 * 1024), b''):
+            resumo.update(pedaco)
+    with _trava_hashes:
+        _hashes[arquivo] = resumo.hexdigest()
+    return _hashes[arquivo]
+
+
+def limitar_diretorio(diretorio, padrao, limite_bytes):
+    """Apaga os arquivos usados há mais tempo até respeitar o limite"""
+    copias = sorted(Path(diretorio).glob(padrao), key=lambda item: item.stat().st_mtime)
+    total = sum(item.stat().st_size for item in copias)
+    while copias and total > limite_bytes:
+        antiga = copias.pop(0)
+        total -= antiga.stat().st_size
+        antiga.unlink(missing_ok=True)
+
+
+class CacheDisco:
+    """Cache em disco de planilhas Excel no formato Arrow IPC (Feather).
+
+    Na primeira leitura a planilha inteira é convertida e gravada em
+    `diretorio`; nas seguintes o arquivo Arrow é mapeado em memória e só as
+    colunas pedidas são materializadas. O nome do arquivo leva o caminho e a
+    planilha de origem, as linhas puladas e o hash do conteúdo, então uma
+    pasta alterada nunca reaproveita dados antigos, e as versões obsoletas
+    são apagadas.
+    """
+
+    def __init__(self, diretorio=DIRETORIO_CACHE_DISCO, limite_mb=LIMITE_CACHE_DISCO_MB):
+        self.diretorio = Path(diretorio)
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        self._trava = threading.Lock()
+
+    @property
+    def disponivel(self):
+        """Indica se o pyarrow está instalado"""
+        return feather is not None
+
+    def ler(self, caminho, skiprows=0, colunas=None, motor='auto', planilha=None, ao_progredir=None):
+        """Lê o arquivo usando a cópia em disco quando ela existir"""
+        if not self.disponivel or eh_csv(caminho):
+            return ler_arquivo_paralelo(caminho, skiprows, colunas=colunas, motor=motor, planilha=planilha,
+                                        ao_progredir=ao_progredir)
+
+        origem = f"{os.path.abspath(caminho)}|{planilha}"
+        prefixo = hashlib.blake2b(origem.encode('utf-8'), digest_size=8).hexdigest()
+        copia = self.diretorio / f"{prefixo}_{skiprows}_{hash_conteudo(caminho)}.arrow"
+        if copia.exists():
+            try:
+                return self._ler_copia(copia, colunas)
+            except Exception:
+                # Cópia corrompida ou incompatível: refaz a partir da planilha
+                copia.unlink(missing_ok=True)
+
+        df = ler_arquivo_paralelo(caminho, skiprows, motor=motor, planilha=planilha, ao_progredir=ao_progredir)
+        self._gravar(df, copia, f"{prefixo}_{skiprows}_")
+        if colunas is None:
+            return df
+        desejadas = set(colunas)
+        return df[[col for col in df.columns if col in desejadas]]
+
+    def _ler_copia(self, copia, colunas):
+        tabela = feather.read_table(copia, memory_map=True)
+        if colunas is not None:
+            desejadas = set(colunas)
+            tabela = tabela.select([nome for nome in tabela.column_names if nome in desejadas])
+        # Marca o uso para a remoção por antiguidade
+        os.utime(copia)
+        return tabela.to_pandas()
+
+    def _gravar(self, df, copia, prefixo_versoes):
+        # Arrow só aceita nomes de coluna em texto e colunas de tipo uniforme
+        if not all(isinstance(col, str) for col in df.columns):
+            return
+        with self._trava:
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+            for antiga in self.diretorio.glob(f"{prefixo_versoes}*.arrow"):
+                antiga.unlink(missing_ok=True)
+            temporario = copia.with_suffix('.tmp')
+            try:
+                feather.write_feather(df, temporario, compression='uncompressed')
+                os.replace(temporario, copia)
+            except Exception:
+                temporario.unlink(missing_ok=True)
+                return
+            limitar_diretorio(self.diretorio, '*.arrow', self.limite_bytes)
+
+
+class CacheDataFrames:
+    """Cache LRU de DataFrames lidos, limitado por um orçamento de memória.
+
+    As entradas são identificadas por arquivo (caminho, tamanho, data de
+    modificação, planilha), linhas puladas e colunas lidas. Uma leitura com menos
+    colunas é atendida por qualquer entrada do mesmo arquivo que já contenha
+    todas elas. Os DataFrames devolvidos são compartilhados e não devem ser
+    alterados no lugar.
+    """
+
+    def __init__(self, orcamento_mb=ORCAMENTO_CACHE_MB, cache_disco=None):
+        self.cache_disco = cache_disco or CacheDisco()
+        self._itens = OrderedDict()
+        self._uso = 0
+        self._trava = threading.Lock()
+        self.orcamento_bytes = int(orcamento_mb * 1024 * 1024)
+        self.acertos = 0
+        self.falhas = 0
+
+    def definir_orcamento(self, orcamento_mb):
+        """Altera o orçamento de memória, descartando entradas se preciso"""
+        with self._trava:
+            self.orcamento_bytes = int(orcamento_mb * 1024 * 1024)
+            self._liberar(0)
+
+    def ler(self, caminho, skiprows=0, colunas=None, motor='auto', persistir=False, planilha=None,
+            ao_progredir=None):
+        """Lê o arquivo pelo cache, carregando-o apenas quando necessário.
+
+        Com `persistir`, planilhas Excel passam também pelo cache em disco.
+        `ao_progredir` só é chamado quando o arquivo é de fato lido (veja
+        `ler_arquivo`).
+        """
+        arquivo = identificar_arquivo(caminho) + (None if eh_csv(caminho) else planilha,)
+        with self._trava:
+            df = self._procurar(arquivo, skiprows, colunas)
+            if df is not None:
+                self.acertos += 1
+                return df
+            self.falhas += 1
+
+        if persistir:
+            df = self.cache_disco.ler(caminho, skiprows, colunas=colunas, motor=motor, planilha=planilha,
+                                      ao_progredir=ao_progredir)
+        else:
+            df = ler_arquivo_paralelo(caminho, skiprows, colunas=colunas, motor=motor, planilha=planilha,
+                                      ao_progredir=ao_progredir)
+        self._guardar((arquivo, skiprows, None if colunas is None else frozenset(colunas)), df)
+        return df
+
+    def _procurar(self, arquivo, skiprows, colunas):
+        for chave, (df, _) in self._itens.items():
+            arquivo_item, skip_item, colunas_item = chave
+            if arquivo_item != arquivo or skip_item != skiprows:
+                continue
+            if colunas is None:
+                if colunas_item is None:
+                    self._itens.move_to_end(chave)
+                    return df
+            elif colunas_item is None or colunas_item.issuperset(colunas):
+                self._itens.move_to_end(chave)
+                # Mesmo filtro da leitura projetada: colunas ausentes ficam de fora
+                desejadas = set(colunas)
+                return df[[col for col in df.columns if col in desejadas]]
+        return None
+
+    def _guardar(self, chave, df):
+        tamanho = int(df.memory_usage(deep=True).sum())
+        with self._trava:
+            if tamanho > self.orcamento_bytes or chave in self._itens:
+                return
+            self._liberar(tamanho)
+            self._itens[chave] = (df, tamanho)
+            self._uso += tamanho
+
+    def _liberar(self, necessario):
+        """Remove as entradas menos usadas até caber `necessario` bytes"""
+        while self._itens and self._uso + necessario > self.orcamento_bytes:
+            _, (_, tamanho) = self._itens.popitem(last=False)
+            self._uso -= tamanho
+
+    def resumo(self):
+        """Texto curto com acertos e falhas, para a barra de status"""
+        return f"cache: {self.acertos} acerto(s), {self.falhas} falha(s)"
+
+
+class CacheIndices:
+    """Índices de chave da origem reaproveitados entre vinculações.
+
+    A mesma origem costuma ser vinculada a vários destinos seguidos. O índice
+    (chave → colunas selecionadas) é montado uma vez por arquivo, planilha,
+    linhas puladas e coluna-chave e fica guardado na memória; com `persistir`,
+    também em disco, em formato pickle, que preserva o índice e os tipos sem
+    depender do pyarrow. O nome do arquivo leva o hash do conteúdo da origem,
+    então uma origem alterada nunca reaproveita um índice antigo. Pedidos
+    cujas colunas já estão no índice não releem a origem; com colunas novas,
+    o índice é refeito com a união das colunas.
+    """
+
+    def __init__(self, cache, diretorio=DIRETORIO_INDICES, limite_mb=LIMITE_CACHE_DISCO_MB):
+        self.cache = cache
+        self.diretorio = Path(diretorio)
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        self._memoria = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, caminho, chave, colunas, skiprows=0, motor='auto', planilha=None,
+              persistir=True, persistir_leitura=False, normalizacao=None, ao_progredir=None):
+        """Devolve o índice da origem com a chave e as colunas pedidas.
+
+        Colunas ausentes na origem ficam de fora do índice, como na leitura
+        projetada; `persistir_leitura` é repassado ao cache de DataFrames
+        quando a origem precisa ser lida. Com `normalizacao`, o índice guarda
+        as chaves já normalizadas e é identificado também pelas regras usadas.
+        `chave` pode ser uma lista de colunas (chave composta). `ao_progredir`
+        acompanha a leitura da origem, quando ela acontece.
+        """
+        planilha = None if eh_csv(caminho) else planilha
+        normalizacao = normalizacao if normalizacao else None
+        chaves = (chave,) if isinstance(chave, str) else tuple(chave)
+        entrada = (identificar_arquivo(caminho), planilha, skiprows, chaves, normalizacao)
+        desejadas = [col for col in colunas if col not in chaves]
+
+        with self._trava:
+            indice = self._memoria.get(entrada)
+            if indice is not None:
+                self._memoria.move_to_end(entrada)
+        copia = self._copia(caminho, planilha, skiprows, chaves, normalizacao) if persistir else None
+        if indice is None and copia is not None and copia.exists():
+            indice = self._ler_copia(copia, chaves, normalizacao)
+            if indice is not None:
+                self._lembrar(entrada, indice)
+        if indice is not None and set(desejadas).issubset(indice.colunas):
+            return indice.projetar(desejadas)
+
+        # Índice ausente ou sem alguma das colunas: refaz com a união
+        anteriores = indice.colunas if indice is not None else []
+        uniao = anteriores + [col for col in desejadas if col not in anteriores]
+        df = self.cache.ler(caminho, skiprows, colunas=colunas_origem(chaves, uniao), motor=motor,
+                            persistir=persistir_leitura, planilha=planilha, ao_progredir=ao_progredir)
+        for coluna in chaves:
+            if coluna not in df.columns:
+                raise ValueError(f"Coluna-chave '{coluna}' não encontrada no arquivo origem")
+        indice = IndiceOrigem(df, chaves, normalizacao)
+        self._lembrar(entrada, indice)
+        if copia is not None:
+            self._gravar(indice, copia)
+        return indice.projetar(desejadas)
+
+    def _copia(self, caminho, planilha, skiprows, chaves, normalizacao):
+        origem = f"{os.path.abspath(caminho)}|{planilha}|{'|'.join(map(str, chaves))}|{normalizacao}"
+        prefixo = hashlib.blake2b(origem.encode('utf-8'), digest_size=8).hexdigest()
+        return self.diretorio / f"{prefixo}_{skiprows}_{hash_conteudo(caminho)}.pkl"
+
+    def _ler_copia(self, copia, chaves, normalizacao):
+        try:
+            tabela, codificador = pd.read_pickle(copia)
+            if not isinstance(tabela, pd.DataFrame):
+                raise TypeError("índice salvo em formato antigo")
+        except Exception:
+            # Cópia corrompida ou de outra versão do pandas: será refeita
+            copia.unlink(missing_ok=True)
+            return None
+        # Marca o uso para a remoção por antiguidade
+        os.utime(copia)
+        return IndiceOrigem.da_tabela(tabela, chaves, normalizacao, codificador)
+
+    def _gravar(self, indice, copia):
+        prefixo_versoes = copia.name.rsplit('_', 1)[0] + '_'
+        with self._trava:
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+            for antiga in self.diretorio.glob(f"{prefixo_versoes}*.pkl"):
+                antiga.unlink(missing_ok=True)
+            temporario = copia.with_suffix('.tmp')
+            try:
+                pd.to_pickle((indice.tabela, indice.codificador), temporario)
+                os.replace(temporario, copia)
+            except Exception:
+                temporario.unlink(missing_ok=True)
+                return
+            limitar_diretorio(self.diretorio, '*.pkl', self.limite_bytes)
+
+    def _lembrar(self, entrada, indice):
+        with self._trava:
+            self._memoria[entrada] = indice
+            self._memoria.move_to_end(entrada)
+            while len(self._memoria) > MAX_INDICES_MEMORIA:
+                self._memoria.popitem(last=False)
+
+
+# Caches compartilhados pelas interfaces
+cache_dataframes = CacheDataFrames()
+cache_indices = CacheIndices(cache_dataframes)
@@ -0,0 +1,88 @@
+"""Codificação em dicionário (categorias) das colunas de texto repetitivas"""
+import pandas as pd
+
+# Colunas de texto com até esta proporção de valores distintos viram categorias
+LIMIAR_CARDINALIDADE = 0.5
+
+# Tabelas menores não compensam o custo da codificação
+MIN_LINHAS_CATEGORIAS = 1_000
+
+# Linhas usadas para descartar cedo as colunas com muitos valores distintos
+LINHAS_AMOSTRA_CARDINALIDADE = 10_000
+
+
+def _eh_texto(serie):
+    return serie.dtype == object or isinstance(serie.dtype, pd.StringDtype)
+
+
+def codificar_categorias(df, limiar=LIMIAR_CARDINALIDADE, minimo_linhas=MIN_LINHAS_CATEGORIAS):
+    """Troca as colunas de texto de baixa cardinalidade por categorias.
+
+    Uma coluna como UF, situação ou categoria passa a guardar cada texto uma
+    única vez, mais um código inteiro por linha. A chave também é
+    codificada: `IndiceOrigem` confere os tipos pelos valores decodificados.
+    As categorias seguem pelo merge e só voltam a texto na gravação.
+    """
+    if len(df) < minimo_linhas:
+        return df
+    convertidas = {}
+    for coluna in df.columns:
+        serie = df[coluna]
+        if not isinstance(serie, pd.Series) or not _eh_texto(serie):
+            continue
+        amostra = serie.iloc[:LINHAS_AMOSTRA_CARDINALIDADE]
+        if amostra.nunique(dropna=False) > limiar * len(amostra):
+            continue
+        if serie.nunique(dropna=False) <= limiar * len(serie):
+            convertidas[coluna] = serie.astype('category')
+    return _atribuir(df, convertidas) if convertidas else df
+
+
+def _atribuir(df, colunas):
+    """Cópia do DataFrame com as colunas substituídas"""
+    df = df.copy()
+    for coluna, serie in colunas.items():
+        df[coluna] = serie
+    return df
+
+
+def decodificar_categorias(df):
+    """Devolve as colunas categóricas ao tipo original dos seus valores"""
+    colunas = {coluna: serie.astype(serie.cat.categories.dtype)
+               for coluna, serie in df.items() if isinstance(serie.dtype, pd.CategoricalDtype)}
+    return _atribuir(df, colunas) if colunas else df
+
+
+def concatenar(partes, **opcoes):
+    """`pd.concat` que preserva as categorias das colunas categóricas em todas as partes.
+
+    O pandas devolve texto comum quando as categorias das partes diferem;
+    aqui elas são unificadas antes. Colunas categóricas em apenas algumas
+    partes voltam ao tipo original.
+    """
+    partes = list(partes)
+    if len(partes) < 2:
+        return pd.concat(partes, **opcoes)
+    comuns = None
+    for parte in partes:
+        categoricas = {coluna for coluna, serie in parte.items() if isinstance(serie.dtype, pd.CategoricalDtype)}
+        comuns = categoricas if comuns is None else comuns & categoricas
+    categorias = {}
+    for coluna in comuns:
+        todas = partes[0][coluna].cat.categories
+        for parte in partes[1:]:
+            todas = todas.append(parte[coluna].cat.categories.difference(todas))
+        categorias[coluna] = todas
+
+    ajustadas = []
+    for parte in partes:
+        colunas = {}
+        for coluna, serie in parte.items():
+            if not isinstance(serie.dtype, pd.CategoricalDtype):
+                continue
+            if coluna in categorias:
+                colunas[coluna] = serie.cat.set_categories(categorias[coluna])
+            else:
+                colunas[coluna] = serie.astype(serie.cat.categories.dtype)
+        ajustadas.append(_atribuir(parte, colunas) if colunas else parte)
+    return pd.concat(ajustadas, **opcoes)
@@ -0,0 +1,143 @@
+"""Linha de comando do SAFE: vinculação sem interface gráfica, para scripts e agendamentos.
+
+Exemplo:
+    python cli.py origem.xlsx destino.csv -c CPF --copiar NOME EMAIL -o destino_vinculado.csv
+
+As estatísticas (linhas, correspondências, motor e tempos por etapa) saem
+em JSON na saída padrão; o andamento vai para a saída de erros. O código
+de saída é 0 em caso de sucesso e 1 em caso de erro. O andamento de cada
+etapa (linhas, velocidade e tempo restante) é mostrado a cada segundo.
+
+Com `--salvar-trabalho`, a configuração é gravada num arquivo de trabalho;
+`--trabalho` reexecuta o arquivo salvo e pula a vinculação quando origem,
+destino, configuração e saída não mudaram desde a última execução:
+    python cli.py origem.xlsx destino.csv -c CPF --copiar NOME --salvar-trabalho diario.safe.json
+    python cli.py --trabalho diario.safe.json
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from aproximacao import LIMIAR_SIMILARIDADE
+from cache import ORCAMENTO_CACHE_MB, cache_dataframes
+from estimativa import MOTORES_VINCULACAO
+from escrita import MOTORES_ESCRITA
+from leitura import MOTORES_LEITURA
+from normalizacao import ETAPAS_NORMALIZACAO, NormalizacaoChave
+from particionado import LIMITE_MEMORIA_MB
+from vinculacao import POLITICAS_DUPLICADAS
+from trabalhos import reexecutar_trabalho, salvar_trabalho
+from vinculador import TrabalhoVinculacao, Vinculador
+
+# Intervalo mínimo (s) entre duas linhas de andamento da mesma etapa
+INTERVALO_ANDAMENTO = 1.0
+
+
+def criar_parser():
+    """Argumentos aceitos pela linha de comando"""
+    parser = argparse.ArgumentParser(
+        prog='safe', description="Vincula colunas de um arquivo origem a um arquivo destino pela coluna-chave.")
+    parser.add_argument('origem', nargs='?',
+                        help="Arquivo origem (.xlsx, .xls ou .csv), de onde as colunas são copiadas")
+    parser.add_argument('destino', nargs='?', help="Arquivo destino, que recebe as colunas")
+    parser.add_argument('-o', '--saida', help="Arquivo de saída (padrão: <destino>_vinculado ao lado do destino)")
+    parser.add_argument('-c', '--chave', nargs='+',
+                        help="Coluna(s)-chave da origem; várias colunas formam uma chave composta")
+    parser.add_argument('--chave-destino', nargs='+',
+                        help="Coluna(s)-chave do destino, na mesma ordem (padrão: as mesmas da origem)")
+    parser.add_argument('--copiar', nargs='+', help="Colunas da origem copiadas para o destino")
+    parser.add_argument('--pular-origem', type=int, default=0, help="Linhas iniciais ignoradas na origem")
+    parser.add_argument('--pular-destino', type=int, default=0, help="Linhas iniciais ignoradas no destino")
+    parser.add_argument('--planilha-origem', help="Planilha do Excel da origem ('*' para todas)")
+    parser.add_argument('--planilha-destino', help="Planilha do Excel do destino ('*' para todas)")
+    parser.add_argument('--duplicadas', choices=list(POLITICAS_DUPLICADAS.values()), default='primeira',
+                        help="Política para chaves repetidas na origem")
+    parser.add_argument('--normalizar', nargs='+', choices=list(ETAPAS_NORMALIZACAO), default=[],
+                        help="Etapas de normalização das chaves")
+    parser.add_argument('--zeros', type=int, default=0, help="Completa as chaves com zeros à esquerda")
+    parser.add_argument('--similaridade', type=int, nargs='?', const=LIMIAR_SIMILARIDADE,
+                        help="Ativa a correspondência aproximada com a nota mínima indicada (0 a 100)")
+    parser.add_argument('--ordenados', action='store_true',
+                        help="Arquivos já ordenados pela chave: tenta a intercalação numa única passada")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Reaproveita a execução anterior e vincula só as linhas novas ou alteradas")
+    parser.add_argument('--motor', choices=['auto'] + list(MOTORES_VINCULACAO), default='auto',
+                        help="Motor de vinculação (padrão: escolhido pela estimativa)")
+    parser.add_argument('--motor-leitura', choices=list(MOTORES_LEITURA.values()), default='auto')
+    parser.add_argument('--motor-escrita', choices=list(MOTORES_ESCRITA.values()), default='auto')
+    parser.add_argument('--limite-memoria', type=int, default=LIMITE_MEMORIA_MB, help="Limite de memória (MB)")
+    parser.add_argument('--cache-mb', type=int, default=ORCAMENTO_CACHE_MB, help="Cache de planilhas (MB)")
+    parser.add_argument('--cache-disco', action='store_true', help="Guarda em disco as planilhas Excel lidas")
+    parser.add_argument('--sem-indice-disco', action='store_true', help="Não guarda em disco o índice da origem")
+    parser.add_argument('--salvar-trabalho', metavar='ARQUIVO',
+                        help="Grava a configuração num arquivo de trabalho antes de executar")
+    parser.add_argument('--trabalho', metavar='ARQUIVO',
+                        help="Reexecuta um arquivo de trabalho salvo, pulando-o se nada mudou")
+    parser.add_argument('--forcar', action='store_true', help="Com --trabalho, vincula mesmo sem alterações")
+    return parser
+
+
+def main(argumentos=None):
+    """Executa a vinculação e imprime as estatísticas em JSON; devolve o código de saída"""
+    parser = criar_parser()
+    opcoes = parser.parse_args(argumentos)
+    if not opcoes.trabalho and not (opcoes.origem and opcoes.destino and opcoes.chave and opcoes.copiar):
+        parser.error("informe origem, destino, --chave e --copiar, ou um arquivo com --trabalho")
+    if opcoes.similaridade is not None and not 0 <= opcoes.similaridade <= 100:
+        print(json.dumps({'sucesso': False, 'erro': "A similaridade mínima deve ser de 0 a 100"},
+                         ensure_ascii=False))
+        return 1
+
+    def informar(mensagem):
+        print(mensagem, file=sys.stderr)
+
+    ultimo = {'etapa': None, 'feito': None, 'instante': 0.0}
+
+    def mostrar_andamento(andamento):
+        # Sempre no início e no fim de cada etapa; no meio, uma linha por intervalo
+        agora = time.monotonic()
+        if andamento.etapa == ultimo['etapa'] and (
+                andamento.feito == ultimo['feito']
+                or (andamento.fracao != 1 and agora - ultimo['instante'] < INTERVALO_ANDAMENTO)):
+            return
+        ultimo.update(etapa=andamento.etapa, feito=andamento.feito, instante=agora)
+        informar(str(andamento))
+
+    try:
+        cache_dataframes.definir_orcamento(opcoes.cache_mb)
+        vinculador = Vinculador(ao_informar=informar, ao_andamento=mostrar_andamento)
+        if opcoes.trabalho:
+            execucao = reexecutar_trabalho(opcoes.trabalho, vinculador, opcoes.forcar)
+            if execucao.reaproveitado:
+                informar("Nada mudou desde a última execução; resultado anterior reaproveitado")
+            estatisticas = execucao.como_dict()
+        else:
+            trabalho = TrabalhoVinculacao(
+                opcoes.origem, opcoes.destino, opcoes.chave, opcoes.copiar, chaves=opcoes.chave_destino,
+                saida=opcoes.saida, skip_origem=opcoes.pular_origem, skip_destino=opcoes.pular_destino,
+                planilha_origem=opcoes.planilha_origem, planilha_destino=opcoes.planilha_destino,
+                politica=opcoes.duplicadas, normalizacao=NormalizacaoChave(opcoes.normalizar, opcoes.zeros),
+                similaridade=opcoes.similaridade, ordenados=opcoes.ordenados,
+                motor_leitura=opcoes.motor_leitura, motor_escrita=opcoes.motor_escrita,
+                motor_vinculacao=opcoes.motor, limite_mb=opcoes.limite_memoria, persistir=opcoes.cache_disco,
+                indice_disco=not opcoes.sem_indice_disco, selecao_manual=opcoes.chave_destino is not None,
+                incremental=opcoes.incremental)
+            if opcoes.salvar_trabalho:
+                # Executado pelo arquivo salvo, a execução já fica registrada para a próxima vez
+                salvar_trabalho(trabalho, opcoes.salvar_trabalho)
+                estatisticas = reexecutar_trabalho(opcoes.salvar_trabalho, vinculador, forcar=True).como_dict()
+            else:
+                estatisticas = vinculador.executar(trabalho).estatisticas.como_dict()
+    except Exception as e:
+        print(json.dumps({'sucesso': False, 'erro': str(e)}, ensure_ascii=False))
+        return 1
+    print(json.dumps({'sucesso': True, **estatisticas}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    # Necessário para o pool de processos no executável congelado do Windows
+    multiprocessing.freeze_support()
+    sys.exit(main())
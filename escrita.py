@@ -0,0 +1,85 @@
+"""Gravação do arquivo vinculado produzido pelo SAFE"""
+from leitura import eh_csv, eh_xlsx
+
+# Maior número de linhas (cabeçalho incluso) que uma planilha do Excel aceita
+LIMITE_LINHAS_EXCEL = 1_048_576
+
+# Linhas gravadas por vez e a partir de quantas linhas o modo automático usa streaming
+TAMANHO_BLOCO_ESCRITA = 50_000
+LIMIAR_ESCRITA_STREAMING = 100_000
+
+# Rótulos exibidos na interface para cada motor de gravação de Excel
+MOTORES_ESCRITA = {
+    'Automático': 'auto',
+    'Padrão (pandas)': 'pandas',
+    'Streaming (somente escrita)': 'streaming',
+}
+
+
+def escolher_motor_escrita(caminho, total_linhas, motor='auto'):
+    """Resolve o motor de gravação para o arquivo de saída.
+
+    O gravador streaming só produz .xlsx/.xlsm; no modo automático ele é
+    usado quando o resultado passa de `LIMIAR_ESCRITA_STREAMING` linhas.
+    """
+    if not eh_xlsx(caminho):
+        return 'pandas'
+    if motor == 'auto':
+        return 'streaming' if total_linhas >= LIMIAR_ESCRITA_STREAMING else 'pandas'
+    return motor
+
+
+def fatiar(df, tamanho=TAMANHO_BLOCO_ESCRITA):
+    """Divide o DataFrame em fatias consecutivas (ao menos uma, mesmo vazio)"""
+    for inicio in range(0, max(len(df), 1), tamanho):
+        yield df.iloc[inicio:inicio + tamanho]
+
+
+def escrever_xlsx_em_blocos(blocos, caminho, ao_progredir=None):
+    """Grava blocos de DataFrame numa planilha xlsx em modo somente escrita.
+
+    As linhas vão direto para o arquivo à medida que os blocos chegam, sem
+    montar o modelo de células do openpyxl, e `ao_progredir` recebe o total
+    de linhas já gravadas após cada bloco. Devolve o número de linhas.
+    """
+    from openpyxl import Workbook
+
+    livro = Workbook(write_only=True)
+    planilha = livro.create_sheet()
+    total = 0
+    cabecalho = False
+    for bloco in blocos:
+        if not cabecalho:
+            planilha.append(list(bloco.columns))
+            cabecalho = True
+        total += len(bloco)
+        if total + 1 > LIMITE_LINHAS_EXCEL:
+            raise ValueError(f"O resultado excede o limite de {LIMITE_LINHAS_EXCEL:,} linhas do Excel; "
+                             "salve em CSV")
+        # Categorias voltam ao valor original e ausentes viram células vazias, como no to_excel do pandas
+        valores = bloco.astype(object).where(bloco.notna(), None)
+        for linha in valores.itertuples(index=False, name=None):
+            planilha.append(linha)
+        if ao_progredir:
+            ao_progredir(total)
+    livro.save(caminho)
+    return total
+
+
+def salvar_dataframe(df, caminho, motor='auto', ao_progredir=None):
+    """Grava o DataFrame em CSV ou Excel, informando o progresso em linhas"""
+    if eh_csv(caminho):
+        with open(caminho, 'w', newline='', encoding='utf-8') as saida:
+            gravadas = 0
+            for numero, fatia in enumerate(fatiar(df)):
+                fatia.to_csv(saida, header=(numero == 0), index=False)
+                gravadas += len(fatia)
+                if ao_progredir:
+                    ao_progredir(gravadas)
+        return gravadas
+    if escolher_motor_escrita(caminho, len(df), motor) == 'streaming':
+        return escrever_xlsx_em_blocos(fatiar(df), caminho, ao_progredir)
+    df.to_excel(caminho, index=False)
+    if ao_progredir:
+        ao_progredir(len(df))
+    return len(df)
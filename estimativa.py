@@ -0,0 +1,161 @@
+"""Estimativa de memória e tempo antes da vinculação e escolha do motor"""
+import os
+
+from leitura import TODAS_PLANILHAS, colunas_origem, eh_csv, eh_xlsx, ler_arquivo
+from particionado import LIMITE_MEMORIA_MB, numero_particoes
+
+# Linhas lidas de cada arquivo para medir o tamanho médio de uma linha na memória
+LINHAS_AMOSTRA_ESTIMATIVA = 1_000
+
+# Início do CSV usado para estimar o número de linhas
+BYTES_AMOSTRA_CSV = 1024 * 1024
+
+# Tamanho médio de uma linha no disco quando o Excel não informa a dimensão da planilha
+BYTES_POR_LINHA_EXCEL = 60
+
+# Velocidades de referência para a estimativa de tempo
+MB_POR_SEGUNDO_CSV = 50
+CELULAS_POR_SEGUNDO_EXCEL = 150_000
+LINHAS_POR_SEGUNDO_MERGE = 2_000_000
+
+# Memória extra do pandas durante o merge (índices e cópias temporárias)
+FATOR_PICO = 1.5
+
+# Parte do limite que o índice da origem pode ocupar com o destino lido em blocos
+FRACAO_ORIGEM_BLOCOS = 0.5
+
+# Motores de vinculação e o rótulo exibido na interface
+MOTORES_VINCULACAO = {
+    'memoria': 'em memória',
+    'blocos': 'destino em blocos',
+    'disco': 'partições em disco',
+}
+
+
+def contar_linhas(caminho, skiprows=0, planilha=None):
+    """Número aproximado de linhas de dados do arquivo, sem abrir o corpo inteiro.
+
+    CSV: proporção de quebras de linha no primeiro MB (exato em arquivos
+    menores). xlsx: dimensão gravada em cada planilha. Nos demais casos,
+    o tamanho do arquivo dividido por um tamanho médio de linha.
+    """
+    tamanho = os.path.getsize(caminho)
+    if eh_csv(caminho):
+        with open(caminho, 'rb') as arquivo:
+            amostra = arquivo.read(BYTES_AMOSTRA_CSV)
+        if not amostra:
+            return 0
+        quebras = amostra.count(b'\n') + (0 if amostra.endswith(b'\n') else 1)
+        linhas = quebras if len(amostra) >= tamanho else round(tamanho * quebras / len(amostra))
+        return max(linhas - 1 - skiprows, 0)
+    if eh_xlsx(caminho):
+        from openpyxl import load_workbook
+
+        livro = load_workbook(caminho, read_only=True, keep_links=False)
+        try:
+            nomes = livro.sheetnames if planilha == TODAS_PLANILHAS else [planilha or livro.sheetnames[0]]
+            dimensoes = [livro[nome].max_row for nome in nomes]
+        finally:
+            livro.close()
+        if all(dimensao is not None for dimensao in dimensoes):
+            return sum(max(dimensao - 1 - skiprows, 0) for dimensao in dimensoes)
+    return tamanho // BYTES_POR_LINHA_EXCEL
+
+
+def medir_linha(caminho, skiprows=0, colunas=None, planilha=None):
+    """Bytes por linha na memória e número de colunas, medidos numa amostra"""
+    if planilha == TODAS_PLANILHAS:
+        planilha = None
+    amostra = ler_arquivo(caminho, skiprows, colunas, nrows=LINHAS_AMOSTRA_ESTIMATIVA, motor='pandas',
+                          planilha=planilha)
+    return amostra.memory_usage(deep=True, index=False).sum() / max(len(amostra), 1), len(amostra.columns)
+
+
+def _segundos_leitura(caminho, linhas, colunas):
+    if eh_csv(caminho):
+        return os.path.getsize(caminho) / (MB_POR_SEGUNDO_CSV * 1024 * 1024)
+    return linhas * colunas / CELULAS_POR_SEGUNDO_EXCEL
+
+
+def _formatar_tempo(segundos):
+    if segundos < 60:
+        return f"~{max(round(segundos), 1)} s"
+    if segundos < 3600:
+        return f"~{round(segundos / 60)} min"
+    return f"~{segundos / 3600:.1f} h"
+
+
+class Estimativa:
+    """Memória e tempo previstos para a vinculação e o motor escolhido.
+
+    `pico_mb` é o pico da vinculação feita inteiramente na memória (origem,
+    destino e resultado ao mesmo tempo). Abaixo de `limite_mb` o motor é
+    'memoria'; acima dele, 'blocos' quando só o índice da origem cabe com
+    folga e 'disco' (partições) quando nem ele cabe.
+    """
+
+    def __init__(self, linhas_origem, linhas_destino, origem_mb, destino_mb, resultado_mb, segundos,
+                 limite_mb=LIMITE_MEMORIA_MB):
+        self.linhas_origem = linhas_origem
+        self.linhas_destino = linhas_destino
+        self.origem_mb = origem_mb
+        self.destino_mb = destino_mb
+        self.resultado_mb = resultado_mb
+        self.segundos = segundos
+        self.limite_mb = limite_mb
+        self.pico_mb = (origem_mb + destino_mb + resultado_mb) * FATOR_PICO
+        if self.pico_mb <= limite_mb:
+            self.motor = 'memoria'
+        elif origem_mb * FATOR_PICO <= limite_mb * FRACAO_ORIGEM_BLOCOS:
+            self.motor = 'blocos'
+        else:
+            self.motor = 'disco'
+
+    @property
+    def particoes(self):
+        """Partições usadas pelo motor 'disco'"""
+        return numero_particoes(self.pico_mb, self.limite_mb)
+
+    def __str__(self):
+        return (f"Estimativa: {self.linhas_destino:,} linhas no destino, pico de ~{self.pico_mb:,.0f} MB, "
+                f"{_formatar_tempo(self.segundos)}; motor: {MOTORES_VINCULACAO[self.motor]}")
+
+    def detalhes(self):
+        """Texto de várias linhas para a confirmação antes da vinculação"""
+        return (f"• Origem: ~{self.linhas_origem:,} linhas (~{self.origem_mb:,.0f} MB na memória)\n"
+                f"• Destino: ~{self.linhas_destino:,} linhas (~{self.destino_mb:,.0f} MB na memória)\n"
+                f"• Pico em memória: ~{self.pico_mb:,.0f} MB (limite {self.limite_mb:,} MB)\n"
+                f"• Tempo estimado: {_formatar_tempo(self.segundos)}\n"
+                f"• Motor escolhido: {MOTORES_VINCULACAO[self.motor]}")
+
+
+def estimar(arquivo_origem, skip_origem, arquivo_destino, skip_destino, chaves_origem, colunas_selecionadas,
+            planilha_origem=None, planilha_destino=None, limite_mb=LIMITE_MEMORIA_MB):
+    """Amostra os dois arquivos e estima memória e tempo da vinculação.
+
+    Lê apenas o começo de cada arquivo: as colunas da origem usadas no
+    merge e todas as do destino, de onde saem o tamanho médio de uma linha
+    na memória e os tipos das colunas, e multiplica pelo número estimado de
+    linhas.
+    """
+    colunas = colunas_origem(chaves_origem, colunas_selecionadas)
+    linhas_origem = contar_linhas(arquivo_origem, skip_origem, planilha_origem)
+    linhas_destino = contar_linhas(arquivo_destino, skip_destino, planilha_destino)
+    bytes_origem, _ = medir_linha(arquivo_origem, skip_origem, colunas, planilha_origem)
+    bytes_destino, colunas_destino = medir_linha(arquivo_destino, skip_destino, planilha=planilha_destino)
+
+    mega = 1024 * 1024
+    origem_mb = linhas_origem * bytes_origem / mega
+    destino_mb = linhas_destino * bytes_destino / mega
+    # Cada linha do resultado leva as colunas do destino e as copiadas da origem
+    resultado_mb = linhas_destino * (bytes_destino + bytes_origem * len(colunas_selecionadas) / len(colunas)) / mega
+
+    colunas_resultado = colunas_destino + len(colunas_selecionadas)
+    segundos = (_segundos_leitura(arquivo_origem, linhas_origem, len(colunas))
+                + _segundos_leitura(arquivo_destino, linhas_destino, colunas_destino)
+                + linhas_destino / LINHAS_POR_SEGUNDO_MERGE)
+    if eh_csv(arquivo_destino):
+        segundos += resultado_mb / MB_POR_SEGUNDO_CSV
+    else:
+        segundos += linhas_destino * colunas_resultado / CELULAS_POR_SEGUNDO_EXCEL
+    return Estimativa(linhas_origem, linhas_destino, origem_mb, destino_mb, resultado_mb, segundos, limite_mb)
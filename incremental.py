@@ -0,0 +1,419 @@
+"""Vinculação incremental: só as linhas do destino novas ou alteradas são vinculadas de novo"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from cache import DIRETORIO_CACHE_DISCO, LIMITE_CACHE_DISCO_MB, limitar_diretorio
+from leitura import eh_csv
+from vinculacao import TAMANHO_BLOCO_CSV, ResultadoStreaming
+
+# Pasta do estado guardado entre uma execução e a seguinte
+DIRETORIO_INCREMENTAL = DIRETORIO_CACHE_DISCO / 'incremental'
+
+# Versão do estado gravado; estados de outra versão são ignorados
+VERSAO_ESTADO = 2
+
+# Bytes copiados por vez do resultado anterior
+TAMANHO_COPIA = 1024 * 1024
+
+# Opções do trabalho que não mudam o resultado e não invalidam o estado anterior
+_OPCOES_NEUTRAS = ('saida', 'motor_leitura', 'motor_escrita', 'motor_vinculacao', 'limite_mb', 'persistir',
+                   'indice_disco', 'selecao_manual', 'incremental')
+
+
+def impressao_linhas(df):
+    """Hash de cada linha do DataFrame, com todas as colunas"""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def impressao_origem(indice, bloco):
+    """Hash da linha da origem encontrada para cada linha do bloco do destino (0 sem correspondência).
+
+    A consulta usa as mesmas chaves do join, então uma linha cuja chave teve
+    os valores alterados, incluídos ou removidos na origem muda de hash.
+    Exige chave única na origem. As posições vêm de `get_indexer`, pois um
+    `reindex` com chaves ausentes passaria os hashes a decimal e os
+    arredondaria.
+    """
+    if len(indice.tabela.columns):
+        valores = impressao_linhas(indice.tabela)
+    else:
+        valores = np.ones(len(indice.tabela), dtype=np.uint64)
+    posicoes = indice.tabela.index.get_indexer(indice.chaves_consulta(bloco))
+    return np.where(posicoes >= 0, valores[posicoes], np.uint64(0))
+
+
+def _tipos(destino, indice):
+    """Colunas e tipos dos dois lados: mudá-los muda o resultado mesmo com os valores iguais"""
+    return {
+        'destino': [(str(coluna), str(tipo)) for coluna, tipo in destino.dtypes.items()],
+        'origem': [(str(coluna), str(tipo)) for coluna, tipo in indice.tabela.dtypes.items()],
+    }
+
+
+def _eh_texto(tipo):
+    return (pd.api.types.is_object_dtype(tipo) or pd.api.types.is_string_dtype(tipo)
+            or isinstance(tipo, pd.CategoricalDtype))
+
+
+def _ajustar_tipos(parte, tipos):
+    """Converte as linhas vinculadas agora aos tipos do resultado anterior.
+
+    As linhas reaproveitadas são copiadas como estavam no CSV, então as novas
+    precisam ser escritas com os mesmos tipos (inteiros que viraram decimais
+    por causa de vazios, por exemplo). Devolve None quando os tipos não se
+    conciliam e as linhas anteriores teriam de ser reescritas.
+    """
+    if not len(parte):
+        return parte
+    if [str(coluna) for coluna in parte.columns] != [coluna for coluna, _ in tipos]:
+        return None
+    ajustes = {}
+    for posicao, (atual, (_, anterior)) in enumerate(zip(parte.dtypes, tipos)):
+        if atual == anterior or (_eh_texto(atual) and _eh_texto(anterior)):
+            continue
+        try:
+            comum = np.result_type(atual, anterior)
+        except TypeError:
+            return None
+        if comum != anterior:
+            return None
+        ajustes[posicao] = anterior
+    if not ajustes:
+        return parte
+    parte = parte.copy()
+    for posicao, tipo in ajustes.items():
+        parte.isetitem(posicao, parte.iloc[:, posicao].astype(tipo))
+    return parte
+
+
+def _fins_das_linhas(dados, bloco):
+    """Posição do fim de cada linha do bloco em `dados`, o CSV do bloco sem cabeçalho (None se não conferir).
+
+    Textos com quebra de linha vão entre aspas no CSV, então cada linha
+    termina na quebra seguinte às suas quebras internas.
+    """
+    quebras = np.flatnonzero(np.frombuffer(dados, dtype=np.uint8) == ord('\n')) + 1
+    if len(quebras) == len(bloco):
+        return quebras
+    por_linha = np.ones(len(bloco), dtype=np.int64)
+    for posicao, tipo in enumerate(bloco.dtypes):
+        if _eh_texto(tipo):
+            internas = bloco.iloc[:, posicao].astype('string').str.count('\n')
+            por_linha += internas.fillna(0).to_numpy(dtype=np.int64)
+    if por_linha.sum() != len(quebras):
+        return None
+    return quebras[np.cumsum(por_linha) - 1]
+
+
+class _LinhasNovas:
+    """Linhas vinculadas nesta execução, convertidas em CSV aos blocos e gravadas na ordem pedida"""
+
+    def __init__(self, df, tamanho_bloco=TAMANHO_BLOCO_CSV):
+        self.df = df
+        self.tamanho_bloco = tamanho_bloco
+        self._proxima = 0
+        self._dados = b''
+        self._inicios = np.zeros(1, dtype=np.int64)
+        self._linha = 0
+
+    def _converter(self):
+        bloco = self.df.iloc[self._proxima:self._proxima + self.tamanho_bloco]
+        if not len(bloco):
+            raise ValueError("Faltaram linhas vinculadas para montar o resultado")
+        self._proxima += len(bloco)
+        self._dados = bloco.to_csv(header=False, index=False).encode('utf-8')
+        fins = _fins_das_linhas(self._dados, bloco)
+        if fins is None:
+            # Sem como separar as linhas do bloco, cada uma é convertida sozinha
+            linhas = [bloco.iloc[[numero]].to_csv(header=False, index=False).encode('utf-8')
+                      for numero in range(len(bloco))]
+            self._dados = b''.join(linhas)
+            fins = np.cumsum([len(linha) for linha in linhas])
+        self._inicios = np.concatenate(([0], fins)).astype(np.int64)
+        self._linha = 0
+
+    def escrever(self, saida, quantidade):
+        """Grava as próximas `quantidade` linhas; devolve o tamanho em bytes de cada uma"""
+        tamanhos = []
+        while quantidade:
+            if self._linha == len(self._inicios) - 1:
+                self._converter()
+            fim = min(len(self._inicios) - 1, self._linha + quantidade)
+            saida.write(self._dados[self._inicios[self._linha]:self._inicios[fim]])
+            tamanhos.append(np.diff(self._inicios[self._linha:fim + 1]))
+            quantidade -= fim - self._linha
+            self._linha = fim
+        return np.concatenate(tamanhos) if tamanhos else np.zeros(0, dtype=np.int64)
+
+
+def _copiar(anterior, saida, inicio, fim):
+    """Copia os bytes [inicio, fim) do resultado anterior"""
+    anterior.seek(inicio)
+    restante = fim - inicio
+    while restante:
+        pedaco = anterior.read(min(restante, TAMANHO_COPIA))
+        if not pedaco:
+            raise ValueError("O resultado anterior terminou antes do esperado")
+        saida.write(pedaco)
+        restante -= len(pedaco)
+
+
+def _trechos(fonte):
+    """Trechos contínuos da saída: linhas novas seguidas ou linhas anteriores consecutivas"""
+    if not len(fonte):
+        return []
+    novas = fonte < 0
+    quebra = np.ones(len(fonte), dtype=bool)
+    quebra[1:] = (novas[1:] != novas[:-1]) | (~novas[1:] & (fonte[1:] != fonte[:-1] + 1))
+    inicios = np.flatnonzero(quebra)
+    return zip(inicios, np.append(inicios[1:], len(fonte)))
+
+
+class ResultadoIncremental(ResultadoStreaming):
+    """Resultado da vinculação incremental, montado num CSV temporário.
+
+    `inicios` é a posição em bytes de cada linha no CSV (e o tamanho do
+    arquivo no fim). Com saída em CSV, o próprio arquivo gravado serve de
+    base à próxima execução; nos demais formatos, o CSV é guardado em
+    `caminho_base`, junto do estado. `base` indica onde ele ficou.
+    """
+
+    def __init__(self, caminho_temporario, total_linhas, correspondidas, tipos, sem_correspondencia, inicios,
+                 caminho_base):
+        super().__init__(caminho_temporario, total_linhas, correspondidas, tipos, sem_correspondencia)
+        self.inicios = inicios
+        self.caminho_base = caminho_base
+        self.base = None
+
+    def salvar(self, caminho_saida, motor='auto', ao_progredir=None):
+        if eh_csv(caminho_saida):
+            super().salvar(caminho_saida, motor, ao_progredir)
+            self.base = os.path.abspath(caminho_saida)
+            return
+        try:
+            self._gravar_excel(caminho_saida, motor, ao_progredir)
+            os.makedirs(os.path.dirname(self.caminho_base), exist_ok=True)
+            shutil.move(self.caminho_temporario, self.caminho_base)
+            self.base = str(self.caminho_base)
+        finally:
+            self.descartar()
+
+
+class VinculacaoIncremental:
+    """Vinculação que reaproveita o resultado da execução anterior do mesmo trabalho.
+
+    Guarda, por linha do destino, o hash da linha inteira, o hash da linha
+    da origem encontrada pela chave e a posição da linha no CSV do
+    resultado, que é a própria saída (ou, com saída em Excel, uma cópia
+    junto do estado). Na execução seguinte, as linhas do destino são
+    casadas com as anteriores pelo hash (inserções, exclusões e mudanças de
+    ordem são toleradas) e só passam pelo join as linhas novas ou alteradas
+    e aquelas cuja linha da origem mudou; o novo CSV é montado copiando os
+    trechos inalterados do anterior. O estado fica no cache em disco,
+    identificado pelo destino e pelas opções que afetam o resultado, e só é
+    gravado por `registrar`, depois da saída. Sem o CSV anterior intacto
+    (apagado ou editado), a vinculação é completa.
+
+    Aplica-se ao join exato com chave única na origem, em que cada linha do
+    destino gera uma linha do resultado; com chaves repetidas multiplicadas
+    a vinculação é completa e nenhum estado é guardado.
+    """
+
+    def __init__(self, trabalho, diretorio=DIRETORIO_INCREMENTAL):
+        self.trabalho = trabalho
+        self.diretorio = diretorio
+        configuracao = {chave: valor for chave, valor in trabalho.como_dict().items() if chave not in _OPCOES_NEUTRAS}
+        configuracao['arquivo_destino'] = os.path.abspath(trabalho.arquivo_destino)
+        texto = json.dumps(configuracao, sort_keys=True, ensure_ascii=False, default=str)
+        self.caminho_estado = diretorio / f"{hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()}.pkl"
+        self.caminho_base = self.caminho_estado.with_suffix('.csv')
+        self._novo_estado = None
+        self._resultado = None
+
+    def _ler_estado(self):
+        if not self.caminho_estado.exists():
+            return None
+        try:
+            estado = pd.read_pickle(self.caminho_estado)
+            if estado.get('versao') != VERSAO_ESTADO:
+                raise ValueError("estado de outra versão")
+        except Exception:
+            # Estado corrompido ou de outra versão: a vinculação será completa
+            self._apagar_estado()
+            return None
+        return estado
+
+    def _apagar_estado(self):
+        self.caminho_estado.unlink(missing_ok=True)
+        self.caminho_base.unlink(missing_ok=True)
+
+    @staticmethod
+    def _base_intacta(estado):
+        """Se o CSV do resultado anterior continua no lugar, com o mesmo tamanho e data"""
+        base = estado['base']
+        try:
+            informacoes = os.stat(base['caminho'])
+        except OSError:
+            return False
+        return (informacoes.st_size, informacoes.st_mtime_ns) == (base['tamanho'], base['modificado'])
+
+    def vincular(self, vinculador, estatisticas):
+        """Vincula o destino reaproveitando a execução anterior.
+
+        Devolve o `ResultadoIncremental` ou, com chaves repetidas
+        multiplicadas, o DataFrame da vinculação completa.
+        """
+        trabalho = self.trabalho
+        vinculador.informar("⚙️ Carregando origem e destino...")
+        (indice, estatisticas.duplicadas), destino = vinculador.carregar(trabalho)
+        for coluna in trabalho.chaves:
+            if coluna not in destino.columns:
+                raise ValueError(f"Coluna-chave '{coluna}' não encontrada em um dos arquivos")
+        if not indice.chave_unica:
+            vinculador.informar("⚠️ Chaves repetidas multiplicam as linhas: vinculando o destino inteiro...")
+            antes = indice.correspondidas, indice.sem_correspondencia
+            vinculador.progresso.iniciar('vinculacao', len(destino))
+            resultado = indice.enriquecer(destino)
+            vinculador.progresso.atualizar(len(destino))
+            estatisticas.correspondidas = indice.correspondidas - antes[0]
+            estatisticas.sem_correspondencia = indice.sem_correspondencia - antes[1]
+            self._apagar_estado()
+            return resultado
+
+        linhas = impressao_linhas(destino)
+        origem = impressao_origem(indice, destino)
+        tipos = _tipos(destino, indice)
+        # Linha do resultado anterior reaproveitada por cada linha do destino (-1: vincular de novo)
+        fonte = np.full(len(destino), -1, dtype=np.int64)
+        estado = self._ler_estado()
+        if estado is not None and estado['tipos'] == tipos and self._base_intacta(estado):
+            anteriores = self._casar_linhas(linhas, estado['linhas'])
+            casadas = np.flatnonzero(anteriores >= 0)
+            mantidas = casadas[estado['origem'][anteriores[casadas]] == origem[casadas]]
+            fonte[mantidas] = anteriores[mantidas]
+        else:
+            estado = None
+
+        novas = np.flatnonzero(fonte < 0)
+        vinculador.informar(f"⚙️ Vinculando {len(novas):,} linha(s) novas ou alteradas "
+                            f"({len(destino) - len(novas):,} reaproveitada(s))...")
+        parte = indice.enriquecer(destino.iloc[novas])
+        if estado is not None:
+            ajustada = _ajustar_tipos(parte, estado['resultado'])
+            if ajustada is None:
+                vinculador.informar("⚠️ Os tipos das colunas do resultado mudaram: vinculando o destino inteiro...")
+                estado = None
+                fonte[:] = -1
+                parte = indice.enriquecer(destino)
+            else:
+                parte = ajustada
+        if estado is not None:
+            tipos_resultado = estado['resultado']
+        else:
+            tipos_resultado = [(str(coluna), tipo) for coluna, tipo in parte.dtypes.items()]
+
+        # A barra acompanha a montagem do CSV, linha a linha do destino
+        vinculador.progresso.iniciar('vinculacao', len(destino))
+        caminho_temporario, inicios = self._montar_csv(parte, fonte, estado, vinculador.progresso.atualizar)
+        correspondidas = int((origem != 0).sum())
+        self._resultado = ResultadoIncremental(caminho_temporario, len(destino), correspondidas,
+                                               dict(tipos_resultado), len(destino) - correspondidas, inicios,
+                                               self.caminho_base)
+        estatisticas.correspondidas = correspondidas
+        estatisticas.sem_correspondencia = len(destino) - correspondidas
+        estatisticas.reaproveitadas = int((fonte >= 0).sum())
+        self._novo_estado = {'versao': VERSAO_ESTADO, 'tipos': tipos, 'linhas': linhas, 'origem': origem,
+                             'resultado': tipos_resultado}
+        return self._resultado
+
+    def _montar_csv(self, parte, fonte, estado, ao_progredir=None):
+        """Grava o novo resultado num CSV temporário ao lado do destino.
+
+        Os trechos reaproveitados são copiados em bytes do CSV anterior e as
+        linhas de `parte` entram, em ordem, nas posições em que `fonte` é -1.
+        `ao_progredir` recebe o total de linhas já gravadas. Devolve o
+        caminho e a posição de cada linha no arquivo.
+        """
+        descritor, caminho_temporario = tempfile.mkstemp(
+            suffix='.csv', prefix='.safe_', dir=os.path.dirname(os.path.abspath(self.trabalho.arquivo_destino)))
+        inicios = np.zeros(len(fonte) + 1, dtype=np.int64)
+        novas = _LinhasNovas(parte)
+        anterior = open(estado['base']['caminho'], 'rb') if estado is not None else None
+        try:
+            with os.fdopen(descritor, 'wb') as saida:
+                if anterior is not None:
+                    inicios_anteriores = estado['inicios']
+                    _copiar(anterior, saida, 0, inicios_anteriores[0])
+                    posicao = int(inicios_anteriores[0])
+                else:
+                    cabecalho = parte.iloc[:0].to_csv(index=False).encode('utf-8')
+                    saida.write(cabecalho)
+                    posicao = len(cabecalho)
+                for inicio, fim in _trechos(fonte):
+                    if fonte[inicio] < 0:
+                        tamanhos = novas.escrever(saida, fim - inicio)
+                    else:
+                        primeira = fonte[inicio]
+                        trecho = inicios_anteriores[primeira:primeira + fim - inicio + 1]
+                        _copiar(anterior, saida, trecho[0], trecho[-1])
+                        tamanhos = np.diff(trecho)
+                    inicios[inicio:fim] = posicao + np.cumsum(tamanhos) - tamanhos
+                    posicao += int(tamanhos.sum())
+                    if ao_progredir:
+                        ao_progredir(fim)
+                inicios[-1] = posicao
+        except Exception:
+            os.remove(caminho_temporario)
+            raise
+        finally:
+            if anterior is not None:
+                anterior.close()
+        return caminho_temporario, inicios
+
+    @staticmethod
+    def _casar_linhas(linhas, linhas_anteriores):
+        """Posição no resultado anterior de cada linha do destino atual (-1 se nova ou alterada).
+
+        Linhas idênticas repetidas são casadas pela ordem de ocorrência.
+        """
+        comuns = min(len(linhas), len(linhas_anteriores))
+        if np.array_equal(linhas[:comuns], linhas_anteriores[:comuns]):
+            # Caso comum: destino igual ou com linhas só acrescentadas ou removidas no fim
+            posicoes = np.full(len(linhas), -1, dtype=np.int64)
+            posicoes[:comuns] = np.arange(comuns, dtype=np.int64)
+            return posicoes
+        atuais = pd.DataFrame({'hash': linhas})
+        atuais['ocorrencia'] = atuais.groupby('hash').cumcount()
+        antigas = pd.DataFrame({'hash': linhas_anteriores})
+        antigas['ocorrencia'] = antigas.groupby('hash').cumcount()
+        antigas['posicao'] = np.arange(len(antigas), dtype=np.int64)
+        posicoes = atuais.merge(antigas, on=['hash', 'ocorrencia'], how='left')['posicao']
+        return posicoes.fillna(-1).to_numpy(dtype=np.int64)
+
+    def registrar(self):
+        """Guarda o estado desta execução; chamado depois que a saída foi gravada"""
+        if self._novo_estado is None or self._resultado is None or self._resultado.base is None:
+            return
+        base = self._resultado.base
+        if base != str(self.caminho_base):
+            # A saída em CSV passou a ser a base: a cópia de uma execução anterior não serve mais
+            self.caminho_base.unlink(missing_ok=True)
+        informacoes = os.stat(base)
+        estado = dict(self._novo_estado, inicios=self._resultado.inicios,
+                      base={'caminho': base, 'tamanho': informacoes.st_size, 'modificado': informacoes.st_mtime_ns})
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(suffix='.pkl', prefix='.safe_', dir=self.diretorio)
+        os.close(descritor)
+        try:
+            pd.to_pickle(estado, temporario)
+            os.replace(temporario, self.caminho_estado)
+        except Exception:
+            os.remove(temporario)
+            raise
+        limitar_diretorio(self.diretorio, '*', LIMITE_CACHE_DISCO_MB * 1024 * 1024)
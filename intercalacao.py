@@ -0,0 +1,145 @@
+"""Vinculação por intercalação (sort-merge) de arquivos já ordenados pela chave"""
+import os
+import tempfile
+
+import pandas as pd
+
+from leitura import colunas_origem, eh_csv, ler_em_blocos, obter_metadados
+from vinculacao import (TAMANHO_BLOCO_CSV, IndiceOrigem, RelatorioDuplicadas, ResultadoStreaming,
+                        conferir_colunas)
+
+
+class ForaDeOrdem(Exception):
+    """Um dos arquivos não está em ordem crescente da chave"""
+
+
+def _verificar_ordem(chaves, anterior, arquivo):
+    """Confere se as chaves do bloco seguem em ordem crescente desde o bloco anterior"""
+    if isinstance(chaves.dtype, pd.CategoricalDtype):
+        chaves = chaves.astype(chaves.cat.categories.dtype)
+    try:
+        ordenadas = chaves.is_monotonic_increasing and (anterior is None or len(chaves) == 0
+                                                         or not chaves.iloc[0] < anterior)
+    except TypeError:
+        ordenadas = False
+    if not ordenadas:
+        raise ForaDeOrdem(f"O arquivo {arquivo} não está ordenado pela chave")
+
+
+class _OrigemOrdenada:
+    """Percorre a origem ordenada em blocos, com a política de repetidas já aplicada.
+
+    As linhas da última chave de cada bloco ficam retidas até o bloco
+    seguinte, para que cada grupo de chaves repetidas chegue inteiro à
+    política. Os relatórios de cada bloco são somados ao final.
+    """
+
+    def __init__(self, blocos, chave, politica, arquivo):
+        self.blocos = blocos
+        self.chave = chave
+        self.politica = politica
+        self.arquivo = arquivo
+        self.relatorios = []
+
+    def __iter__(self):
+        pendente = None
+        for bloco in self.blocos:
+            if pendente is not None:
+                bloco = pd.concat([pendente, bloco], ignore_index=True)
+            _verificar_ordem(bloco[self.chave], None, self.arquivo)
+            if bloco.empty:
+                continue
+            completas = bloco[self.chave] != bloco[self.chave].iloc[-1]
+            pendente = bloco[~completas]
+            yield self._tratar(bloco[completas])
+        if pendente is not None:
+            yield self._tratar(pendente)
+
+    def _tratar(self, bloco):
+        indice, relatorio = IndiceOrigem(bloco, self.chave).tratar_duplicadas(self.politica)
+        self.relatorios.append(relatorio)
+        return indice.tabela
+
+    def relatorio(self):
+        return RelatorioDuplicadas.somar(self.relatorios, self.politica)
+
+
+def merge_ordenado(arquivo_origem, skip_origem, arquivo_destino, skip_destino, chave_origem, chave,
+                   colunas_selecionadas, politica='primeira', planilha_origem=None, planilha_destino=None,
+                   tamanho_bloco=TAMANHO_BLOCO_CSV, ao_progredir=None):
+    """Vincula dois arquivos ordenados pela chave numa única passada por cada um.
+
+    Origem e destino são lidos em blocos, em paralelo como numa intercalação:
+    só ficam na memória um bloco do destino e as linhas da origem entre a
+    menor e a maior chave desse bloco. A ordem crescente é conferida durante
+    a leitura; se um dos arquivos sair de ordem, levanta `ForaDeOrdem` e o
+    chamador deve usar o caminho por índice (hash). O resultado é anexado a
+    um CSV temporário e devolvido como `ResultadoStreaming`, junto com o
+    `RelatorioDuplicadas` (ou None). Aceita apenas chaves de uma coluna.
+    `ao_progredir` recebe, a cada bloco, o total de linhas do destino já vinculadas.
+    """
+    planilha_origem = None if eh_csv(arquivo_origem) else planilha_origem
+    planilha_destino = None if eh_csv(arquivo_destino) else planilha_destino
+    colunas = colunas_origem(chave_origem, colunas_selecionadas)
+    conferir_colunas(obter_metadados(arquivo_origem).cabecalho(skip_origem, planilha_origem),
+                     obter_metadados(arquivo_destino).cabecalho(skip_destino, planilha_destino),
+                     [chave_origem], [chave], colunas_selecionadas)
+
+    blocos_origem = (bloco.rename(columns={chave_origem: chave})
+                     for bloco in ler_em_blocos(arquivo_origem, skip_origem, colunas, tamanho_bloco,
+                                                planilha=planilha_origem))
+    origem = _OrigemOrdenada(blocos_origem, chave, politica, arquivo_origem)
+    partes = iter(origem)
+    janela = None
+    esgotada = False
+
+    descritor, caminho_temporario = tempfile.mkstemp(
+        suffix='.csv', prefix='.safe_', dir=os.path.dirname(os.path.abspath(arquivo_destino)))
+    total_linhas = 0
+    lidas = 0
+    correspondidas = 0
+    sem_correspondencia = 0
+    anterior = None
+    tipos = None
+    try:
+        with os.fdopen(descritor, 'w', newline='', encoding='utf-8') as saida:
+            blocos = ler_em_blocos(arquivo_destino, skip_destino, tamanho_bloco=tamanho_bloco,
+                                   planilha=planilha_destino)
+            for numero, bloco in enumerate(blocos):
+                chaves = bloco[chave]
+                _verificar_ordem(chaves, anterior, arquivo_destino)
+                if len(chaves):
+                    menor, maior = chaves.iloc[0], chaves.iloc[-1]
+                    anterior = maior
+                    # Avança a origem até passar da maior chave do bloco,
+                    # descartando o que ficou abaixo da menor
+                    try:
+                        while not esgotada and (janela is None or janela.empty or not janela.index[-1] > maior):
+                            parte = next(partes, None)
+                            if parte is None:
+                                esgotada = True
+                                break
+                            janela = parte if janela is None else pd.concat([janela, parte])
+                        if janela is not None:
+                            janela = janela[janela.index >= menor]
+                    except TypeError as erro:
+                        raise ForaDeOrdem(f"Chaves de tipos diferentes nos dois arquivos: {erro}") from erro
+                if janela is None:
+                    # Origem vazia (ou destino ainda sem linhas): nenhuma correspondência
+                    janela = pd.DataFrame(columns=colunas[1:], index=pd.Index([], name=chave))
+                indice = IndiceOrigem.da_tabela(janela, chave)
+                resultado = indice.enriquecer(bloco)
+                correspondidas += indice.correspondidas
+                sem_correspondencia += indice.sem_correspondencia
+                if tipos is None:
+                    tipos = resultado.dtypes
+                resultado.to_csv(saida, header=(numero == 0), index=False)
+                total_linhas += len(resultado)
+                lidas += len(bloco)
+                if ao_progredir:
+                    ao_progredir(lidas)
+    except Exception:
+        os.remove(caminho_temporario)
+        raise
+    return (ResultadoStreaming(caminho_temporario, total_linhas, correspondidas, tipos, sem_correspondencia),
+            origem.relatorio())
@@ -0,0 +1,432 @@
+"""Funções de leitura dos arquivos de origem e destino do SAFE"""
+import csv
+import io
+import os
+import threading
+
+import pandas as pd
+
+from categorias import codificar_categorias, concatenar
+
+# Linhas por bloco entregues pelo leitor streaming de xlsx
+TAMANHO_BLOCO_XLSX = 50_000
+
+# A partir deste tamanho o modo automático usa o leitor streaming de xlsx
+LIMIAR_XLSX_STREAMING = 20 * 1024 * 1024
+
+# Linhas guardadas na amostra de metadados (máximo de "Pular linhas" + folga)
+LINHAS_AMOSTRA = 110
+
+# Separadores aceitos na detecção automática de CSV
+SEPARADORES_CSV = ',;\t|'
+
+# Valor de `planilha` que concatena todas as planilhas da pasta de trabalho
+# ("*" não é permitido em nomes de planilha do Excel)
+TODAS_PLANILHAS = '*'
+ROTULO_TODAS_PLANILHAS = 'Todas as planilhas (concatenadas)'
+
+# Rótulos exibidos na interface para cada motor de leitura de Excel
+MOTORES_LEITURA = {
+    'Automático': 'auto',
+    'Padrão (pandas)': 'pandas',
+    'Streaming (somente leitura)': 'streaming',
+}
+
+
+def eh_csv(caminho):
+    """Indica se o caminho aponta para um arquivo CSV"""
+    return str(caminho).lower().endswith('.csv')
+
+
+def eh_xlsx(caminho):
+    """Indica se o caminho aponta para uma pasta de trabalho do Excel 2007+"""
+    return str(caminho).lower().endswith(('.xlsx', '.xlsm'))
+
+
+def escolher_motor(caminho, motor='auto'):
+    """Resolve o motor de leitura a ser usado para o arquivo.
+
+    O leitor streaming só atende pastas .xlsx/.xlsm; no modo automático ele
+    é escolhido quando o arquivo passa de `LIMIAR_XLSX_STREAMING`.
+    """
+    if not eh_xlsx(caminho):
+        return 'pandas'
+    if motor == 'auto':
+        return 'streaming' if os.path.getsize(caminho) >= LIMIAR_XLSX_STREAMING else 'pandas'
+    return motor
+
+
+def _nomes_cabecalho(valores):
+    """Nomeia as colunas como o pandas faria (Unnamed: n, duplicadas com .1)"""
+    nomes = []
+    vistos = {}
+    for posicao, valor in enumerate(valores):
+        nome = f"Unnamed: {posicao}" if valor is None or valor == '' else valor
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        vistos.setdefault(nome, 0)
+        nomes.append(nome)
+    return nomes
+
+
+class MetadadosArquivo:
+    """Informações de um arquivo obtidas numa única abertura.
+
+    Guarda o formato, o separador detectado (CSV), os nomes das planilhas
+    (Excel), a última linha declarada nas dimensões de cada planilha xlsx e
+    uma amostra das primeiras linhas de cada planilha, da qual sai o
+    cabeçalho para qualquer valor de "Pular linhas" sem abrir o arquivo de
+    novo nem ler o corpo das planilhas.
+    """
+
+    def __init__(self, caminho, tamanho, modificado):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.modificado = modificado
+        self.separador = ','
+        self.planilhas = []
+        self._ultimas_linhas = {}
+        self._cabecalhos = {}
+
+        if eh_csv(caminho):
+            self.formato = 'csv'
+            self._amostras = {None: self._ler_amostra_csv()}
+        elif eh_xlsx(caminho):
+            self.formato = 'xlsx'
+            self._amostras = self._ler_amostras_xlsx()
+        else:
+            self.formato = 'xls'
+            self._amostras = self._ler_amostras_excel()
+        # Valida o cabeçalho padrão logo na abertura, como a leitura com nrows=1 fazia
+        self.cabecalho(0)
+
+    def _ler_amostra_csv(self):
+        with open(self.caminho, encoding='utf-8', errors='replace', newline='') as arquivo:
+            linhas = [linha for _, linha in zip(range(LINHAS_AMOSTRA), arquivo)]
+        amostra = ''.join(linhas)
+        try:
+            self.separador = csv.Sniffer().sniff(amostra, delimiters=SEPARADORES_CSV).delimiter
+        except csv.Error:
+            self.separador = ','
+        return amostra, len(linhas) < LINHAS_AMOSTRA
+
+    def _ler_amostras_xlsx(self):
+        from openpyxl import load_workbook
+
+        amostras = {}
+        livro = load_workbook(self.caminho, read_only=True, data_only=True, keep_links=False)
+        try:
+            self.planilhas = livro.sheetnames
+            for planilha in livro.worksheets:
+                # As dimensões gravadas no arquivo são descartadas logo abaixo,
+                # porque podem estar erradas; servem só de estimativa do tamanho
+                self._ultimas_linhas[planilha.title] = planilha.max_row
+                planilha.reset_dimensions()
+                linhas = [list(linha) for _, linha in
+                          zip(range(LINHAS_AMOSTRA), planilha.iter_rows(values_only=True))]
+                amostras[planilha.title] = (linhas, len(linhas) < LINHAS_AMOSTRA)
+        finally:
+            livro.close()
+        return amostras
+
+    def _ler_amostras_excel(self):
+        with pd.ExcelFile(self.caminho) as excel:
+            self.planilhas = excel.sheet_names
+            amostras = excel.parse(sheet_name=None, header=None, nrows=LINHAS_AMOSTRA)
+        return {
+            nome: (amostra.astype(object).where(amostra.notna(), None).values.tolist(),
+                   len(amostra) < LINHAS_AMOSTRA)
+            for nome, amostra in amostras.items()
+        }
+
+    def cabecalho(self, skiprows=0, planilha=None):
+        """Nomes das colunas quando as primeiras `skiprows` linhas são puladas.
+
+        `planilha` segue a convenção de `ler_arquivo`: None para a primeira,
+        o nome de uma planilha ou `TODAS_PLANILHAS` para a união das colunas
+        de todas elas, na ordem em que aparecem.
+        """
+        if self.formato == 'csv':
+            planilha = None
+        elif planilha is None:
+            planilha = self.planilhas[0]
+        chave = (skiprows, planilha)
+        if chave not in self._cabecalhos:
+            if planilha == TODAS_PLANILHAS:
+                colunas = []
+                for nome in self.planilhas:
+                    colunas += [col for col in self.cabecalho(skiprows, nome) if col not in colunas]
+                self._cabecalhos[chave] = colunas
+            else:
+                self._cabecalhos[chave] = self._montar_cabecalho(skiprows, planilha)
+        return self._cabecalhos[chave]
+
+    def linhas(self, skiprows=0, planilha=None):
+        """Linhas de dados previstas pelas dimensões das planilhas xlsx.
+
+        Devolve None para CSV e xls, ou quando alguma planilha não declara
+        dimensões (só "A1"); serve de total para a barra de progresso.
+        """
+        if self.formato != 'xlsx':
+            return None
+        if planilha == TODAS_PLANILHAS:
+            nomes = self.planilhas
+        else:
+            nomes = [self.planilhas[0] if planilha is None else planilha]
+        total = 0
+        for nome in nomes:
+            ultima = self._ultimas_linhas.get(nome)
+            if not ultima or ultima <= 1:
+                return None
+            total += max(ultima - skiprows - 1, 0)
+        return total
+
+    def _montar_cabecalho(self, skiprows, planilha):
+        if planilha not in self._amostras:
+            raise ValueError(f"Planilha '{planilha}' não encontrada em {self.caminho}")
+        amostra, completa = self._amostras[planilha]
+        if not completa and skiprows + 1 >= LINHAS_AMOSTRA:
+            # Fora da amostra: lê o cabeçalho diretamente do arquivo
+            df = ler_arquivo(self.caminho, skiprows, nrows=0, motor='pandas', planilha=planilha)
+            return list(df.columns)
+        if self.formato == 'csv':
+            df = pd.read_csv(io.StringIO(amostra), sep=self.separador, skiprows=skiprows, nrows=0)
+            return list(df.columns)
+        linhas = amostra[skiprows:]
+        if not linhas:
+            return []
+        largura = 0
+        for linha in linhas:
+            while linha and linha[-1] is None:
+                linha = linha[:-1]
+            largura = max(largura, len(linha))
+        cabecalho = (list(linhas[0]) + [None] * largura)[:largura]
+        return _nomes_cabecalho(cabecalho)
+
+
+_metadados = {}
+_trava_metadados = threading.Lock()
+
+
+def obter_metadados(caminho):
+    """Devolve os metadados do arquivo, reaproveitando a leitura anterior.
+
+    A entrada é identificada por caminho, tamanho e data de modificação, de
+    modo que qualquer alteração no arquivo provoca uma nova leitura.
+    """
+    estado = os.stat(caminho)
+    chave = (os.path.abspath(caminho), estado.st_size, estado.st_mtime_ns)
+    with _trava_metadados:
+        metadados = _metadados.get(chave)
+    if metadados is None:
+        metadados = MetadadosArquivo(caminho, estado.st_size, estado.st_mtime_ns)
+        with _trava_metadados:
+            _metadados[chave] = metadados
+    return metadados
+
+
+def medida_leitura(caminho, skiprows=0, planilha=None):
+    """Tamanho da leitura do arquivo, como `(total, unidade)`, ou None quando não há como prever.
+
+    CSV é medido em bytes, pelo tamanho do arquivo; xlsx em linhas, pelas
+    dimensões das planilhas. São as mesmas unidades do `ao_progredir` de
+    `ler_arquivo`.
+    """
+    if eh_csv(caminho):
+        return os.path.getsize(caminho), 'bytes'
+    linhas = obter_metadados(caminho).linhas(skiprows, planilha)
+    return (linhas, 'linhas') if linhas else None
+
+
+class _ArquivoMedido(io.RawIOBase):
+    """Arquivo binário que avisa `ao_progredir(bytes_lidos)` a cada leitura do pandas"""
+
+    def __init__(self, arquivo, ao_progredir):
+        super().__init__()
+        self._arquivo = arquivo
+        self._ao_progredir = ao_progredir
+        self._lidos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        quantidade = self._arquivo.readinto(destino)
+        if quantidade:
+            self._lidos += quantidade
+            self._ao_progredir(self._lidos)
+        return quantidade
+
+
+def separador_csv(caminho):
+    """Separador detectado para o CSV (vírgula quando não há como detectar)"""
+    return obter_metadados(caminho).separador
+
+
+def ler_xlsx_em_blocos(caminho, skiprows=0, colunas=None, nrows=None,
+                       tamanho_bloco=TAMANHO_BLOCO_XLSX, planilha=None, ao_progredir=None):
+    """Percorre a planilha em modo somente leitura, em blocos.
+
+    Gera DataFrames de até `tamanho_bloco` linhas contendo apenas as colunas
+    pedidas, sem montar o modelo completo da pasta de trabalho. Linhas vazias
+    no fim da planilha são descartadas, como no `pd.read_excel`. Com
+    `TODAS_PLANILHAS`, as planilhas são percorridas uma após a outra e todo
+    bloco sai com a união das colunas, na ordem da concatenação do pandas
+    (colunas ausentes numa planilha ficam vazias); sem isso, planilhas com
+    colunas em outra ordem seriam gravadas pela posição, nas colunas erradas.
+    `ao_progredir(linhas)` recebe as linhas já entregues, a cada bloco.
+    """
+    from openpyxl import load_workbook
+
+    uniao = None
+    if planilha == TODAS_PLANILHAS:
+        desejadas = None if colunas is None else set(colunas)
+        uniao = [coluna for coluna in obter_metadados(caminho).cabecalho(skiprows, TODAS_PLANILHAS)
+                 if desejadas is None or coluna in desejadas]
+    livro = load_workbook(caminho, read_only=True, data_only=True, keep_links=False)
+    try:
+        if planilha == TODAS_PLANILHAS:
+            planilhas = livro.worksheets
+        elif planilha is None:
+            planilhas = livro.worksheets[:1]
+        else:
+            planilhas = [livro[planilha]]
+        lidas = 0
+        for atual in planilhas:
+            for bloco in _blocos_planilha(atual, skiprows, colunas, nrows, tamanho_bloco):
+                if ao_progredir:
+                    lidas += len(bloco)
+                    ao_progredir(lidas)
+                yield bloco if uniao is None or list(bloco.columns) == uniao else bloco.reindex(columns=uniao)
+    finally:
+        livro.close()
+
+
+def _blocos_planilha(planilha, skiprows, colunas, nrows, tamanho_bloco):
+    """Gera os blocos de uma única planilha aberta em modo somente leitura"""
+    planilha.reset_dimensions()
+    linhas = planilha.iter_rows(values_only=True)
+
+    for _ in range(skiprows):
+        if next(linhas, None) is None:
+            break
+
+    cabecalho = list(next(linhas, None) or ())
+    while cabecalho and cabecalho[-1] is None:
+        cabecalho.pop()
+    nomes = _nomes_cabecalho(cabecalho)
+    desejadas = None if colunas is None else set(colunas)
+    posicoes = [i for i, nome in enumerate(nomes) if desejadas is None or nome in desejadas]
+    nomes_bloco = [nomes[i] for i in posicoes]
+
+    bloco = []
+    vazias = 0
+    lidas = 0
+    emitiu = False
+    for linha in linhas:
+        if all(valor is None for valor in linha):
+            # Só entra no resultado se aparecer outra linha com dados depois
+            vazias += 1
+            continue
+        if nrows is not None and lidas + vazias >= nrows:
+            break
+        bloco.extend([None] * len(posicoes) for _ in range(vazias))
+        tamanho = len(linha)
+        bloco.append([linha[i] if i < tamanho else None for i in posicoes])
+        lidas += vazias + 1
+        vazias = 0
+        if nrows is not None and lidas >= nrows:
+            break
+        if len(bloco) >= tamanho_bloco:
+            yield pd.DataFrame(bloco, columns=nomes_bloco)
+            emitiu = True
+            bloco = []
+
+    if bloco or not emitiu:
+        yield pd.DataFrame(bloco, columns=nomes_bloco)
+
+
+def _filtro_colunas(colunas):
+    """Monta o filtro de colunas aceito por read_csv/read_excel.
+
+    Usa um callable em vez da lista de nomes para que colunas ausentes não
+    gerem erro do pandas; a validação com mensagem amigável fica a cargo
+    de quem chamou.
+    """
+    if colunas is None:
+        return None
+    desejadas = set(colunas)
+    return lambda coluna: coluna in desejadas
+
+
+def ler_arquivo(caminho, skiprows=0, colunas=None, nrows=None, motor='auto', planilha=None,
+                ao_progredir=None):
+    """Carrega um arquivo CSV ou Excel.
+
+    Quando `colunas` é informado, apenas essas colunas são materializadas,
+    de modo que o custo de leitura acompanha as colunas usadas e não a
+    largura da planilha. `motor` escolhe o leitor de xlsx (veja
+    `escolher_motor`). `planilha` é None para a primeira planilha, o nome
+    de uma planilha ou `TODAS_PLANILHAS` para concatenar todas.
+    `ao_progredir(feito)` recebe o acumulado da leitura, nas unidades de
+    `medida_leitura`: bytes no CSV e linhas no Excel (no `pd.read_excel`,
+    só ao final de cada planilha).
+    """
+    usecols = _filtro_colunas(colunas)
+    if eh_csv(caminho) and ao_progredir:
+        with open(caminho, 'rb', buffering=0) as arquivo:
+            df = pd.read_csv(_ArquivoMedido(arquivo, ao_progredir), sep=separador_csv(caminho),
+                             skiprows=skiprows, usecols=usecols, nrows=nrows)
+    elif eh_csv(caminho):
+        df = pd.read_csv(caminho, sep=separador_csv(caminho), skiprows=skiprows,
+                         usecols=usecols, nrows=nrows)
+    elif planilha == TODAS_PLANILHAS:
+        partes = []
+        lidas = 0
+        for nome in obter_metadados(caminho).planilhas:
+            progredir = (lambda feito, base=lidas: ao_progredir(base + feito)) if ao_progredir else None
+            partes.append(ler_arquivo(caminho, skiprows, colunas, nrows, motor, nome, progredir))
+            lidas += len(partes[-1])
+        return concatenar(partes, ignore_index=True)
+    elif escolher_motor(caminho, motor) == 'streaming':
+        blocos = list(ler_xlsx_em_blocos(caminho, skiprows, colunas, nrows, planilha=planilha,
+                                         ao_progredir=ao_progredir))
+        df = blocos[0] if len(blocos) == 1 else pd.concat(blocos, ignore_index=True)
+    else:
+        df = pd.read_excel(caminho, sheet_name=0 if planilha is None else planilha,
+                           skiprows=skiprows, usecols=usecols, nrows=nrows)
+        if ao_progredir:
+            ao_progredir(len(df))
+    # Textos repetitivos (UF, situação...) ficam na memória como categorias
+    return codificar_categorias(df)
+
+
+def ler_em_blocos(caminho, skiprows=0, colunas=None, tamanho_bloco=None, motor='auto',
+                  planilha=None):
+    """Gera o conteúdo do arquivo em blocos de DataFrame.
+
+    CSV usa o `chunksize` do pandas e xlsx grandes usam o leitor streaming;
+    os demais formatos são entregues num único bloco.
+    """
+    if eh_csv(caminho):
+        with pd.read_csv(caminho, sep=separador_csv(caminho), skiprows=skiprows,
+                         usecols=_filtro_colunas(colunas),
+                         chunksize=tamanho_bloco or TAMANHO_BLOCO_XLSX) as leitor:
+            yield from leitor
+    elif escolher_motor(caminho, motor) == 'streaming':
+        yield from ler_xlsx_em_blocos(caminho, skiprows, colunas,
+                                      tamanho_bloco=tamanho_bloco or TAMANHO_BLOCO_XLSX,
+                                      planilha=planilha)
+    else:
+        yield ler_arquivo(caminho, skiprows, colunas, motor='pandas', planilha=planilha)
+
+
+def colunas_origem(chave, colunas_selecionadas):
+    """Colunas da origem necessárias para o merge (chave + selecionadas).
+
+    `chave` pode ser o nome de uma coluna ou a lista de colunas de uma chave
+    composta.
+    """
+    chaves = [chave] if isinstance(chave, str) else list(chave)
+    return chaves + [col for col in colunas_selecionadas if col not in chaves]
@@ -0,0 +1,88 @@
+"""Vinculação em lote: uma origem aplicada a vários arquivos destino"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from leitura import eh_csv
+
+# Destinos processados ao mesmo tempo; cada um mantém um arquivo na memória
+MAX_DESTINOS_SIMULTANEOS = min(4, os.cpu_count() or 1)
+
+# Arquivos aceitos como destino ao escolher uma pasta
+EXTENSOES_DESTINO = ('.xlsx', '.xlsm', '.xls', '.csv')
+SUFIXO_VINCULADO = '_vinculado'
+
+
+def listar_destinos(pasta):
+    """Arquivos destino de uma pasta, em ordem alfabética.
+
+    Ignora resultados de vinculações anteriores (`*_vinculado`), arquivos
+    temporários do Excel (`~$*`) e os temporários do próprio SAFE.
+    """
+    destinos = []
+    for item in sorted(Path(pasta).iterdir(), key=lambda item: item.name.lower()):
+        if not item.is_file() or item.suffix.lower() not in EXTENSOES_DESTINO:
+            continue
+        if item.stem.endswith(SUFIXO_VINCULADO) or item.name.startswith(('~$', '.safe_')):
+            continue
+        destinos.append(str(item))
+    return destinos
+
+
+def nome_vinculado(arquivo_destino):
+    """Caminho de saída padrão: `<nome>_vinculado` ao lado do destino"""
+    arquivo_base = Path(arquivo_destino)
+    extensao = '.csv' if eh_csv(arquivo_destino) else '.xlsx'
+    return str(arquivo_base.with_name(f"{arquivo_base.stem}{SUFIXO_VINCULADO}{extensao}"))
+
+
+class ResumoDestino:
+    """Resultado da vinculação de um destino do lote"""
+
+    def __init__(self, arquivo, saida=None, linhas=0, erro=None):
+        self.arquivo = arquivo
+        self.saida = saida
+        self.linhas = linhas
+        self.erro = erro
+
+    @property
+    def sucesso(self):
+        return self.erro is None
+
+
+def vincular_destino(vinculador, trabalho, arquivo_destino):
+    """Vincula um destino do lote pelo `Vinculador` e grava o resultado.
+
+    O trabalho é copiado para o destino (`TrabalhoVinculacao.para_destino`),
+    então cada arquivo segue o mesmo caminho da vinculação individual,
+    inclusive o motor escolhido pela estimativa. Devolve o `ResumoDestino`.
+    """
+    resultado = vinculador.executar(trabalho.para_destino(arquivo_destino))
+    return ResumoDestino(arquivo_destino, resultado.estatisticas.saida, resultado.estatisticas.linhas)
+
+
+def vincular_lote(vinculador, trabalho, destinos, max_trabalhadores=MAX_DESTINOS_SIMULTANEOS, ao_concluir=None):
+    """Vincula vários destinos à origem do trabalho.
+
+    `vinculador` deve reaproveitar o índice da origem já preparado
+    (`Vinculador.com_indice`), para que a origem seja lida uma vez só.
+    Os destinos são processados em paralelo por um número limitado de
+    threads (as planilhas Excel seguem para o pool de processos da leitura).
+    Um destino com erro não interrompe os demais: o erro fica no resumo.
+    `ao_concluir` recebe (concluídos, total) a cada destino terminado.
+    Devolve um `ResumoDestino` por arquivo, na ordem recebida.
+    """
+    def processar(arquivo):
+        try:
+            return vincular_destino(vinculador, trabalho, arquivo)
+        except Exception as erro:
+            return ResumoDestino(arquivo, erro=str(erro))
+
+    resumos = [None] * len(destinos)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_trabalhadores, len(destinos)))) as executor:
+        futuros = {executor.submit(processar, arquivo): posicao for posicao, arquivo in enumerate(destinos)}
+        for concluidos, futuro in enumerate(as_completed(futuros), 1):
+            resumos[futuros[futuro]] = futuro.result()
+            if ao_concluir:
+                ao_concluir(concluidos, len(destinos))
+    return resumos
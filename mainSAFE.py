@@ -1,15 +1,38 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import pandas as pd
 import os
 from pathlib import Path
 import threading
+import multiprocessing
+
+from aproximacao import COLUNA_SIMILARIDADE, LIMIAR_SIMILARIDADE
+from cache import ORCAMENTO_CACHE_MB, cache_dataframes
+from escrita import MOTORES_ESCRITA
+from leitura import MOTORES_LEITURA, ROTULO_TODAS_PLANILHAS, TODAS_PLANILHAS, obter_metadados
+from lote import listar_destinos, vincular_lote
+from normalizacao import ETAPAS_NORMALIZACAO, NormalizacaoChave
+from paralelo import executar_em_paralelo
+from particionado import LIMITE_MEMORIA_MB
+from progresso import Progresso
+from vinculacao import POLITICAS_DUPLICADAS
+from trabalhos import EXTENSAO_TRABALHO, reexecutar_trabalho, salvar_trabalho
+from vinculador import TrabalhoVinculacao, Vinculador
+
+# Texto exibido enquanto a chave tem uma única coluna
+SEM_CHAVE_COMPOSTA = "Nenhuma (usa apenas a coluna-chave selecionada)"
 
 
 class ExcelMergerApp:
     def __init__(self, root):
         self.root = root
         self.manual_selection = tk.BooleanVar(value=False)  # Variável para o checkbox
+        self.cache_disco = tk.BooleanVar(value=False)  # Cache em disco das planilhas Excel
+        self.indice_disco = tk.BooleanVar(value=True)  # Índice da origem salvo em disco
+        self.destinos_lote = []  # Destinos do modo em lote
+        self.pares_chave = []  # Pares (origem, destino) da chave composta
+        self.aproximada = tk.BooleanVar(value=False)  # Aceitar chaves parecidas
+        self.arquivos_ordenados = tk.BooleanVar(value=False)  # Intercalar arquivos já ordenados
+        self.incremental = tk.BooleanVar(value=False)  # Reaproveitar a execução anterior
         self.setup_window()
         self.create_widgets()
         self.df1_columns = []
@@ -49,6 +72,39 @@ class ExcelMergerApp:
         self.spin_skip2.grid(row=0, column=3, padx=(5, 0))
         self.spin_skip2.set(0)
         
+        ttk.Label(skip_frame, text="Leitor Excel:").grid(row=1, column=0, sticky=tk.W, pady=(10, 0))
+        self.combo_motor_leitura = ttk.Combobox(skip_frame, values=list(MOTORES_LEITURA), 
+                                               state="readonly", width=25)
+        self.combo_motor_leitura.grid(row=1, column=1, sticky=tk.W, padx=(5, 0), pady=(10, 0))
+        self.combo_motor_leitura.set('Automático')
+        
+        ttk.Label(skip_frame, text="Gravador Excel:").grid(row=1, column=2, sticky=tk.W, padx=(20, 0), pady=(10, 0))
+        self.combo_motor_escrita = ttk.Combobox(skip_frame, values=list(MOTORES_ESCRITA), 
+                                               state="readonly", width=25)
+        self.combo_motor_escrita.grid(row=1, column=3, sticky=tk.W, padx=(5, 0), pady=(10, 0))
+        self.combo_motor_escrita.set('Automático')
+        
+        ttk.Label(skip_frame, text="Cache em memória (MB):").grid(row=2, column=0, sticky=tk.W, pady=(10, 0))
+        self.spin_cache_mb = ttk.Spinbox(skip_frame, from_=0, to=65536, increment=128, width=10)
+        self.spin_cache_mb.grid(row=2, column=1, sticky=tk.W, padx=(5, 0), pady=(10, 0))
+        self.spin_cache_mb.set(ORCAMENTO_CACHE_MB)
+        
+        # Acima deste limite origem e destino são particionados em disco
+        ttk.Label(skip_frame, text="Limite de memória (MB):").grid(row=2, column=2, sticky=tk.W, padx=(20, 0), pady=(10, 0))
+        self.spin_memoria_mb = ttk.Spinbox(skip_frame, from_=64, to=262144, increment=256, width=10)
+        self.spin_memoria_mb.grid(row=2, column=3, sticky=tk.W, padx=(5, 0), pady=(10, 0))
+        self.spin_memoria_mb.set(LIMITE_MEMORIA_MB)
+        
+        # Cache em disco só fica disponível com o pyarrow instalado
+        ttk.Checkbutton(skip_frame, text="Guardar planilhas Excel em cache no disco (requer pyarrow)", 
+                        variable=self.cache_disco,
+                        state="normal" if cache_dataframes.cache_disco.disponivel else "disabled").grid(
+            row=3, column=0, columnspan=4, sticky=tk.W, pady=(10, 0))
+        
+        # O índice da origem é reaproveitado ao vincular a mesma origem a outros destinos
+        ttk.Checkbutton(skip_frame, text="Guardar índice da chave da origem em disco para os próximos destinos", 
+                        variable=self.indice_disco).grid(row=4, column=0, columnspan=4, sticky=tk.W, pady=(5, 0))
+        
     def setup_modern_style(self):
         """Configura um estilo visual moderno"""
         style = ttk.Style()
@@ -167,6 +223,49 @@ class ExcelMergerApp:
                                 command=self.selecionar_arquivo2, style='Modern.TButton')
         btn_destino.grid(row=0, column=1)
         
+        # Modo em lote: vários destinos vinculados à mesma origem
+        lote_frame = ttk.Frame(destino_frame)
+        lote_frame.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(8, 0))
+        ttk.Label(lote_frame, text="Lote:").pack(side=tk.LEFT)
+        ttk.Button(lote_frame, text="Vários Arquivos", command=self.selecionar_lote_arquivos, 
+                   style='Modern.TButton').pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(lote_frame, text="Pasta", command=self.selecionar_lote_pasta, 
+                   style='Modern.TButton').pack(side=tk.LEFT, padx=(5, 0))
+        self.label_lote = ttk.Label(lote_frame, text="", style='Info.TLabel')
+        self.label_lote.pack(side=tk.LEFT, padx=(10, 0))
+        
+        # Planilha de cada arquivo (habilitado apenas para Excel)
+        self.combo_planilha1 = self._criar_combo_planilha(origem_frame)
+        self.combo_planilha2 = self._criar_combo_planilha(destino_frame)
+        
+    def _criar_combo_planilha(self, frame):
+        """Cria o seletor de planilha abaixo do caminho do arquivo"""
+        planilha_frame = ttk.Frame(frame)
+        planilha_frame.grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(8, 0))
+        ttk.Label(planilha_frame, text="Planilha:").pack(side=tk.LEFT)
+        combo = ttk.Combobox(planilha_frame, width=35, state="disabled")
+        combo.pack(side=tk.LEFT, padx=(5, 0))
+        return combo
+        
+    def _atualizar_planilhas(self, metadados, numero):
+        """Lista as planilhas do arquivo no seletor correspondente"""
+        combo = self.combo_planilha1 if numero == 1 else self.combo_planilha2
+        if metadados.planilhas:
+            combo.config(values=metadados.planilhas + [ROTULO_TODAS_PLANILHAS], state="readonly")
+            combo.set(metadados.planilhas[0])
+        else:
+            combo.config(values=[])
+            combo.set('')
+            combo.config(state="disabled")
+            
+    def planilha_selecionada(self, numero):
+        """Planilha escolhida para o arquivo, no formato aceito por ler_arquivo"""
+        combo = self.combo_planilha1 if numero == 1 else self.combo_planilha2
+        valor = combo.get()
+        if not valor:
+            return None
+        return TODAS_PLANILHAS if valor == ROTULO_TODAS_PLANILHAS else valor
+        
     def create_advanced_config_section(self, parent, row):
         """Cria seção de configurações avançada com seleção múltipla"""
         self.config_frame = ttk.LabelFrame(parent, text="⚙️ Configurações Avançadas", 
@@ -202,6 +301,75 @@ class ExcelMergerApp:
         self.combo_chave_destino.grid(row=current_row, column=1, sticky=(tk.W, tk.E), padx=(10, 0), pady=(0, 5))
         current_row += 1
         
+        # Chave composta: pares de colunas-chave acrescentados um a um
+        ttk.Label(self.config_frame, text="🧩 Chave composta:").grid(
+            row=current_row, column=0, sticky=tk.W, pady=(0, 5))
+        composta_frame = ttk.Frame(self.config_frame)
+        composta_frame.grid(row=current_row, column=1, sticky=(tk.W, tk.E), padx=(10, 0), pady=(0, 5))
+        ttk.Button(composta_frame, text="➕ Adicionar à chave", command=self.adicionar_chave_composta).pack(
+            side=tk.LEFT)
+        ttk.Button(composta_frame, text="Limpar", command=self.limpar_chave_composta).pack(
+            side=tk.LEFT, padx=(5, 0))
+        self.label_chave_composta = ttk.Label(composta_frame, text=SEM_CHAVE_COMPOSTA, style='Info.TLabel')
+        self.label_chave_composta.pack(side=tk.LEFT, padx=(10, 0))
+        current_row += 1
+        
+        # O que fazer quando a chave se repete na origem
+        ttk.Label(self.config_frame, text="🔁 Chaves repetidas na origem:").grid(
+            row=current_row, column=0, sticky=tk.W, pady=(0, 5))
+        self.combo_duplicadas = ttk.Combobox(self.config_frame, values=list(POLITICAS_DUPLICADAS), 
+                                             state="readonly", width=40)
+        self.combo_duplicadas.grid(row=current_row, column=1, sticky=tk.W, padx=(10, 0), pady=(0, 5))
+        self.combo_duplicadas.set('Manter a primeira')
+        current_row += 1
+        
+        # Normalização aplicada às chaves dos dois arquivos antes do join
+        ttk.Label(self.config_frame, text="🧹 Normalizar chave:").grid(
+            row=current_row, column=0, sticky=(tk.W, tk.N), pady=(5, 5))
+        normalizacao_frame = ttk.Frame(self.config_frame)
+        normalizacao_frame.grid(row=current_row, column=1, sticky=tk.W, padx=(10, 0), pady=(5, 5))
+        self.vars_normalizacao = {}
+        for posicao, (etapa, rotulo) in enumerate(ETAPAS_NORMALIZACAO.items()):
+            variavel = tk.BooleanVar(value=False)
+            ttk.Checkbutton(normalizacao_frame, text=rotulo, variable=variavel).grid(
+                row=posicao // 3, column=posicao % 3, sticky=tk.W, padx=(0, 15), pady=(0, 3))
+            self.vars_normalizacao[etapa] = variavel
+        ttk.Label(normalizacao_frame, text="Zeros à esquerda até (0 = não completar):").grid(
+            row=2, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        self.spin_zeros = ttk.Spinbox(normalizacao_frame, from_=0, to=30, width=6)
+        self.spin_zeros.grid(row=2, column=2, sticky=tk.W, pady=(5, 0))
+        self.spin_zeros.set(0)
+        current_row += 1
+        
+        # Vinculação aproximada: aceita chaves parecidas acima de uma nota mínima
+        ttk.Label(self.config_frame, text="🔎 Correspondência aproximada:").grid(
+            row=current_row, column=0, sticky=tk.W, pady=(0, 5))
+        aproximada_frame = ttk.Frame(self.config_frame)
+        aproximada_frame.grid(row=current_row, column=1, sticky=tk.W, padx=(10, 0), pady=(0, 5))
+        ttk.Checkbutton(aproximada_frame, text="Aceitar chaves parecidas com similaridade mínima de",
+                        variable=self.aproximada).pack(side=tk.LEFT)
+        self.spin_similaridade = ttk.Spinbox(aproximada_frame, from_=50, to=100, width=6)
+        self.spin_similaridade.pack(side=tk.LEFT, padx=(5, 5))
+        self.spin_similaridade.set(LIMIAR_SIMILARIDADE)
+        ttk.Label(aproximada_frame, text="%").pack(side=tk.LEFT)
+        current_row += 1
+        
+        # Arquivos exportados já ordenados pela chave dispensam o índice da origem
+        ttk.Label(self.config_frame, text="⚡ Arquivos ordenados:").grid(
+            row=current_row, column=0, sticky=tk.W, pady=(0, 5))
+        ttk.Checkbutton(self.config_frame, text="Origem e destino já ordenados pela chave (passada única)",
+                        variable=self.arquivos_ordenados).grid(
+            row=current_row, column=1, sticky=tk.W, padx=(10, 0), pady=(0, 5))
+        current_row += 1
+        
+        # Reaproveita a execução anterior e vincula só as linhas novas ou alteradas
+        ttk.Label(self.config_frame, text="♻️ Vinculação incremental:").grid(
+            row=current_row, column=0, sticky=tk.W, pady=(0, 5))
+        ttk.Checkbutton(self.config_frame, text="Reaproveitar o resultado anterior e vincular só o que mudou",
+                        variable=self.incremental).grid(
+            row=current_row, column=1, sticky=tk.W, padx=(10, 0), pady=(0, 5))
+        current_row += 1
+        
         # Separador
         ttk.Separator(self.config_frame).grid(row=current_row, column=0, columnspan=2, 
                                             sticky=(tk.W, tk.E), pady=15)
@@ -288,14 +456,20 @@ class ExcelMergerApp:
                                      style='Modern.TButton', width=20)
         self.btn_execute.pack(side=tk.LEFT, padx=10)
         
+        # Trabalhos salvos: a configuração atual vai para um arquivo e pode ser reexecutada
+        ttk.Button(button_frame, text="💾 Salvar Trabalho", command=self.salvar_trabalho_atual,
+                   style='Modern.TButton').pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="🔁 Reexecutar Trabalho", command=self.reexecutar_trabalho_salvo,
+                   style='Modern.TButton').pack(side=tk.LEFT)
+        
         # Contador de colunas selecionadas
         self.label_contador = ttk.Label(button_frame, text="", style='Info.TLabel')
         self.label_contador.pack(side=tk.LEFT, padx=20)
         
     def create_progress_section(self, parent, row):
         """Cria seção de progresso e status"""
-        # Barra de progresso
-        self.progress = ttk.Progressbar(parent, mode='indeterminate', length=400)
+        # Barra de progresso: avança pela fração de cada etapa informada pelo motor
+        self.progress = ttk.Progressbar(parent, mode='determinate', maximum=100, length=400)
         self.progress.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
         
         # Status com ícones
@@ -304,6 +478,11 @@ class ExcelMergerApp:
                                      style='Info.TLabel', font=('Segoe UI', 10))
         self.status_label.grid(row=row+1, column=0, columnspan=3, pady=5)
         
+        # Linhas processadas, velocidade e tempo restante da etapa atual
+        self.andamento_var = tk.StringVar(value="")
+        ttk.Label(parent, textvariable=self.andamento_var, font=('Segoe UI', 9), foreground="gray").grid(
+            row=row+2, column=0, columnspan=3)
+        
     def selecionar_todas_colunas(self):
         """Seleciona todas as colunas na listbox"""
         self.listbox_colunas.select_set(0, tk.END)
@@ -343,22 +522,51 @@ class ExcelMergerApp:
             filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("All files", "*.*")]
         )
         if caminho:
+            # Um destino escolhido individualmente encerra o modo em lote
+            self.destinos_lote = []
+            self.label_lote.config(text="")
             self.entrada_arquivo2.delete(0, tk.END)
             self.entrada_arquivo2.insert(0, caminho)
             self.validar_arquivo(caminho, 2)
             self.check_ready_state()
             
+    def selecionar_lote_arquivos(self):
+        """Seleciona vários arquivos destino para o modo em lote"""
+        caminhos = filedialog.askopenfilenames(
+            title="Selecionar arquivos DESTINO do lote",
+            filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if caminhos:
+            self._definir_lote(list(caminhos))
+            
+    def selecionar_lote_pasta(self):
+        """Seleciona uma pasta cujos arquivos Excel e CSV serão os destinos do lote"""
+        pasta = filedialog.askdirectory(title="Selecionar pasta com os arquivos DESTINO")
+        if not pasta:
+            return
+        destinos = listar_destinos(pasta)
+        if not destinos:
+            messagebox.showwarning("⚠️ Lote Vazio", "Nenhum arquivo Excel ou CSV encontrado na pasta")
+            return
+        self._definir_lote(destinos)
+        
+    def _definir_lote(self, destinos):
+        """Ativa o modo em lote; o primeiro destino serve de modelo para as colunas"""
+        self.destinos_lote = destinos
+        self.entrada_arquivo2.delete(0, tk.END)
+        self.entrada_arquivo2.insert(0, destinos[0])
+        self.validar_arquivo(destinos[0], 2)
+        self.label_lote.config(text=f"📚 {len(destinos)} arquivo(s) no lote")
+        self.check_ready_state()
+            
     def validar_arquivo(self, caminho, numero):
         """Valida se o arquivo existe e é legível"""
         try:
             if not os.path.exists(caminho):
                 raise FileNotFoundError(f"Arquivo não encontrado: {caminho}")
                 
-            # Detecta tipo de arquivo e tenta ler
-            if caminho.lower().endswith('.csv'):
-                pd.read_csv(caminho, nrows=1)
-            else:
-                pd.read_excel(caminho, nrows=1)
+            # Detecta tipo de arquivo e guarda cabeçalho e formato para as próximas etapas
+            self._atualizar_planilhas(obter_metadados(caminho), numero)
                 
             self.status_var.set(f"✅ Arquivo {numero} carregado com sucesso!")
             
@@ -382,7 +590,7 @@ class ExcelMergerApp:
     def preview_columns(self):
         """Carrega e exibe as colunas disponíveis"""
         try:
-            self.progress.start()
+            self._progresso_indeterminado()
             self.status_var.set("⏳ Carregando colunas...")
             
             thread = threading.Thread(target=self._load_columns_thread)
@@ -390,7 +598,7 @@ class ExcelMergerApp:
             thread.start()
             
         except Exception as e:
-            self.progress.stop()
+            self._parar_progresso()
             messagebox.showerror("❌ Erro", f"Erro ao carregar colunas:\n{str(e)}")
             
     def _load_columns_thread(self):
@@ -406,19 +614,12 @@ class ExcelMergerApp:
             if not int(skip1) or not int(skip2):
                 print()
             
-            # Carrega dados baseado no tipo de arquivo
-            if arquivo1.lower().endswith('.csv'):
-                df1 = pd.read_csv(arquivo1, skiprows=skip1, nrows=5)
-            else:
-                df1 = pd.read_excel(arquivo1, skiprows=skip1, nrows=5)
-                
-            if arquivo2.lower().endswith('.csv'):
-                df2 = pd.read_csv(arquivo2, skiprows=skip2, nrows=5)
-            else:
-                df2 = pd.read_excel(arquivo2, skiprows=skip2, nrows=5)
-            
-            self.df1_columns = list(df1.columns)
-            self.df2_columns = list(df2.columns)
+            # Cabeçalhos vêm da amostra lida na validação dos arquivos, os dois ao mesmo tempo
+            cabecalho1, cabecalho2 = executar_em_paralelo(
+                lambda: obter_metadados(arquivo1).cabecalho(int(skip1), self.planilha_selecionada(1)),
+                lambda: obter_metadados(arquivo2).cabecalho(int(skip2), self.planilha_selecionada(2)))
+            self.df1_columns = list(cabecalho1)
+            self.df2_columns = list(cabecalho2)
             
             # No modo automático, verifica colunas em comum
             if not self.manual_selection.get():
@@ -435,7 +636,10 @@ class ExcelMergerApp:
             
     def _update_column_combos(self):
         """Atualiza os comboboxes e listbox com as colunas carregadas"""
-        self.progress.stop()
+        self._parar_progresso()
+        
+        # Colunas recarregadas: a chave composta anterior pode não valer mais
+        self.limpar_chave_composta()
         
         # Atualiza interface com base no modo
         if self.manual_selection.get():
@@ -471,7 +675,7 @@ class ExcelMergerApp:
         
     def _handle_column_error(self, error_msg):
         """Trata erros no carregamento de colunas"""
-        self.progress.stop()
+        self._parar_progresso()
         messagebox.showerror("❌ Erro ao Carregar Colunas", error_msg)
         self.status_var.set("❌ Erro ao carregar colunas")
         
@@ -479,75 +683,149 @@ class ExcelMergerApp:
         """Executa a vinculação das colunas"""
         if not self.validar_inputs():
             return
-            
+        
+        # Os valores dos widgets são lidos aqui, na thread principal
+        try:
+            trabalho = self.montar_trabalho()
+            cache_dataframes.definir_orcamento(int(self.spin_cache_mb.get()))
+        except ValueError as e:
+            messagebox.showerror("❌ Erro", str(e))
+            return
+        
+        self.btn_execute.config(state="disabled")
+        self._progresso_indeterminado()
+        if self.destinos_lote:
+            self._iniciar_vinculacao(trabalho)
+            return
+        
+        # Antes de começar, estima memória e tempo e escolhe o motor de vinculação;
+        # a estimativa lê amostras dos arquivos, então roda fora da thread principal
+        self.status_var.set("📐 Estimando memória e tempo...")
+        thread = threading.Thread(target=self._estimar_thread, args=(trabalho,))
+        thread.daemon = True
+        thread.start()
+        
+    def _estimar_thread(self, trabalho):
+        """Thread que estima memória e tempo sem travar a interface"""
+        try:
+            plano = trabalho.planejar()
+        except Exception:
+            # Sem a estimativa, a vinculação segue pelo caminho em memória
+            trabalho.motor_vinculacao = 'memoria'
+            plano = None
+        self.root.after(0, lambda: self.confirmar_estimativa(trabalho, plano))
+        
+    def confirmar_estimativa(self, trabalho, plano):
+        """Mostra a estimativa de memória e tempo no status e pede confirmação"""
+        if plano is not None:
+            self.status_var.set(f"📐 {plano}")
+            if not messagebox.askokcancel("📐 Confirmar Vinculação",
+                                          f"{plano.detalhes()}\n\nIniciar a vinculação?"):
+                self._parar_progresso()
+                self.btn_execute.config(state="normal")
+                self.status_var.set("Vinculação cancelada")
+                return
+        self._iniciar_vinculacao(trabalho)
+        
+    def _iniciar_vinculacao(self, trabalho):
+        """Dispara a vinculação (única ou em lote) numa thread separada"""
         try:
-            self.progress.start()
-            self.btn_execute.config(state="disabled")
             self.status_var.set("⚙️ Processando vinculação...")
             
-            thread = threading.Thread(target=self._executar_merge_thread)
+            # Com destinos em lote, todos são vinculados à mesma origem
+            alvo = self._executar_lote_thread if self.destinos_lote else self._executar_merge_thread
+            thread = threading.Thread(target=alvo, args=(trabalho,))
             thread.daemon = True
             thread.start()
             
         except Exception as e:
-            self.progress.stop()
+            self._parar_progresso()
             self.btn_execute.config(state="normal")
             messagebox.showerror("❌ Erro", f"Erro inesperado:\n{str(e)}")
             
-    def _executar_merge_thread(self):
-        """Thread para executar o merge sem travar a interface"""
-        try:
-            arquivo1 = self.entrada_arquivo1.get()
-            arquivo2 = self.entrada_arquivo2.get()
-            skip1 = int(self.spin_skip1.get())
-            skip2 = int(self.spin_skip2.get())
-            
-            # Obter colunas selecionadas
-            indices_selecionados = self.listbox_colunas.curselection()
-            colunas_selecionadas = [self.df1_columns[i] for i in indices_selecionados]
-            
-            # Carrega os dados completos
-            if arquivo1.lower().endswith('.csv'):
-                df1 = pd.read_csv(arquivo1, skiprows=skip1)
-            else:
-                df1 = pd.read_excel(arquivo1, skiprows=skip1)
-                
-            if arquivo2.lower().endswith('.csv'):
-                df2 = pd.read_csv(arquivo2, skiprows=skip2)
-            else:
-                df2 = pd.read_excel(arquivo2, skiprows=skip2)
+    def montar_trabalho(self):
+        """Reúne as escolhas da interface num trabalho para o motor de vinculação"""
+        chaves_origem, chaves = self._obter_chaves()
+        return TrabalhoVinculacao(
+            self.entrada_arquivo1.get(), self.entrada_arquivo2.get(), chaves_origem,
+            [self.df1_columns[i] for i in self.listbox_colunas.curselection()], chaves=chaves,
+            skip_origem=int(self.spin_skip1.get()), skip_destino=int(self.spin_skip2.get()),
+            planilha_origem=self.planilha_selecionada(1), planilha_destino=self.planilha_selecionada(2),
+            politica=POLITICAS_DUPLICADAS[self.combo_duplicadas.get()],
+            normalizacao=self.normalizacao_selecionada(),
+            similaridade=int(self.spin_similaridade.get()) if self.aproximada.get() else None,
+            ordenados=self.arquivos_ordenados.get(),
+            motor_leitura=MOTORES_LEITURA[self.combo_motor_leitura.get()],
+            motor_escrita=MOTORES_ESCRITA[self.combo_motor_escrita.get()],
+            limite_mb=int(self.spin_memoria_mb.get()),
+            persistir=self.cache_disco.get(), indice_disco=self.indice_disco.get(),
+            selecao_manual=self.manual_selection.get(),
+            incremental=self.incremental.get())
             
-            # Obter colunas-chave com base no modo
+    def normalizacao_selecionada(self):
+        """Regras de normalização da chave escolhidas na interface"""
+        etapas = [etapa for etapa, variavel in self.vars_normalizacao.items() if variavel.get()]
+        return NormalizacaoChave(etapas, int(self.spin_zeros.get()))
+        
+    def _par_selecionado(self):
+        """Par (origem, destino) escolhido nos seletores de chave, ou None"""
+        if self.manual_selection.get():
+            chave_origem = self.combo_chave_origem.get()
+            chave_destino = self.combo_chave_destino.get()
+            return (chave_origem, chave_destino) if chave_origem and chave_destino else None
+        chave = self.combo_chave.get()
+        return (chave, chave) if chave else None
+        
+    def adicionar_chave_composta(self):
+        """Acrescenta o par de colunas-chave selecionado à chave composta"""
+        par = self._par_selecionado()
+        if par is None:
+            messagebox.showerror("❌ Erro", "Selecione as colunas-chave antes de adicioná-las")
+            return
+        if par not in self.pares_chave:
+            self.pares_chave.append(par)
+        self._atualizar_chave_composta()
+        
+    def limpar_chave_composta(self):
+        """Volta a usar uma única coluna-chave"""
+        self.pares_chave = []
+        self._atualizar_chave_composta()
+        
+    def _atualizar_chave_composta(self):
+        """Mostra os pares de colunas que formam a chave composta"""
+        if not self.pares_chave:
+            self.label_chave_composta.config(text=SEM_CHAVE_COMPOSTA)
+            return
+        partes = [origem if origem == destino else f"{origem} → {destino}"
+                  for origem, destino in self.pares_chave]
+        self.label_chave_composta.config(text=" + ".join(partes))
+        
+    def _obter_chaves(self):
+        """Colunas-chave da origem e do destino, em listas pareadas.
+
+        Os pares adicionados à chave composta vêm primeiro; o par escolhido
+        nos seletores entra por último, se ainda não estiver na lista.
+        """
+        pares = list(self.pares_chave)
+        par = self._par_selecionado()
+        if par is not None and par not in pares:
+            pares.append(par)
+        if not pares:
             if self.manual_selection.get():
-                chave_origem = self.combo_chave_origem.get()
-                chave_destino = self.combo_chave_destino.get()
-                if not chave_origem or not chave_destino:
-                    raise ValueError("Selecione as colunas-chave para ambos os arquivos")
-                # Renomeia temporariamente a coluna do arquivo origem para corresponder ao destino
-                df1 = df1.rename(columns={chave_origem: chave_destino})
-                chave = chave_destino
-            else:
-                chave = self.combo_chave.get()
-                if not chave:
-                    raise ValueError("Selecione a coluna-chave")
-            
-            # Verifica se as colunas existem
-            if chave not in df1.columns or chave not in df2.columns:
-                raise ValueError(f"Coluna-chave '{chave}' não encontrada em um dos arquivos")
-                
-            for coluna in colunas_selecionadas:
-                if coluna not in df1.columns:
-                    raise ValueError(f"Coluna '{coluna}' não encontrada no arquivo origem")
-            
-            # Colunas para merge (chave + selecionadas)
-            colunas_merge = [chave] + [col for col in colunas_selecionadas if col != chave]
-            
-            # Realiza o merge
-            df_merge = df2.merge(df1[colunas_merge], on=chave, how='left')
+                raise ValueError("Selecione as colunas-chave para ambos os arquivos")
+            raise ValueError("Selecione a coluna-chave")
+        return [origem for origem, _ in pares], [destino for _, destino in pares]
+        
+    def _executar_merge_thread(self, trabalho):
+        """Thread para executar o merge sem travar a interface"""
+        try:
+            # O motor carrega, vincula e escolhe a estratégia; a interface só escolhe onde salvar
+            vinculador = Vinculador(ao_informar=self._informar_andamento, ao_andamento=self._informar_progresso)
+            resultado = vinculador.vincular(trabalho)
             
             # Abre caixa de diálogo para escolher nome e local do arquivo de saída
-            arquivo_base = Path(arquivo2)
-            extensao = '.csv' if arquivo2.lower().endswith('.csv') else '.xlsx'
+            arquivo_base = Path(trabalho.arquivo_destino)
+            extensao = '.csv' if trabalho.arquivo_destino.lower().endswith('.csv') else '.xlsx'
             nome_sugerido = f"{arquivo_base.stem}_vinculado{extensao}"
             
             # Executa a caixa de diálogo na thread principal
@@ -559,6 +837,7 @@ class ExcelMergerApp:
             )
             
             if not nome_saida:
+                resultado.descartar()
                 raise ValueError("Nenhum arquivo de saída selecionado")
                 
             # Garante que o arquivo tenha a extensão correta
@@ -566,40 +845,205 @@ class ExcelMergerApp:
                 nome_saida += extensao
                 
             # Salva o resultado
-            if nome_saida.lower().endswith('.csv'):
-                df_merge.to_csv(nome_saida, index=False)
-            else:
-                df_merge.to_excel(nome_saida, index=False)
+            resultado.salvar(nome_saida, trabalho.motor_escrita)
             
-            # Estatísticas
-            total_linhas = len(df_merge)
-            colunas_adicionadas = len(colunas_selecionadas)
+            self.root.after(0, lambda: self._merge_success(str(nome_saida), resultado.estatisticas))
+            
+        except Exception as e:
+            mensagem = str(e)
+            self.root.after(0, lambda: self._merge_error(mensagem))
+            
+    def _executar_lote_thread(self, trabalho):
+        """Thread do modo em lote: indexa a origem uma vez e vincula todos os destinos"""
+        try:
+            destinos = list(self.destinos_lote)
             
-            self.root.after(0, lambda: self._merge_success(str(nome_saida), total_linhas, 
-                                                        colunas_adicionadas, colunas_selecionadas))
+            # A origem é indexada uma vez e o índice serve a todos os destinos
+            vinculador = Vinculador()
+            indice, duplicadas = vinculador.preparar_indice(trabalho)
+            
+            # A barra avança a cada destino concluído
+            progresso = Progresso(self._informar_progresso)
+            progresso.iniciar('lote', len(destinos), 'arquivos')
+            
+            # Cada destino é gravado como <nome>_vinculado ao lado do original
+            resumos = vincular_lote(vinculador.com_indice(indice, duplicadas), trabalho, destinos,
+                                    ao_concluir=lambda concluidos, total: progresso.atualizar(concluidos))
+            self.root.after(0, lambda: self._lote_concluido(resumos, trabalho.colunas, duplicadas))
             
         except Exception as e:
-            self.root.after(0, lambda: self._merge_error(str(e)))
+            mensagem = str(e)
+            self.root.after(0, lambda: self._merge_error(mensagem))
             
-    def _merge_success(self, caminho_saida, total_linhas, colunas_adicionadas, nomes_colunas):
-        """Trata sucesso do merge com estatísticas detalhadas"""
+    def _informar_andamento(self, mensagem):
+        """Mostra no status as mensagens do motor de vinculação (chamado da thread de trabalho)"""
+        self.root.after(0, lambda: self.status_var.set(mensagem))
+        
+    def salvar_trabalho_atual(self):
+        """Grava a configuração atual num arquivo de trabalho para reexecutar depois"""
+        if not self.validar_inputs():
+            return
+        try:
+            trabalho = self.montar_trabalho()
+        except ValueError as e:
+            messagebox.showerror("❌ Erro", str(e))
+            return
+        arquivo_base = Path(trabalho.arquivo_destino)
+        caminho = filedialog.asksaveasfilename(
+            title="Salvar Trabalho",
+            initialdir=arquivo_base.parent,
+            initialfile=f"{arquivo_base.stem}{EXTENSAO_TRABALHO}",
+            defaultextension=EXTENSAO_TRABALHO,
+            filetypes=[("Trabalhos do SAFE", "*.json"), ("All files", "*.*")]
+        )
+        if not caminho:
+            return
+        try:
+            salvar_trabalho(trabalho, caminho)
+        except Exception as e:
+            messagebox.showerror("❌ Erro ao Salvar Trabalho", str(e))
+            return
+        self.status_var.set(f"💾 Trabalho salvo em {Path(caminho).name} (saída: {Path(trabalho.saida).name})")
+        
+    def reexecutar_trabalho_salvo(self):
+        """Reexecuta um trabalho salvo; sem alterações nos arquivos, reaproveita o resultado anterior"""
+        caminho = filedialog.askopenfilename(
+            title="Abrir Trabalho",
+            filetypes=[("Trabalhos do SAFE", "*.json"), ("All files", "*.*")]
+        )
+        if not caminho:
+            return
+        try:
+            cache_dataframes.definir_orcamento(int(self.spin_cache_mb.get()))
+        except ValueError:
+            messagebox.showerror("❌ Erro", "O cache e o limite de memória devem ser números inteiros de MB")
+            return
+        
+        self._progresso_indeterminado()
+        self.btn_execute.config(state="disabled")
+        self.status_var.set(f"⚙️ Conferindo o trabalho {Path(caminho).name}...")
+        thread = threading.Thread(target=self._reexecutar_thread, args=(caminho,))
+        thread.daemon = True
+        thread.start()
+        
+    def _reexecutar_thread(self, caminho):
+        """Thread da reexecução de um trabalho salvo"""
+        try:
+            vinculador = Vinculador(ao_informar=self._informar_andamento, ao_andamento=self._informar_progresso)
+            execucao = reexecutar_trabalho(caminho, vinculador)
+            self.root.after(0, lambda: self._trabalho_concluido(execucao))
+        except Exception as e:
+            mensagem = str(e)
+            self.root.after(0, lambda: self._merge_error(mensagem))
+            
+    def _trabalho_concluido(self, execucao):
+        """Informa se o trabalho foi vinculado de novo ou se o resultado anterior foi reaproveitado"""
+        self._parar_progresso()
+        self.btn_execute.config(state="normal" if self.df1_columns else "disabled")
+        estatisticas = execucao.estatisticas
+        if execucao.reaproveitado:
+            self.status_var.set("♻️ Nada mudou desde a última execução: resultado anterior reaproveitado")
+            titulo = "♻️ Resultado Reaproveitado"
+            texto = "Origem, destino e configuração não mudaram desde a última execução."
+        else:
+            self.status_var.set(f"🎉 Trabalho reexecutado com sucesso! ({cache_dataframes.resumo()})")
+            titulo = "🎉 Sucesso!"
+            texto = f"Trabalho vinculado novamente ({', '.join(execucao.alteracoes)})."
+        messagebox.showinfo(titulo,
+                            f"{texto}\n\n"
+                            f"📁 Arquivo de saída:\n{estatisticas['saida']}\n\n"
+                            f"📊 Estatísticas:\n"
+                            f"• Total de linhas: {estatisticas['linhas']:,}\n"
+                            f"{self._linha_correspondidas(estatisticas['correspondidas'])}"
+                            f"• Colunas adicionadas: {estatisticas['colunas_adicionadas']}")
+        
+    def _lote_concluido(self, resumos, nomes_colunas, duplicadas=None):
+        """Exibe o resumo por arquivo do modo em lote"""
+        self._parar_progresso()
+        self.btn_execute.config(state="normal")
+        sucessos = [resumo for resumo in resumos if resumo.sucesso]
+        self.status_var.set(f"🎉 Lote concluído: {len(sucessos)} de {len(resumos)} arquivos vinculados "
+                            f"({cache_dataframes.resumo()})")
+        
+        linhas = []
+        for resumo in resumos:
+            nome = Path(resumo.arquivo).name
+            if resumo.sucesso:
+                linhas.append(f"✅ {nome} → {Path(resumo.saida).name} ({resumo.linhas:,} linhas)")
+            else:
+                linhas.append(f"❌ {nome}: {resumo.erro}")
+        
+        texto = (f"Lote concluído: {len(sucessos)} de {len(resumos)} arquivos vinculados.\n\n"
+                 f"📋 Colunas vinculadas: {', '.join(map(str, nomes_colunas))}\n\n" + '\n'.join(linhas))
+        if duplicadas:
+            texto += f"\n\n🔁 {duplicadas}"
+        if self.aproximada.get():
+            texto += f"\n\n🔎 Nota de cada correspondência na coluna '{COLUNA_SIMILARIDADE}'"
+        if len(sucessos) == len(resumos):
+            messagebox.showinfo("🎉 Lote Concluído", texto)
+        else:
+            messagebox.showwarning("⚠️ Lote Concluído com Erros", texto)
+        
+    def _informar_progresso(self, andamento):
+        """Repassa o andamento do motor à thread principal (chamado da thread de trabalho)"""
+        self.root.after(0, lambda: self._mostrar_andamento(andamento))
+        
+    def _mostrar_andamento(self, andamento):
+        """Mostra a fração, a velocidade e o tempo restante da etapa; sem total, a barra fica em movimento"""
+        if andamento.fracao is None:
+            if str(self.progress['mode']) != 'indeterminate':
+                self._progresso_indeterminado()
+        else:
+            self.progress.stop()
+            self.progress.configure(mode='determinate', value=andamento.fracao * 100)
+        self.andamento_var.set(str(andamento))
+        
+    def _progresso_indeterminado(self):
+        """Barra em movimento contínuo, para tarefas sem tamanho conhecido"""
+        self.andamento_var.set("")
+        self.progress.configure(mode='indeterminate')
+        self.progress.start()
+        
+    def _parar_progresso(self):
+        """Para e esvazia a barra de progresso"""
         self.progress.stop()
+        self.progress.configure(mode='determinate', value=0)
+        self.andamento_var.set("")
+        
+    def _merge_success(self, caminho_saida, estatisticas):
+        """Trata sucesso do merge com estatísticas detalhadas"""
+        self._parar_progresso()
         self.btn_execute.config(state="normal")
-        self.status_var.set("🎉 Vinculação concluída com sucesso!")
+        self.status_var.set(f"🎉 Vinculação concluída com sucesso! ({cache_dataframes.resumo()})")
+        
+        colunas_texto = '\n'.join([f"• {col}" for col in estatisticas.colunas])
         
-        colunas_texto = '\n'.join([f"• {col}" for col in nomes_colunas])
+        aviso_duplicadas = f"\n\n🔁 {estatisticas.duplicadas}" if estatisticas.duplicadas else ""
+        if self.aproximada.get():
+            aviso_duplicadas += f"\n\n🔎 Nota de cada correspondência na coluna '{COLUNA_SIMILARIDADE}'"
+        if estatisticas.reaproveitadas is not None:
+            aviso_duplicadas += (f"\n\n♻️ {estatisticas.reaproveitadas:,} linha(s) reaproveitada(s) "
+                                 f"da execução anterior")
         
         messagebox.showinfo("🎉 Sucesso!", 
                            f"Vinculação concluída com sucesso!\n\n"
                            f"📁 Arquivo salvo em:\n{caminho_saida}\n\n"
                            f"📊 Estatísticas:\n"
-                           f"• Total de linhas: {total_linhas:,}\n"
-                           f"• Colunas adicionadas: {colunas_adicionadas}\n\n"
-                           f"📋 Colunas vinculadas:\n{colunas_texto}")
+                           f"• Total de linhas: {estatisticas.linhas:,}\n"
+                           f"{self._linha_correspondidas(estatisticas.correspondidas)}"
+                           f"• Colunas adicionadas: {len(estatisticas.colunas)}\n\n"
+                           f"📋 Colunas vinculadas:\n{colunas_texto}{aviso_duplicadas}")
+        
+    @staticmethod
+    def _linha_correspondidas(correspondidas):
+        """Linha do resumo com as correspondências (vazia quando o motor não as contou)"""
+        if correspondidas is None:
+            return ""
+        return f"• Linhas com correspondência: {correspondidas:,}\n"
         
     def _merge_error(self, error_msg):
         """Trata erro no merge"""
-        self.progress.stop()
+        self._parar_progresso()
         self.btn_execute.config(state="normal")
         messagebox.showerror("❌ Erro na Vinculação", error_msg)
         self.status_var.set("❌ Erro na vinculação")
@@ -614,14 +1058,12 @@ class ExcelMergerApp:
             messagebox.showerror("❌ Erro", "Selecione o arquivo destino")
             return False
             
-        if self.manual_selection.get():
-            if not self.combo_chave_origem.get() or not self.combo_chave_destino.get():
+        if not self.pares_chave and self._par_selecionado() is None:
+            if self.manual_selection.get():
                 messagebox.showerror("❌ Erro", "Selecione as colunas-chave para ambos os arquivos")
-                return False
-        else:
-            if not self.combo_chave.get():
+            else:
                 messagebox.showerror("❌ Erro", "Selecione a coluna-chave")
-                return False
+            return False
             
         if not self.listbox_colunas.curselection():
             messagebox.showerror("❌ Erro", "Selecione pelo menos uma coluna para copiar")
@@ -634,11 +1076,34 @@ class ExcelMergerApp:
             messagebox.showerror("❌ Erro", "Valores de 'pular linhas' devem ser números inteiros")
             return False
             
+        try:
+            int(self.spin_zeros.get())
+        except ValueError:
+            messagebox.showerror("❌ Erro", "A quantidade de zeros à esquerda deve ser um número inteiro")
+            return False
+            
+        try:
+            similaridade = int(self.spin_similaridade.get())
+        except ValueError:
+            similaridade = -1
+        if not 0 <= similaridade <= 100:
+            messagebox.showerror("❌ Erro", "A similaridade mínima deve ser um número inteiro de 0 a 100")
+            return False
+            
+        try:
+            int(self.spin_cache_mb.get())
+            int(self.spin_memoria_mb.get())
+        except ValueError:
+            messagebox.showerror("❌ Erro", "O cache e o limite de memória devem ser números inteiros de MB")
+            return False
+            
         return True
 
 
 def main():
     """Função principal para executar a aplicação"""
+    # Necessário para o pool de processos no executável congelado do Windows
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = ExcelMergerApp(root)
     root.mainloop()
@@ -0,0 +1,79 @@
+"""Normalização das colunas-chave antes da vinculação"""
+import pandas as pd
+
+try:
+    # O pandas recusa o armazenamento 'pyarrow' quando o pyarrow não está instalado
+    TIPO_TEXTO = pd.StringDtype('pyarrow')
+except ImportError:  # pyarrow é opcional: sem ele as operações de texto rodam no pandas
+    TIPO_TEXTO = pd.StringDtype()
+
+# Etapas disponíveis, na ordem em que são aplicadas, com o rótulo exibido na interface
+ETAPAS_NORMALIZACAO = {
+    'texto': 'Comparar como texto',
+    'espacos': 'Remover espaços',
+    'acentos': 'Remover acentos',
+    'caixa': 'Ignorar maiúsculas',
+    'digitos': 'Somente dígitos',
+}
+
+
+def como_texto(serie):
+    """Converte a coluna para texto sem deixar '.0' em inteiros lidos como float.
+
+    Chaves numéricas com células vazias chegam do pandas como float; elas
+    voltam a inteiro antes da conversão para que 123.0 vire '123'.
+    """
+    if pd.api.types.is_float_dtype(serie):
+        valores = serie.dropna()
+        if (valores == valores.round()).all():
+            serie = serie.astype('Int64')
+    return serie.astype(TIPO_TEXTO)
+
+
+class NormalizacaoChave:
+    """Regras aplicadas às chaves da origem e do destino antes do join.
+
+    Com qualquer regra ativa as chaves são comparadas como texto, o que já
+    resolve um lado lido como número e o outro como texto. As etapas usam
+    somente operações de coluna inteira (`Series.str`), sem laço por linha
+    em Python; com o pyarrow instalado elas rodam em código nativo.
+    `largura_zeros` completa com zeros à esquerda (CPF, CNPJ, códigos).
+    """
+
+    def __init__(self, etapas=(), largura_zeros=0):
+        self.etapas = tuple(etapa for etapa in ETAPAS_NORMALIZACAO if etapa in set(etapas))
+        self.largura_zeros = int(largura_zeros)
+
+    def __bool__(self):
+        return bool(self.etapas) or self.largura_zeros > 0
+
+    def __eq__(self, outra):
+        return (isinstance(outra, NormalizacaoChave)
+                and (self.etapas, self.largura_zeros) == (outra.etapas, outra.largura_zeros))
+
+    def __hash__(self):
+        return hash((self.etapas, self.largura_zeros))
+
+    def __str__(self):
+        partes = list(self.etapas)
+        if self.largura_zeros:
+            partes.append(f"zeros{self.largura_zeros}")
+        return '+'.join(partes) or 'nenhuma'
+
+    def aplicar(self, serie):
+        """Devolve a coluna normalizada, sem alterar a original"""
+        if not self:
+            return serie
+        texto = como_texto(serie)
+        if 'espacos' in self.etapas:
+            texto = texto.str.strip()
+        if 'acentos' in self.etapas:
+            # Decompõe os caracteres e descarta as marcas de acentuação
+            texto = texto.str.normalize('NFKD').str.replace('[\u0300-\u036f]', '', regex=True)
+        if 'caixa' in self.etapas:
+            texto = texto.str.casefold()
+        if 'digitos' in self.etapas:
+            texto = texto.str.replace(r'\D', '', regex=True)
+        if self.largura_zeros:
+            texto = texto.str.zfill(self.largura_zeros)
+        return texto
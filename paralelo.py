@@ -0,0 +1,235 @@
+"""Execução paralela das leituras de origem e destino do SAFE"""
+import multiprocessing
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+from categorias import concatenar
+from leitura import TODAS_PLANILHAS, eh_csv, ler_arquivo, obter_metadados
+from progresso import INTERVALO_AVISO
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow é opcional: sem ele o DataFrame volta por pickle
+    pa = None
+
+# Processos reservados para interpretar planilhas Excel
+MAX_PROCESSOS = min(4, os.cpu_count() or 1)
+
+_processos = None
+_trava_processos = threading.Lock()
+
+
+def pool_processos():
+    """Pool de processos compartilhado, criado na primeira planilha Excel.
+
+    Devolve None quando a plataforma não permite criar processos; nesse caso
+    a leitura acontece na própria thread. Os processos são iniciados por
+    'spawn' mesmo no Linux: o pool nasce numa thread de trabalho e um fork
+    copiaria travas seguradas por outras threads (Tk, logging, pools do
+    pandas e do pyarrow), podendo travar o processo filho.
+    """
+    global _processos
+    with _trava_processos:
+        if _processos is None:
+            try:
+                _processos = ProcessPoolExecutor(max_workers=MAX_PROCESSOS,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            except (NotImplementedError, OSError):
+                return None
+        return _processos
+
+
+def _descartar_pool():
+    global _processos
+    with _trava_processos:
+        _processos = None
+
+
+def _gravar_ipc(tabela, destino):
+    """Grava a tabela em formato Arrow IPC.
+
+    Fica numa função à parte para que as referências ao buffer de destino
+    sejam liberadas no retorno, antes de o bloco compartilhado ser fechado.
+    """
+    with pa.ipc.new_stream(destino, tabela.schema) as escritor:
+        escritor.write_table(tabela)
+
+
+def _criar_bloco(tamanho):
+    """Bloco de memória compartilhada fora do rastreador de recursos, quando o Python permite"""
+    try:
+        return shared_memory.SharedMemory(create=True, size=tamanho, track=False), False
+    except TypeError:  # Python < 3.13: o bloco é tirado do rastreador depois de preenchido
+        return shared_memory.SharedMemory(create=True, size=tamanho), True
+
+
+def _abrir_bloco(nome):
+    """Abre no processo auxiliar um bloco criado pelo processo principal.
+
+    Antes do Python 3.13 a abertura registra o bloco de novo, mas no mesmo
+    rastreador de recursos do processo principal (herdado pelo 'spawn'),
+    que já o registrou ao criá-lo; a remoção continua com o principal.
+    """
+    try:
+        return shared_memory.SharedMemory(name=nome, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=nome)
+
+
+def _linhas_lidas(contadores):
+    """Soma das linhas anotadas pelos processos auxiliares nos contadores compartilhados"""
+    return sum(struct.unpack_from('q', contador.buf)[0] for contador in contadores)
+
+
+def _ler_em_processo(caminho, skiprows, colunas, motor, planilha, contador=None):
+    """Roda no processo auxiliar: lê o arquivo e publica o resultado.
+
+    Com o pyarrow disponível, a tabela é gravada em formato Arrow IPC direto
+    num bloco de memória compartilhada e só o nome do bloco volta pelo pipe,
+    sem serializar o DataFrame com pickle. Sem pyarrow, ou quando alguma
+    coluna não tem tipo representável em Arrow, devolve o próprio DataFrame.
+    `contador` é o nome do bloco compartilhado onde as linhas já lidas são
+    anotadas, para o progresso acompanhado pelo processo principal.
+    """
+    if contador is None:
+        df = ler_arquivo(caminho, skiprows, colunas=colunas, motor=motor, planilha=planilha)
+    else:
+        bloco_contador = _abrir_bloco(contador)
+
+        def anotar(linhas):
+            struct.pack_into('q', bloco_contador.buf, 0, linhas)
+
+        try:
+            df = ler_arquivo(caminho, skiprows, colunas=colunas, motor=motor, planilha=planilha,
+                             ao_progredir=anotar)
+        finally:
+            bloco_contador.close()
+    if pa is None or not all(isinstance(col, str) for col in df.columns):
+        return 'dataframe', df
+    try:
+        tabela = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return 'dataframe', df
+
+    medidor = pa.MockOutputStream()
+    _gravar_ipc(tabela, medidor)
+    tamanho = medidor.size()
+
+    bloco, rastreado = _criar_bloco(max(tamanho, 1))
+    try:
+        _gravar_ipc(tabela, pa.FixedSizeBufferWriter(pa.py_buffer(bloco.buf)))
+    except Exception:
+        bloco.close()
+        bloco.unlink()
+        raise
+    nome = bloco.name
+    bloco.close()
+    if rastreado and os.name == 'posix':
+        # O processo principal passa a ser o dono do bloco e o remove após a
+        # leitura; sem isso o rastreador de recursos tentaria removê-lo de novo.
+        # O rastreador guarda o nome POSIX, com a barra inicial
+        resource_tracker.unregister(f"/{nome}", 'shared_memory')
+    return 'arrow', (nome, tamanho)
+
+
+def _receber_resultado(tipo, conteudo):
+    """Reconstrói no processo principal o DataFrame publicado pelo auxiliar"""
+    if tipo == 'dataframe':
+        return conteudo
+    nome, tamanho = conteudo
+    bloco = shared_memory.SharedMemory(name=nome)
+    try:
+        # Uma única cópia para memória própria deste processo, para que o
+        # bloco compartilhado possa ser liberado já aqui
+        dados = bytes(bloco.buf[:tamanho])
+    finally:
+        bloco.close()
+        bloco.unlink()
+    with pa.ipc.open_stream(pa.py_buffer(dados)) as leitor:
+        return leitor.read_all().to_pandas()
+
+
+def _descartar_blocos(futuros):
+    """Espera as leituras restantes e remove os blocos compartilhados que elas publicaram"""
+    for futuro in futuros:
+        try:
+            tipo, conteudo = futuro.result()
+        except Exception:
+            continue
+        if tipo != 'arrow':
+            continue
+        try:
+            bloco = shared_memory.SharedMemory(name=conteudo[0])
+        except FileNotFoundError:
+            continue
+        bloco.close()
+        bloco.unlink()
+
+
+def ler_arquivo_paralelo(caminho, skiprows=0, colunas=None, motor='auto', planilha=None,
+                         ao_progredir=None):
+    """Lê o arquivo como `ler_arquivo`, interpretando Excel em outro processo.
+
+    O openpyxl é Python puro e segura o GIL; num processo separado a leitura
+    de uma planilha não disputa CPU com a outra nem com a interface. Com
+    `TODAS_PLANILHAS`, cada planilha vai para um processo e os resultados são
+    concatenados na ordem da pasta de trabalho. Com `ao_progredir`, cada
+    processo anota as linhas lidas num contador em memória compartilhada,
+    consultado aqui enquanto a leitura não termina.
+    """
+    if eh_csv(caminho):
+        return ler_arquivo(caminho, skiprows, colunas=colunas, motor=motor, ao_progredir=ao_progredir)
+    pool = pool_processos()
+    if pool is None:
+        return ler_arquivo(caminho, skiprows, colunas=colunas, motor=motor, planilha=planilha,
+                           ao_progredir=ao_progredir)
+
+    if planilha == TODAS_PLANILHAS:
+        planilhas = obter_metadados(caminho).planilhas
+    else:
+        planilhas = [planilha]
+    pendentes = []
+    partes = []
+    contadores = []
+    try:
+        for nome in planilhas:
+            contador = None
+            if ao_progredir:
+                bloco, _ = _criar_bloco(struct.calcsize('q'))
+                struct.pack_into('q', bloco.buf, 0, 0)
+                contadores.append(bloco)
+                contador = bloco.name
+            pendentes.append(pool.submit(_ler_em_processo, caminho, skiprows, colunas, motor, nome, contador))
+        while pendentes:
+            if ao_progredir:
+                while not wait(pendentes[:1], timeout=INTERVALO_AVISO).done:
+                    ao_progredir(_linhas_lidas(contadores))
+                ao_progredir(_linhas_lidas(contadores))
+            partes.append(_receber_resultado(*pendentes.pop(0).result()))
+    except BrokenProcessPool:
+        _descartar_pool()
+        return ler_arquivo(caminho, skiprows, colunas=colunas, motor=motor, planilha=planilha,
+                           ao_progredir=ao_progredir)
+    finally:
+        # Se uma leitura falhou, os blocos já publicados pelas demais ficaram
+        # sem dono (e fora do rastreador): são removidos aqui
+        _descartar_blocos(pendentes)
+        for contador in contadores:
+            contador.close()
+            contador.unlink()
+    return partes[0] if len(partes) == 1 else concatenar(partes, ignore_index=True)
+
+
+def executar_em_paralelo(*funcoes):
+    """Executa as funções (sem argumentos) ao mesmo tempo.
+
+    Devolve os resultados na mesma ordem; se alguma falhar, a primeira
+    exceção, na ordem das funções, é repassada a quem chamou.
+    """
+    with ThreadPoolExecutor(max_workers=len(funcoes)) as executor:
+        futuros = [executor.submit(funcao) for funcao in funcoes]
+    return [futuro.result() for futuro in futuros]
@@ -0,0 +1,241 @@
+"""Vinculação fora da memória: origem e destino particionados em disco pela chave"""
+import math
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from leitura import colunas_origem, eh_csv, ler_em_blocos, obter_metadados
+from normalizacao import como_texto
+from vinculacao import (TAMANHO_BLOCO_CSV, IndiceOrigem, RelatorioDuplicadas, ResultadoStreaming,
+                        conferir_colunas)
+
+# Teto de memória padrão (MB) para a vinculação feita inteiramente na memória
+LIMITE_MEMORIA_MB = 2048
+
+# Memória ocupada pelo DataFrame em relação ao tamanho do arquivo no disco
+FATOR_MEMORIA_CSV = 3
+FATOR_MEMORIA_XLSX = 10
+
+# Limites do número de partições gravadas em disco
+MIN_PARTICOES = 2
+MAX_PARTICOES = 256
+
+# Coluna auxiliar com a posição original de cada linha do destino
+COLUNA_LINHA = '__linha_safe__'
+
+
+def estimar_memoria_mb(caminho):
+    """Memória aproximada (MB) para carregar o arquivo inteiro num DataFrame"""
+    fator = FATOR_MEMORIA_CSV if eh_csv(caminho) else FATOR_MEMORIA_XLSX
+    return os.path.getsize(caminho) * fator / (1024 * 1024)
+
+
+def numero_particoes(memoria_mb, limite_mb=LIMITE_MEMORIA_MB):
+    """Partições necessárias para cada uma caber com folga no teto de memória"""
+    particoes = math.ceil(2 * memoria_mb / max(limite_mb, 1))
+    return min(max(particoes, MIN_PARTICOES), MAX_PARTICOES)
+
+
+def _particao(bloco, chaves, normalizacao, total):
+    """Número da partição de cada linha, calculado pelo hash da chave.
+
+    A chave é convertida para texto antes do hash para que 1 (inteiro) e
+    1.0 (float de uma coluna com vazios) caiam na mesma partição.
+    """
+    valores = {}
+    for posicao, coluna in enumerate(chaves):
+        serie = normalizacao.aplicar(bloco[coluna]) if normalizacao else bloco[coluna]
+        valores[posicao] = como_texto(serie).to_numpy(dtype=object)
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(valores), index=False).to_numpy()
+    return hashes % np.uint64(total)
+
+
+def _anexar(caminho, df):
+    """Acrescenta um DataFrame ao arquivo de partição (vários pickles em sequência)"""
+    with open(caminho, 'ab') as arquivo:
+        pickle.dump(df, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _ler_partes(caminho):
+    """Gera os DataFrames gravados no arquivo de partição, na ordem de gravação"""
+    if not os.path.exists(caminho):
+        return
+    with open(caminho, 'rb') as arquivo:
+        while True:
+            try:
+                yield pickle.load(arquivo)
+            except EOFError:
+                return
+
+
+def _espalhar(blocos, chaves, normalizacao, total, prefixo, numerar=False):
+    """Grava cada bloco dividido entre os arquivos das partições.
+
+    Com `numerar`, cada linha recebe antes a sua posição original em
+    `COLUNA_LINHA`. Devolve o bloco vazio com as colunas lidas e o número
+    de linhas.
+    """
+    modelo = None
+    linhas = 0
+    for bloco in blocos:
+        if numerar:
+            bloco = bloco.assign(**{COLUNA_LINHA: np.arange(linhas, linhas + len(bloco), dtype=np.int64)})
+        if modelo is None:
+            modelo = bloco.iloc[:0]
+        linhas += len(bloco)
+        for particao, parte in bloco.groupby(_particao(bloco, chaves, normalizacao, total), sort=False):
+            _anexar(f"{prefixo}_{particao}.pkl", parte)
+    return modelo, linhas
+
+
+def _origem_particao(temporarios, particao, vazia):
+    """Linhas da origem de uma partição, juntas num DataFrame"""
+    partes = list(_ler_partes(os.path.join(temporarios, f"origem_{particao}.pkl")))
+    return pd.concat(partes, ignore_index=True) if partes else vazia
+
+
+def _recusar_repetidas(temporarios, total, vazia, chaves, normalizacao):
+    """Política 'erro': levanta ValueError se houver chaves repetidas em qualquer partição da origem.
+
+    Uma chave fica sempre numa só partição, então a soma dos relatórios das
+    partições é o relatório da origem inteira, como no motor em memória.
+    """
+    relatorios = []
+    for particao in range(total):
+        origem = _origem_particao(temporarios, particao, vazia)
+        # 'multiplicar' só mede as repetidas, sem interromper na primeira partição
+        relatorios.append(IndiceOrigem(origem, chaves, normalizacao).tratar_duplicadas('multiplicar')[1])
+    relatorio = RelatorioDuplicadas.somar(relatorios, 'erro')
+    if relatorio:
+        raise ValueError(f"{relatorio}.\nEscolha outra política para chaves repetidas na origem.")
+
+
+class _Cursor:
+    """Lê em ordem o resultado de uma partição, já ordenado pela linha do destino"""
+
+    def __init__(self, caminho):
+        self.partes = _ler_partes(caminho)
+        self.atual = None
+
+    def ate(self, fim):
+        """Entrega as linhas com posição original abaixo de `fim`"""
+        pedacos = []
+        while True:
+            if self.atual is None:
+                self.atual = next(self.partes, None)
+                if self.atual is None:
+                    return pedacos
+            corte = int(np.searchsorted(self.atual[COLUNA_LINHA].to_numpy(), fim))
+            pedacos.append(self.atual.iloc[:corte])
+            if corte < len(self.atual):
+                self.atual = self.atual.iloc[corte:]
+                return pedacos
+            self.atual = None
+
+
+def merge_particionado(arquivo_origem, skip_origem, arquivo_destino, skip_destino, chaves_origem, chaves,
+                       colunas_selecionadas, politica='primeira', planilha_origem=None, planilha_destino=None,
+                       normalizacao=None, limite_mb=LIMITE_MEMORIA_MB, tamanho_bloco=TAMANHO_BLOCO_CSV,
+                       particoes=None, ao_progredir=None):
+    """Vincula arquivos maiores que a memória particionando os dois lados pela chave.
+
+    1. Origem e destino são lidos em blocos e cada linha vai para o arquivo
+       temporário da sua partição (hash da chave), de modo que uma chave
+       fica sempre na mesma partição dos dois lados.
+    2. Cada partição da origem vira um `IndiceOrigem` (com a política de
+       repetidas) e as partes do destino da mesma partição são enriquecidas
+       uma a uma; só uma partição da origem fica na memória por vez.
+    3. Os resultados das partições são intercalados pela posição original
+       das linhas do destino, em janelas de `tamanho_bloco` linhas, e
+       anexados a um CSV temporário.
+
+    O número de partições vem de `particoes` ou, sem ele, do tamanho dos
+    arquivos em relação ao teto `limite_mb`. `ao_progredir` recebe, a cada
+    parte vinculada no passo 2, o total de linhas do destino já vinculadas.
+    Devolve o `ResultadoStreaming` e o `RelatorioDuplicadas` (ou None).
+    """
+    planilha_origem = None if eh_csv(arquivo_origem) else planilha_origem
+    planilha_destino = None if eh_csv(arquivo_destino) else planilha_destino
+    chaves_origem, chaves = list(chaves_origem), list(chaves)
+    conferir_colunas(obter_metadados(arquivo_origem).cabecalho(skip_origem, planilha_origem),
+                     obter_metadados(arquivo_destino).cabecalho(skip_destino, planilha_destino),
+                     chaves_origem, chaves, colunas_selecionadas)
+    total = particoes or numero_particoes(estimar_memoria_mb(arquivo_origem) + estimar_memoria_mb(arquivo_destino),
+                                          limite_mb)
+    renomear = dict(zip(chaves_origem, chaves))
+
+    diretorio = os.path.dirname(os.path.abspath(arquivo_destino))
+    temporarios = tempfile.mkdtemp(prefix='.safe_particoes_', dir=diretorio)
+    try:
+        # 1. Espalha os dois arquivos pelas partições
+        blocos_origem = (bloco.rename(columns=renomear) for bloco in
+                         ler_em_blocos(arquivo_origem, skip_origem, colunas_origem(chaves_origem, colunas_selecionadas),
+                                       tamanho_bloco, planilha=planilha_origem))
+        vazia, _ = _espalhar(blocos_origem, chaves, normalizacao, total, os.path.join(temporarios, 'origem'))
+        if vazia is None:
+            vazia = pd.DataFrame(columns=chaves + [col for col in colunas_selecionadas if col not in chaves])
+        if politica == 'erro':
+            # Conferida na origem inteira antes de espalhar o destino, com um único relatório
+            _recusar_repetidas(temporarios, total, vazia, chaves, normalizacao)
+        modelo, linhas_destino = _espalhar(ler_em_blocos(arquivo_destino, skip_destino, tamanho_bloco=tamanho_bloco,
+                                                         planilha=planilha_destino),
+                                           chaves, normalizacao, total, os.path.join(temporarios, 'destino'),
+                                           numerar=True)
+        if modelo is None:
+            modelo = pd.DataFrame(columns=list(obter_metadados(arquivo_destino).cabecalho(skip_destino,
+                                                                                         planilha_destino)))
+
+        # 2. Vincula partição por partição
+        relatorios = []
+        correspondidas = 0
+        sem_correspondencia = 0
+        vinculadas = 0
+        for particao in range(total):
+            caminho_destino = os.path.join(temporarios, f"destino_{particao}.pkl")
+            if not os.path.exists(caminho_destino):
+                continue
+            origem = _origem_particao(temporarios, particao, vazia)
+            indice, relatorio = IndiceOrigem(origem, chaves, normalizacao).tratar_duplicadas(politica)
+            relatorios.append(relatorio)
+            for parte in _ler_partes(caminho_destino):
+                _anexar(os.path.join(temporarios, f"resultado_{particao}.pkl"), indice.enriquecer(parte))
+                vinculadas += len(parte)
+                if ao_progredir:
+                    ao_progredir(vinculadas)
+            correspondidas += indice.correspondidas
+            sem_correspondencia += indice.sem_correspondencia
+            os.remove(caminho_destino)
+
+        # 3. Reúne os resultados na ordem original do destino
+        colunas_saida = [col for col in IndiceOrigem(vazia, chaves, normalizacao).enriquecer(modelo).columns
+                         if col != COLUNA_LINHA]
+        cursores = [_Cursor(os.path.join(temporarios, f"resultado_{particao}.pkl")) for particao in range(total)]
+        descritor, caminho_temporario = tempfile.mkstemp(suffix='.csv', prefix='.safe_', dir=diretorio)
+        total_linhas = 0
+        tipos = None
+        try:
+            with os.fdopen(descritor, 'w', newline='', encoding='utf-8') as saida:
+                pd.DataFrame(columns=colunas_saida).to_csv(saida, index=False)
+                for inicio in range(0, linhas_destino, tamanho_bloco):
+                    pedacos = [pedaco for cursor in cursores for pedaco in cursor.ate(inicio + tamanho_bloco)]
+                    if not pedacos:
+                        continue
+                    janela = pd.concat(pedacos).sort_values(COLUNA_LINHA, kind='stable')
+                    if tipos is None:
+                        tipos = janela[colunas_saida].dtypes
+                    janela[colunas_saida].to_csv(saida, header=False, index=False)
+                    total_linhas += len(janela)
+        except Exception:
+            os.remove(caminho_temporario)
+            raise
+        finally:
+            for cursor in cursores:
+                cursor.partes.close()
+    finally:
+        shutil.rmtree(temporarios, ignore_errors=True)
+    return (ResultadoStreaming(caminho_temporario, total_linhas, correspondidas, tipos, sem_correspondencia),
+            RelatorioDuplicadas.somar(relatorios, politica))
@@ -0,0 +1,170 @@
+"""Andamento da vinculação por etapa: quanto já foi feito, velocidade e tempo restante"""
+import threading
+import time
+
+# Intervalo mínimo entre dois avisos da mesma etapa, para não inundar a interface
+INTERVALO_AVISO = 0.2
+
+# Etapas informadas pelo motor e o rótulo exibido
+ETAPAS = {
+    'leitura': '📂 Lendo arquivos',
+    'vinculacao': '⚙️ Vinculando',
+    'gravacao': '💾 Gravando',
+    'lote': '📦 Vinculando destinos',
+}
+
+
+def formatar_duracao(segundos):
+    """Duração em mm:ss ou h:mm:ss"""
+    minutos, segundos = divmod(int(round(segundos)), 60)
+    horas, minutos = divmod(minutos, 60)
+    return f"{horas}:{minutos:02d}:{segundos:02d}" if horas else f"{minutos:02d}:{segundos:02d}"
+
+
+class Andamento:
+    """Retrato de uma etapa num instante.
+
+    `total` é None quando a etapa não tem tamanho conhecido (leitura de um
+    arquivo inteiro, por exemplo); nesse caso não há fração nem tempo
+    restante. `velocidade` é medida a partir do primeiro avanço da etapa,
+    para que a preparação antes dele não a subestime.
+    """
+
+    def __init__(self, etapa, feito, total, decorrido, velocidade, unidade='linhas'):
+        self.etapa = etapa
+        self.feito = feito
+        self.total = total
+        self.decorrido = decorrido
+        self.velocidade = velocidade
+        self.unidade = unidade
+
+    @property
+    def fracao(self):
+        """Parte concluída, de 0 a 1 (None sem total conhecido)"""
+        if not self.total:
+            return None
+        return min(self.feito / self.total, 1.0)
+
+    @property
+    def restante(self):
+        """Segundos estimados até o fim da etapa (None sem total ou velocidade)"""
+        if not self.total or not self.velocidade:
+            return None
+        return max(self.total - self.feito, 0) / self.velocidade
+
+    def __str__(self):
+        # Leituras medidas em bytes aparecem em MB
+        unidade, escala, casas = ('MB', 1024 * 1024, 1) if self.unidade == 'bytes' else (self.unidade, 1, 0)
+        texto = ETAPAS.get(self.etapa, self.etapa)
+        if self.total:
+            texto += (f": {self.feito / escala:,.{casas}f} de {self.total / escala:,.{casas}f} {unidade}"
+                      f" ({self.fracao:.0%})")
+        elif self.feito:
+            texto += f": {self.feito / escala:,.{casas}f} {unidade}"
+        if self.velocidade:
+            texto += f" • {self.velocidade / escala:,.{casas}f} {unidade}/s"
+        if self.restante is not None:
+            texto += f" • faltam {formatar_duracao(self.restante)}"
+        else:
+            texto += f" • {formatar_duracao(self.decorrido)}"
+        return texto
+
+
+class Progresso:
+    """Acompanha as etapas da vinculação e avisa `ao_atualizar(andamento)`.
+
+    Pode ser atualizado de qualquer thread: o estado fica sob um lock e
+    `ao_atualizar` é chamado fora dele, na thread que avançou, no máximo
+    uma vez a cada `intervalo` segundos (sempre no início e no fim de cada
+    etapa). Na interface, o aviso deve ser repassado à thread principal.
+    `atualizar` recebe o total acumulado, como o `ao_progredir` dos
+    gravadores; `avancar` soma um incremento; `parcela` junta numa etapa
+    partes feitas ao mesmo tempo, como a leitura da origem e a do destino.
+    """
+
+    def __init__(self, ao_atualizar=None, intervalo=INTERVALO_AVISO):
+        self.ao_atualizar = ao_atualizar
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._etapa = None
+        self._total = None
+        self._unidade = 'linhas'
+        self._feito = 0
+        self._inicio = time.perf_counter()
+        self._base = None
+        self._ultimo_aviso = 0.0
+
+    def iniciar(self, etapa, total=None, unidade='linhas'):
+        """Começa uma etapa; `total` pode ser uma estimativa ou None (tamanho desconhecido)"""
+        with self._lock:
+            self._etapa = etapa
+            self._total = int(total) if total else None
+            self._unidade = unidade
+            self._feito = 0
+            self._inicio = time.perf_counter()
+            self._base = None
+        self._avisar(forcar=True)
+
+    def atualizar(self, feito):
+        """Informa o total acumulado da etapa atual"""
+        with self._lock:
+            self._registrar(int(feito))
+        self._avisar()
+
+    def avancar(self, quantidade=1):
+        """Soma `quantidade` ao acumulado da etapa atual"""
+        with self._lock:
+            self._registrar(self._feito + int(quantidade))
+        self._avisar()
+
+    def parcela(self, fator=1):
+        """`ao_progredir(feito)` de uma das partes da etapa atual.
+
+        Cada parte informa o próprio acumulado; o que ele cresceu, convertido
+        para a unidade da etapa por `fator`, é somado ao acumulado da etapa.
+        """
+        anterior = 0
+
+        def atualizar(feito):
+            nonlocal anterior
+            feito = int(feito * fator)
+            if feito > anterior:
+                self.avancar(feito - anterior)
+                anterior = feito
+        return atualizar
+
+    def concluir(self):
+        """Encerra a etapa atual: o acumulado passa a ser o total, corrigindo a estimativa"""
+        with self._lock:
+            self._total = self._feito
+        self._avisar(forcar=True)
+
+    def _registrar(self, feito):
+        self._feito = feito
+        if self._base is None:
+            # A velocidade é medida a partir do primeiro avanço
+            self._base = (time.perf_counter(), feito)
+
+    @property
+    def andamento(self):
+        """`Andamento` da etapa atual"""
+        with self._lock:
+            agora = time.perf_counter()
+            velocidade = None
+            if self._base is not None:
+                instante, feito_base = self._base
+                if agora > instante and self._feito > feito_base:
+                    velocidade = (self._feito - feito_base) / (agora - instante)
+            # Um total estimado abaixo do real acompanha o que já foi feito
+            total = max(self._total, self._feito) if self._total else None
+            return Andamento(self._etapa, self._feito, total, agora - self._inicio, velocidade, self._unidade)
+
+    def _avisar(self, forcar=False):
+        if not self.ao_atualizar or self._etapa is None:
+            return
+        with self._lock:
+            agora = time.perf_counter()
+            if not forcar and agora - self._ultimo_aviso < self.intervalo:
+                return
+            self._ultimo_aviso = agora
+        self.ao_atualizar(self.andamento)
@@ -0,0 +1,193 @@
+"""Trabalhos de vinculação salvos em arquivo e reexecutados só quando algo mudou"""
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from cache import hash_conteudo
+from vinculador import TrabalhoVinculacao, Vinculador
+
+# Extensão sugerida para os arquivos de trabalho
+EXTENSAO_TRABALHO = '.safe.json'
+
+# Versão do formato gravado; arquivos de versões mais novas são recusados
+VERSAO_TRABALHO = 1
+
+# Opções do trabalho que são caminhos de arquivo
+CAMPOS_CAMINHO = ('arquivo_origem', 'arquivo_destino', 'saida')
+
+
+def impressao_arquivo(caminho):
+    """Impressão digital do arquivo: tamanho, modificação e hash do conteúdo"""
+    estado = os.stat(caminho)
+    return {'tamanho': estado.st_size, 'modificado': estado.st_mtime_ns, 'hash': hash_conteudo(caminho)}
+
+
+def mesmo_conteudo(caminho, anterior):
+    """Confere o arquivo contra a impressão anterior.
+
+    Com tamanho e data iguais o arquivo é dado como igual sem reler o
+    conteúdo; com a data alterada (arquivo copiado ou salvo de novo sem
+    mudanças) o hash decide.
+    """
+    if not anterior or not os.path.exists(caminho):
+        return False
+    estado = os.stat(caminho)
+    if estado.st_size != anterior['tamanho']:
+        return False
+    return estado.st_mtime_ns == anterior['modificado'] or hash_conteudo(caminho) == anterior['hash']
+
+
+def impressao_configuracao(trabalho):
+    """Hash da configuração do trabalho (arquivos, chaves, colunas e opções)"""
+    texto = json.dumps(trabalho.como_dict(), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _ler(caminho):
+    with open(caminho, encoding='utf-8') as arquivo:
+        dados = json.load(arquivo)
+    if dados.get('versao', 1) > VERSAO_TRABALHO:
+        raise ValueError(f"O arquivo de trabalho {caminho} foi gravado por uma versão mais nova do SAFE")
+    return dados
+
+
+def _gravar(caminho, dados):
+    """Grava o JSON num temporário e o renomeia, para nunca deixar o arquivo pela metade"""
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    descritor, temporario = tempfile.mkstemp(suffix='.json', prefix='.safe_', dir=diretorio)
+    try:
+        with os.fdopen(descritor, 'w', encoding='utf-8') as arquivo:
+            json.dump(dados, arquivo, ensure_ascii=False, indent=2, default=str)
+        os.replace(temporario, caminho)
+    except Exception:
+        os.remove(temporario)
+        raise
+
+
+def _trabalho_salvo(dados, caminho):
+    """Recria o trabalho gravado em `caminho`.
+
+    Caminhos relativos (de arquivos escritos à mão, por exemplo) são
+    resolvidos a partir da pasta do arquivo de trabalho, e não da pasta
+    de onde ele é reexecutado.
+    """
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    configuracao = dict(dados['trabalho'])
+    for campo in CAMPOS_CAMINHO:
+        if configuracao.get(campo) and not os.path.isabs(configuracao[campo]):
+            configuracao[campo] = os.path.normpath(os.path.join(diretorio, configuracao[campo]))
+    return TrabalhoVinculacao.de_dict(configuracao)
+
+
+def salvar_trabalho(trabalho, caminho):
+    """Grava a configuração do trabalho, com caminhos absolutos; a última execução registrada é mantida"""
+    configuracao = trabalho.como_dict()
+    for campo in CAMPOS_CAMINHO:
+        if configuracao.get(campo):
+            configuracao[campo] = os.path.abspath(configuracao[campo])
+    ultima = None
+    if os.path.exists(caminho):
+        try:
+            ultima = _ler(caminho).get('ultima_execucao')
+        except (ValueError, OSError):
+            ultima = None
+    _gravar(caminho, {'versao': VERSAO_TRABALHO, 'trabalho': configuracao, 'ultima_execucao': ultima})
+
+
+def carregar_trabalho(caminho):
+    """Lê o `TrabalhoVinculacao` salvo em `caminho`"""
+    return _trabalho_salvo(_ler(caminho), caminho)
+
+
+def alteracoes(trabalho, ultima):
+    """O que mudou desde a última execução bem-sucedida (lista vazia: nada mudou).
+
+    Compara a configuração, o conteúdo da origem e do destino e confere se a
+    saída gravada continua no lugar, com o mesmo tamanho e data.
+    """
+    if not ultima:
+        return ["nenhuma execução anterior"]
+    mudancas = []
+    if ultima.get('configuracao') != impressao_configuracao(trabalho):
+        mudancas.append("configuração")
+    if not mesmo_conteudo(trabalho.arquivo_origem, ultima.get('origem')):
+        mudancas.append("arquivo origem")
+    if not mesmo_conteudo(trabalho.arquivo_destino, ultima.get('destino')):
+        mudancas.append("arquivo destino")
+    saida = ultima.get('saida')
+    if not saida or not os.path.exists(trabalho.saida):
+        mudancas.append("arquivo de saída ausente")
+    else:
+        estado = os.stat(trabalho.saida)
+        if (estado.st_size, estado.st_mtime_ns) != (saida['tamanho'], saida['modificado']):
+            mudancas.append("arquivo de saída modificado")
+    return mudancas
+
+
+def _renovar_impressoes(trabalho, ultima):
+    """Atualiza a data guardada da origem e do destino conferidos pelo hash; devolve se algo mudou.
+
+    Chamado quando nada mudou: um arquivo com a data diferente teve o
+    conteúdo confirmado pelo hash, e a data nova evita relê-lo na próxima vez.
+    """
+    renovou = False
+    for chave, arquivo in (('origem', trabalho.arquivo_origem), ('destino', trabalho.arquivo_destino)):
+        modificado = os.stat(arquivo).st_mtime_ns
+        if ultima[chave]['modificado'] != modificado:
+            ultima[chave]['modificado'] = modificado
+            renovou = True
+    return renovou
+
+
+class ExecucaoTrabalho:
+    """Resultado da reexecução de um trabalho salvo.
+
+    `estatisticas` é o dicionário de `Estatisticas.como_dict`: da vinculação
+    feita agora ou, com `reaproveitado`, da última execução, cujo arquivo de
+    saída continua válido. `alteracoes` lista o que levou à nova execução.
+    """
+
+    def __init__(self, trabalho, estatisticas, reaproveitado, alteracoes=()):
+        self.trabalho = trabalho
+        self.estatisticas = estatisticas
+        self.reaproveitado = reaproveitado
+        self.alteracoes = list(alteracoes)
+
+    def como_dict(self):
+        return {'reaproveitado': self.reaproveitado, 'alteracoes': self.alteracoes, **self.estatisticas}
+
+
+def reexecutar_trabalho(caminho, vinculador=None, forcar=False, ao_progredir=None):
+    """Reexecuta o trabalho salvo, pulando a vinculação quando nada mudou.
+
+    As impressões da origem e do destino são tiradas antes da vinculação,
+    para que um arquivo alterado durante a execução seja vinculado de novo
+    na próxima vez. Depois de gravar a saída, a execução é registrada no
+    próprio arquivo do trabalho. Devolve a `ExecucaoTrabalho`.
+    """
+    dados = _ler(caminho)
+    trabalho = _trabalho_salvo(dados, caminho)
+    mudancas = ["execução forçada"] if forcar else alteracoes(trabalho, dados.get('ultima_execucao'))
+    if not mudancas:
+        if _renovar_impressoes(trabalho, dados['ultima_execucao']):
+            _gravar(caminho, dados)
+        return ExecucaoTrabalho(trabalho, dados['ultima_execucao']['estatisticas'], True)
+
+    configuracao = impressao_configuracao(trabalho)
+    origem = impressao_arquivo(trabalho.arquivo_origem)
+    destino = impressao_arquivo(trabalho.arquivo_destino)
+    resultado = (vinculador or Vinculador()).executar(trabalho, ao_progredir)
+    estatisticas = resultado.estatisticas.como_dict()
+    estado = os.stat(trabalho.saida)
+    dados['ultima_execucao'] = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'configuracao': configuracao,
+        'origem': origem,
+        'destino': destino,
+        'saida': {'tamanho': estado.st_size, 'modificado': estado.st_mtime_ns},
+        'estatisticas': estatisticas,
+    }
+    _gravar(caminho, dados)
+    return ExecucaoTrabalho(trabalho, estatisticas, False, mudancas)
@@ -0,0 +1,436 @@
+"""Rotinas de vinculação (merge) entre os arquivos de origem e destino do SAFE"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from categorias import codificar_categorias, concatenar, decodificar_categorias
+from escrita import TAMANHO_BLOCO_ESCRITA, escolher_motor_escrita, escrever_xlsx_em_blocos, salvar_dataframe
+from leitura import eh_csv, ler_em_blocos
+
+# Linhas do destino processadas por vez no modo streaming
+TAMANHO_BLOCO_CSV = 100_000
+
+# Coluna auxiliar com a chave normalizada ou empacotada durante o merge com chaves repetidas
+COLUNA_CHAVE_AUXILIAR = '__chave_safe__'
+
+# Rótulos exibidos na interface para cada política de chaves repetidas na origem
+POLITICAS_DUPLICADAS = {
+    'Manter a primeira': 'primeira',
+    'Manter a última': 'ultima',
+    'Agregar (soma números, junta textos)': 'agregar',
+    'Interromper com erro': 'erro',
+    'Multiplicar linhas do destino': 'multiplicar',
+}
+
+# Quantas chaves repetidas aparecem como exemplo no relatório
+EXEMPLOS_DUPLICADAS = 5
+
+
+def conferir_colunas(cabecalho_origem, cabecalho_destino, chaves_origem, chaves, colunas_selecionadas):
+    """Confere, antes de ler os arquivos, se as chaves e as colunas pedidas existem"""
+    for coluna in list(chaves_origem) + list(colunas_selecionadas):
+        if coluna not in cabecalho_origem:
+            raise ValueError(f"Coluna '{coluna}' não encontrada no arquivo origem")
+    for coluna in chaves:
+        if coluna not in cabecalho_destino:
+            raise ValueError(f"Coluna-chave '{coluna}' não encontrada em um dos arquivos")
+
+
+class CodificadorChave:
+    """Empacota uma chave de várias colunas num único código inteiro.
+
+    Cada coluna é trocada pela posição do valor entre os valores distintos da
+    origem, e os códigos das colunas são combinados um a um; a cada passo as
+    combinações são renumeradas pelas que existem na origem. O código final
+    nunca passa do número de linhas da origem e, ao contrário de um hash, não
+    tem colisões. No destino, valores ou combinações ausentes na origem
+    recebem -1. Tudo é feito com operações vetorizadas de índice do pandas.
+    """
+
+    def __init__(self, normalizacao=None):
+        self.normalizacao = normalizacao if normalizacao else None
+        self.distintos = []
+        self.combinacoes = []
+
+    def _valores(self, df, coluna):
+        serie = df[coluna]
+        return self.normalizacao.aplicar(serie) if self.normalizacao else serie
+
+    def ajustar(self, df, colunas):
+        """Aprende os valores da origem e devolve os códigos das suas linhas"""
+        self.distintos = []
+        self.combinacoes = []
+        codigo = None
+        for coluna in colunas:
+            codigos, distintos = pd.factorize(self._valores(df, coluna), use_na_sentinel=False)
+            self.distintos.append(pd.Index(distintos))
+            codigos = codigos.astype(np.int64)
+            if codigo is None:
+                codigo = codigos
+                continue
+            codigo, combinacoes = pd.factorize(codigo * len(distintos) + codigos)
+            self.combinacoes.append(pd.Index(combinacoes))
+            codigo = codigo.astype(np.int64)
+        return codigo
+
+    def codificar(self, df, colunas):
+        """Códigos das linhas do destino (-1 quando a chave não existe na origem)"""
+        codigo = None
+        for posicao, (coluna, distintos) in enumerate(zip(colunas, self.distintos)):
+            codigos = distintos.get_indexer(self._valores(df, coluna)).astype(np.int64)
+            if codigo is None:
+                codigo = codigos
+                continue
+            combinado = codigo * len(distintos) + codigos
+            combinado[(codigo < 0) | (codigos < 0)] = -1
+            codigo = self.combinacoes[posicao - 1].get_indexer(combinado).astype(np.int64)
+        return codigo
+
+    def decodificar_colunas(self, codigos):
+        """Valores originais de cada coluna da chave, um `Index` por coluna, para os códigos da origem"""
+        codigos = np.asarray(codigos, dtype=np.int64)
+        colunas = []
+        for posicao in range(len(self.distintos) - 1, 0, -1):
+            combinado = self.combinacoes[posicao - 1].to_numpy()[codigos]
+            cardinalidade = len(self.distintos[posicao])
+            colunas.append(self.distintos[posicao].take(combinado % cardinalidade))
+            codigos = combinado // cardinalidade
+        colunas.append(self.distintos[0].take(codigos))
+        return list(reversed(colunas))
+
+    def decodificar(self, codigos):
+        """Tuplas de valores originais correspondentes aos códigos da origem"""
+        return list(zip(*self.decodificar_colunas(codigos)))
+
+    def vazio(self, colunas):
+        """DataFrame vazio com os tipos das colunas-chave da origem"""
+        return pd.DataFrame({coluna: distintos[:0] for coluna, distintos in zip(colunas, self.distintos)})
+
+
+class IndiceOrigem:
+    """Tabela de consulta da origem, montada uma única vez por vinculação.
+
+    Reproduz o resultado de `destino.merge(origem, on=chave, how='left')`
+    bloco a bloco: a ordem das linhas do destino é mantida, chaves sem
+    correspondência recebem valores vazios e colunas repetidas recebem os
+    sufixos `_x`/`_y` do pandas.
+
+    Com uma `NormalizacaoChave` ativa, o índice guarda as chaves da origem já
+    normalizadas e cada bloco do destino é normalizado antes da consulta; os
+    valores originais da chave no destino são mantidos no resultado. A chave
+    pode ter várias colunas: nesse caso a tabela é indexada pelo código
+    único do `CodificadorChave`, em vez de um merge em várias colunas.
+    """
+
+    def __init__(self, df_origem, chave, normalizacao=None):
+        chaves = [chave] if isinstance(chave, str) else list(chave)
+        codificador = None
+        if len(chaves) > 1:
+            codificador = CodificadorChave(normalizacao)
+            codigos = codificador.ajustar(df_origem, chaves)
+            tabela = df_origem.drop(columns=chaves).set_axis(pd.Index(codigos, name=COLUNA_CHAVE_AUXILIAR))
+        else:
+            tabela = df_origem.set_index(chaves[0])
+            if normalizacao:
+                tabela.index = pd.Index(normalizacao.aplicar(tabela.index.to_series()), name=chaves[0])
+        self._montar(tabela, chaves, normalizacao, codificador)
+
+    @classmethod
+    def da_tabela(cls, tabela, chave, normalizacao=None, codificador=None):
+        """Cria o índice a partir de uma tabela já indexada pela chave"""
+        indice = cls.__new__(cls)
+        indice._montar(tabela, [chave] if isinstance(chave, str) else list(chave), normalizacao, codificador)
+        return indice
+
+    def _montar(self, tabela, chaves, normalizacao, codificador):
+        self.tabela = tabela
+        self.chaves = chaves
+        # Nome da coluna-chave quando ela é simples
+        self.chave = chaves[0] if codificador is None else None
+        self.normalizacao = normalizacao if normalizacao else None
+        self.codificador = codificador
+        # Com chaves repetidas o merge multiplica linhas; nesse caso o
+        # bloco passa pelo merge normal para manter a mesma semântica
+        self.chave_unica = self.tabela.index.is_unique
+        # Linhas do destino com e sem chave encontrada na origem, somadas a cada bloco
+        self.correspondidas = 0
+        self.sem_correspondencia = 0
+        self._df_origem = None
+        self._verificado = False
+
+    @property
+    def colunas(self):
+        """Colunas da origem disponíveis no índice (sem a chave)"""
+        return list(self.tabela.columns)
+
+    @property
+    def auxiliar(self):
+        """Indica se a consulta usa uma chave derivada em vez dos valores originais"""
+        return self.normalizacao is not None or self.codificador is not None
+
+    @property
+    def df_origem(self):
+        """A origem como DataFrame comum, com a chave (ou a chave derivada) em coluna"""
+        if self._df_origem is None:
+            coluna = COLUNA_CHAVE_AUXILIAR if self.auxiliar else self.chave
+            self._df_origem = self.tabela.rename_axis(coluna).reset_index()
+        return self._df_origem
+
+    def projetar(self, colunas):
+        """Índice restrito às colunas pedidas, compartilhando a mesma chave"""
+        presentes = set(self.tabela.columns)
+        colunas = [col for col in colunas if col in presentes]
+        if colunas == self.colunas:
+            return self
+        return IndiceOrigem.da_tabela(self.tabela[colunas], self.chaves, self.normalizacao, self.codificador)
+
+    def renomear_chave(self, chave):
+        """Índice igual, com a chave exposta sob outro(s) nome(s) de coluna"""
+        return IndiceOrigem.da_tabela(self.tabela, chave, self.normalizacao, self.codificador)
+
+    def tratar_duplicadas(self, politica='primeira'):
+        """Aplica a política de chaves repetidas antes do join.
+
+        Devolve o índice a usar e um `RelatorioDuplicadas` (None quando a
+        chave da origem é única). Exceto em 'multiplicar', o índice devolvido
+        tem chaves únicas e o resultado terá exatamente as linhas do destino.
+        Com 'erro', levanta ValueError com o relatório.
+        """
+        if self.chave_unica:
+            return self, None
+        indice = self.tabela.index
+        repetidas = indice.duplicated(keep=False)
+        contagem = indice[repetidas].value_counts(dropna=False)
+        exemplos = list(contagem.index[:EXEMPLOS_DUPLICADAS])
+        if self.codificador is not None:
+            exemplos = self.codificador.decodificar(exemplos)
+        relatorio = RelatorioDuplicadas(len(contagem), int((contagem - 1).sum()), exemplos, politica)
+
+        if politica == 'erro':
+            raise ValueError(f"{relatorio}.\nEscolha outra política para chaves repetidas na origem.")
+        if politica == 'multiplicar':
+            return self, relatorio
+        if politica == 'agregar':
+            tabela = pd.concat([self.tabela[~repetidas], _agregar(self.tabela[repetidas])])
+        else:
+            tabela = self.tabela[~indice.duplicated(keep='first' if politica == 'primeira' else 'last')]
+        return IndiceOrigem.da_tabela(tabela, self.chaves, self.normalizacao, self.codificador), relatorio
+
+    def _verificar_tipos(self, bloco):
+        if self._verificado:
+            return
+        # Merge vazio apenas para validar tipos das chaves como o pandas faria
+        if self.codificador is not None:
+            origem = self.codificador.vazio(self.chaves)
+        else:
+            origem = self.df_origem.iloc[:0]
+        # Colunas categóricas são comparadas pelo tipo dos seus valores
+        decodificar_categorias(bloco.iloc[:0]).merge(decodificar_categorias(origem), on=self.chaves, how='left')
+        self._verificado = True
+
+    def chaves_consulta(self, bloco):
+        """Chaves do bloco do destino na forma do índice (normalizadas ou codificadas)"""
+        if self.codificador is not None:
+            if not self.normalizacao:
+                self._verificar_tipos(bloco)
+            return pd.Series(self.codificador.codificar(bloco, self.chaves), index=bloco.index)
+        if self.normalizacao:
+            # Os dois lados viram texto normalizado, então os tipos já coincidem
+            return self.normalizacao.aplicar(bloco[self.chave])
+        self._verificar_tipos(bloco)
+        return bloco[self.chave]
+
+    def enriquecer(self, bloco):
+        """Aplica o left join da origem a um bloco do destino"""
+        chaves = self.chaves_consulta(bloco)
+        encontradas = int(pd.Series(chaves).isin(self.tabela.index).sum())
+        self.correspondidas += encontradas
+        self.sem_correspondencia += len(bloco) - encontradas
+
+        if not self.chave_unica:
+            if not self.auxiliar:
+                return bloco.merge(self.df_origem, on=self.chave, how='left')
+            return (bloco.assign(**{COLUNA_CHAVE_AUXILIAR: chaves})
+                    .merge(self.df_origem, on=COLUNA_CHAVE_AUXILIAR, how='left')
+                    .drop(columns=COLUNA_CHAVE_AUXILIAR))
+
+        return anexar_colunas(bloco, self.tabela.reindex(chaves.to_numpy()))
+
+
+def anexar_colunas(bloco, valores):
+    """Junta ao bloco do destino os valores da origem alinhados linha a linha.
+
+    Colunas presentes nos dois lados recebem os sufixos `_x`/`_y`, como no
+    `merge` do pandas.
+    """
+    valores.index = bloco.index
+    repetidas = [col for col in valores.columns if col in bloco.columns]
+    if repetidas:
+        bloco = bloco.rename(columns={col: f"{col}_x" for col in repetidas})
+        valores = valores.rename(columns={col: f"{col}_y" for col in repetidas})
+    return pd.concat([bloco, valores], axis=1)
+
+
+def _juntar_textos(valores):
+    """Valores distintos do grupo, na ordem em que aparecem"""
+    return ' | '.join(dict.fromkeys(str(valor) for valor in valores.dropna())) or None
+
+
+def _agregar(tabela):
+    """Reduz as linhas de cada chave a uma: soma os números e junta os demais valores"""
+    grupos = tabela.groupby(level=0, sort=False, dropna=False, observed=True)
+    numericas = [col for col in tabela.columns
+                 if pd.api.types.is_numeric_dtype(tabela[col]) and not pd.api.types.is_bool_dtype(tabela[col])]
+    outras = [col for col in tabela.columns if col not in numericas]
+    partes = []
+    if numericas:
+        partes.append(grupos[numericas].sum(min_count=1))
+    if outras:
+        partes.append(grupos[outras].agg(_juntar_textos))
+    return pd.concat(partes, axis=1)[list(tabela.columns)]
+
+
+class RelatorioDuplicadas:
+    """Resumo das chaves repetidas encontradas na origem"""
+
+    def __init__(self, chaves_repetidas, linhas_excedentes, exemplos, politica):
+        self.chaves_repetidas = chaves_repetidas
+        self.linhas_excedentes = linhas_excedentes
+        self.exemplos = exemplos
+        self.politica = politica
+
+    @classmethod
+    def somar(cls, relatorios, politica):
+        """Junta os relatórios de partes da origem sem chaves em comum (None sem repetidas)"""
+        relatorios = [relatorio for relatorio in relatorios if relatorio]
+        if not relatorios:
+            return None
+        exemplos = [exemplo for relatorio in relatorios for exemplo in relatorio.exemplos]
+        return cls(sum(relatorio.chaves_repetidas for relatorio in relatorios),
+                   sum(relatorio.linhas_excedentes for relatorio in relatorios),
+                   exemplos[:EXEMPLOS_DUPLICADAS], politica)
+
+    def __str__(self):
+        exemplos = ', '.join(str(exemplo) for exemplo in self.exemplos)
+        return (f"{self.chaves_repetidas:,} chave(s) repetida(s) na origem "
+                f"({self.linhas_excedentes:,} linha(s) a mais); exemplos: {exemplos}")
+
+
+class ResultadoStreaming:
+    """Resultado do merge em blocos, gravado num arquivo CSV temporário.
+
+    `tipos` são os tipos das colunas do resultado (os do primeiro bloco),
+    usados para reler o CSV temporário sem perder datas nem textos.
+    """
+
+    def __init__(self, caminho_temporario, total_linhas, correspondidas=None, tipos=None,
+                 sem_correspondencia=None):
+        self.caminho_temporario = caminho_temporario
+        self.total_linhas = total_linhas
+        # Linhas do destino com e sem correspondência na origem (quando o motor informa)
+        self.correspondidas = correspondidas
+        self.sem_correspondencia = sem_correspondencia
+        self.tipos = dict(tipos) if tipos is not None else {}
+
+    def _opcoes_leitura(self):
+        """Opções do `pd.read_csv` que devolvem datas como datas e textos como texto.
+
+        Sem elas, o CSV relido viraria texto nas datas e número em códigos
+        como '001'; os números continuam inferidos, pois colunas vazias no
+        primeiro bloco podem ganhar valores nos seguintes.
+        """
+        datas = [coluna for coluna, tipo in self.tipos.items() if pd.api.types.is_datetime64_any_dtype(tipo)]
+        textos = {coluna: str for coluna, tipo in self.tipos.items()
+                  if pd.api.types.is_object_dtype(tipo) or pd.api.types.is_string_dtype(tipo)
+                  or isinstance(tipo, pd.CategoricalDtype)}
+        return {'parse_dates': datas, 'dtype': textos}
+
+    def salvar(self, caminho_saida, motor='auto', ao_progredir=None):
+        """Move o resultado para o caminho escolhido pelo usuário.
+
+        Para saída em Excel, o CSV temporário é relido em blocos e entregue
+        ao gravador streaming, sem carregar o resultado inteiro na memória.
+        """
+        if eh_csv(caminho_saida):
+            shutil.move(self.caminho_temporario, caminho_saida)
+            if ao_progredir:
+                ao_progredir(self.total_linhas)
+            return
+        try:
+            self._gravar_excel(caminho_saida, motor, ao_progredir)
+        finally:
+            self.descartar()
+
+    def _gravar_excel(self, caminho_saida, motor='auto', ao_progredir=None):
+        """Converte o CSV temporário na planilha de saída, sem apagá-lo"""
+        if escolher_motor_escrita(caminho_saida, self.total_linhas, motor) == 'streaming':
+            with pd.read_csv(self.caminho_temporario, chunksize=TAMANHO_BLOCO_ESCRITA,
+                             **self._opcoes_leitura()) as blocos:
+                escrever_xlsx_em_blocos(blocos, caminho_saida, ao_progredir)
+        else:
+            salvar_dataframe(pd.read_csv(self.caminho_temporario, **self._opcoes_leitura()), caminho_saida,
+                             'pandas', ao_progredir)
+
+    def descartar(self):
+        """Remove o arquivo temporário, se ainda existir"""
+        if os.path.exists(self.caminho_temporario):
+            os.remove(self.caminho_temporario)
+
+
+def merge_csv_em_blocos(arquivo_destino, skiprows, indice, tamanho_bloco=TAMANHO_BLOCO_CSV, planilha=None,
+                        motor='auto', ao_progredir=None):
+    """Vincula o destino à origem lendo o destino em blocos.
+
+    O pico de memória fica limitado ao índice da origem mais um bloco do
+    destino. Além de CSV, aceita planilhas xlsx, lidas em blocos pelo leitor
+    streaming. O resultado é anexado bloco a bloco num CSV temporário criado
+    ao lado do destino, para que a gravação final seja apenas uma renomeação.
+    `ao_progredir` recebe, a cada bloco, o total de linhas do destino já vinculadas.
+    """
+    descritor, caminho_temporario = tempfile.mkstemp(
+        suffix='.csv', prefix='.safe_', dir=os.path.dirname(os.path.abspath(arquivo_destino)))
+    total_linhas = 0
+    lidas = 0
+    tipos = None
+    # O índice pode vir do cache e já ter atendido outras vinculações
+    correspondidas_antes = indice.correspondidas
+    sem_correspondencia_antes = indice.sem_correspondencia
+    try:
+        with os.fdopen(descritor, 'w', newline='', encoding='utf-8') as saida:
+            blocos = ler_em_blocos(arquivo_destino, skiprows, tamanho_bloco=tamanho_bloco, motor=motor,
+                                   planilha=None if eh_csv(arquivo_destino) else planilha)
+            for numero, bloco in enumerate(blocos):
+                resultado = indice.enriquecer(bloco)
+                if tipos is None:
+                    tipos = resultado.dtypes
+                resultado.to_csv(saida, header=(numero == 0), index=False)
+                total_linhas += len(resultado)
+                lidas += len(bloco)
+                if ao_progredir:
+                    ao_progredir(lidas)
+    except Exception:
+        os.remove(caminho_temporario)
+        raise
+    return ResultadoStreaming(caminho_temporario, total_linhas, indice.correspondidas - correspondidas_antes, tipos,
+                              indice.sem_correspondencia - sem_correspondencia_antes)
+
+
+def merge_blocos(blocos, indice, ao_progredir=None):
+    """Vincula à origem um destino entregue em blocos e junta o resultado.
+
+    Usado com o leitor streaming de xlsx: cada bloco é enriquecido assim que
+    é lido, sem manter ao mesmo tempo o destino bruto e o resultado. Os
+    textos repetitivos de cada bloco já guardado ficam como categorias.
+    `ao_progredir` recebe, a cada bloco, o total de linhas já vinculadas.
+    """
+    resultados = []
+    lidas = 0
+    for bloco in blocos:
+        resultados.append(codificar_categorias(indice.enriquecer(bloco)))
+        lidas += len(bloco)
+        if ao_progredir:
+            ao_progredir(lidas)
+    return concatenar(resultados, ignore_index=True)
@@ -0,0 +1,518 @@
+"""Motor de vinculação sem interface gráfica: trabalho de entrada, resultado e estatísticas na saída.
+
+Uso em scripts:
+
+    trabalho = TrabalhoVinculacao('origem.xlsx', 'destino.csv', ['CPF'], ['NOME', 'EMAIL'],
+                                  saida='destino_vinculado.csv')
+    resultado = Vinculador().executar(trabalho)
+    print(resultado.estatisticas.como_dict())
+
+Leitura da origem e do destino, gravação e estratégias de vinculação podem
+ser trocadas no construtor do `Vinculador`.
+"""
+import copy
+import os
+import time
+
+from aproximacao import CorrespondenciaAproximada
+from cache import cache_dataframes, cache_indices
+from escrita import salvar_dataframe
+from estimativa import contar_linhas, estimar
+from incremental import VinculacaoIncremental
+from intercalacao import ForaDeOrdem, merge_ordenado
+from leitura import eh_csv, escolher_motor, ler_em_blocos, medida_leitura, obter_metadados
+from lote import nome_vinculado
+from normalizacao import NormalizacaoChave
+from paralelo import executar_em_paralelo
+from particionado import LIMITE_MEMORIA_MB, merge_particionado
+from progresso import Progresso
+from vinculacao import ResultadoStreaming, merge_blocos, merge_csv_em_blocos
+
+
+class TrabalhoVinculacao:
+    """Tudo o que define uma vinculação: arquivos, chaves, colunas e opções.
+
+    `chaves` são as colunas-chave do destino, pareadas com `chaves_origem`
+    (as mesmas quando omitidas). `similaridade` ativa a correspondência
+    aproximada com a nota mínima indicada. `motor_vinculacao` 'auto' é
+    resolvido pela estimativa em `planejar`. `incremental` reaproveita o
+    resultado da execução anterior quando a vinculação é em memória.
+    `selecao_manual` só guarda o modo de escolha das chaves na interface,
+    para reabrir o trabalho salvo.
+    """
+
+    def __init__(self, arquivo_origem, arquivo_destino, chaves_origem, colunas, chaves=None, saida=None,
+                 skip_origem=0, skip_destino=0, planilha_origem=None, planilha_destino=None,
+                 politica='primeira', normalizacao=None, similaridade=None, ordenados=False,
+                 motor_leitura='auto', motor_escrita='auto', motor_vinculacao='auto',
+                 limite_mb=LIMITE_MEMORIA_MB, particoes=None, persistir=False, indice_disco=True,
+                 selecao_manual=False, incremental=False):
+        chaves_origem = [chaves_origem] if isinstance(chaves_origem, str) else list(chaves_origem)
+        chaves = chaves_origem if chaves is None else [chaves] if isinstance(chaves, str) else list(chaves)
+        if len(chaves) != len(chaves_origem):
+            raise ValueError("A origem e o destino devem ter o mesmo número de colunas-chave")
+        self.arquivo_origem = str(arquivo_origem)
+        self.arquivo_destino = str(arquivo_destino)
+        self.chaves_origem = chaves_origem
+        self.chaves = chaves
+        self.colunas = list(colunas)
+        self.saida = str(saida) if saida else nome_vinculado(arquivo_destino)
+        self.skip_origem = int(skip_origem)
+        self.skip_destino = int(skip_destino)
+        self.planilha_origem = None if eh_csv(arquivo_origem) else planilha_origem
+        self.planilha_destino = None if eh_csv(arquivo_destino) else planilha_destino
+        self.politica = politica
+        self.normalizacao = normalizacao if normalizacao else None
+        self.similaridade = similaridade
+        self.ordenados = ordenados
+        self.motor_leitura = motor_leitura
+        self.motor_escrita = motor_escrita
+        self.motor_vinculacao = motor_vinculacao
+        # Motor pedido, antes de a estimativa resolver o 'auto'
+        self.motor_pedido = motor_vinculacao
+        self.limite_mb = limite_mb
+        self.particoes = particoes
+        self.persistir = persistir
+        self.indice_disco = indice_disco
+        self.selecao_manual = selecao_manual
+        self.incremental = incremental
+
+    def como_dict(self):
+        """Configuração do trabalho em tipos simples, pronta para JSON.
+
+        O motor escolhido pela estimativa não é guardado: ao reexecutar, ele
+        é escolhido de novo para o tamanho atual dos arquivos.
+        """
+        normalizacao = self.normalizacao or NormalizacaoChave()
+        return {
+            'arquivo_origem': self.arquivo_origem,
+            'arquivo_destino': self.arquivo_destino,
+            'saida': self.saida,
+            'skip_origem': self.skip_origem,
+            'skip_destino': self.skip_destino,
+            'planilha_origem': self.planilha_origem,
+            'planilha_destino': self.planilha_destino,
+            'selecao_manual': self.selecao_manual,
+            'chaves_origem': self.chaves_origem,
+            'chaves': self.chaves,
+            'colunas': self.colunas,
+            'politica': self.politica,
+            'normalizacao': {'etapas': list(normalizacao.etapas), 'largura_zeros': normalizacao.largura_zeros},
+            'similaridade': self.similaridade,
+            'ordenados': self.ordenados,
+            'motor_leitura': self.motor_leitura,
+            'motor_escrita': self.motor_escrita,
+            'motor_vinculacao': self.motor_pedido,
+            'limite_mb': self.limite_mb,
+            'persistir': self.persistir,
+            'indice_disco': self.indice_disco,
+            'incremental': self.incremental,
+        }
+
+    @classmethod
+    def de_dict(cls, dados):
+        """Recria o trabalho a partir de `como_dict`"""
+        dados = dict(dados)
+        regras = dados.pop('normalizacao', None) or {}
+        normalizacao = NormalizacaoChave(regras.get('etapas', ()), regras.get('largura_zeros', 0))
+        return cls(normalizacao=normalizacao, **dados)
+
+    def para_destino(self, arquivo_destino):
+        """Cópia do trabalho para outro destino do lote, gravada como `<nome>_vinculado` ao lado dele.
+
+        O motor pedido é mantido e, no 'auto', a estimativa escolhe de novo
+        para o tamanho de cada destino.
+        """
+        dados = self.como_dict()
+        dados.update(arquivo_destino=str(arquivo_destino), saida=nome_vinculado(arquivo_destino))
+        return TrabalhoVinculacao.de_dict(dados)
+
+    def planejar(self):
+        """Estima memória e tempo e define o motor de vinculação; devolve a `Estimativa`"""
+        plano = estimar(self.arquivo_origem, self.skip_origem, self.arquivo_destino, self.skip_destino,
+                        self.chaves_origem, self.colunas, self.planilha_origem, self.planilha_destino,
+                        self.limite_mb)
+        self.motor_vinculacao, self.particoes = plano.motor, plano.particoes
+        return plano
+
+
+class Estatisticas:
+    """Números de uma vinculação concluída: linhas, correspondências, motor e tempos"""
+
+    def __init__(self, colunas):
+        self.colunas = list(colunas)
+        self.saida = None
+        self.linhas = 0
+        # Linhas do destino com e sem chave encontrada na origem; com chaves
+        # repetidas multiplicadas, as duas somam menos que as linhas da saída
+        self.correspondidas = None
+        self.sem_correspondencia = None
+        self.motor = None
+        self.duplicadas = None
+        # Linhas copiadas do resultado anterior na vinculação incremental
+        self.reaproveitadas = None
+        # Segundos gastos em cada etapa, na ordem em que foram executadas
+        self.tempos = {}
+
+    def marcar(self, etapa, inicio):
+        """Registra o tempo da etapa iniciada em `inicio` (time.perf_counter)"""
+        self.tempos[etapa] = round(time.perf_counter() - inicio, 3)
+
+    def como_dict(self):
+        """Estatísticas em tipos simples, prontas para JSON"""
+        return {
+            'saida': self.saida,
+            'linhas': self.linhas,
+            'correspondidas': self.correspondidas,
+            'sem_correspondencia': self.sem_correspondencia,
+            'colunas_adicionadas': len(self.colunas),
+            'colunas': [str(coluna) for coluna in self.colunas],
+            'motor': self.motor,
+            'chaves_repetidas': int(self.duplicadas.chaves_repetidas) if self.duplicadas else 0,
+            'linhas_excedentes': int(self.duplicadas.linhas_excedentes) if self.duplicadas else 0,
+            'linhas_reaproveitadas': self.reaproveitadas,
+            'tempos': dict(self.tempos),
+        }
+
+
+class ResultadoVinculacao:
+    """Dados vinculados, ainda não gravados, e as estatísticas da vinculação.
+
+    `dados` é um DataFrame ou, nos motores em blocos, um `ResultadoStreaming`
+    com o CSV temporário; `salvar` grava no caminho final pelo gravador do
+    `Vinculador` e `descartar` libera o temporário sem gravar. `ao_salvar`
+    é chamado depois de uma gravação bem-sucedida; com `progresso`, a
+    gravação é informada como a etapa 'gravacao'.
+    """
+
+    def __init__(self, dados, estatisticas, gravar, ao_salvar=None, progresso=None):
+        self.dados = dados
+        self.estatisticas = estatisticas
+        self._gravar = gravar
+        self._ao_salvar = ao_salvar
+        self.progresso = progresso
+
+    @property
+    def em_disco(self):
+        return isinstance(self.dados, ResultadoStreaming)
+
+    def salvar(self, caminho_saida, motor_escrita='auto', ao_progredir=None):
+        inicio = time.perf_counter()
+
+        def progredir(linhas):
+            if self.progresso:
+                self.progresso.atualizar(linhas)
+            if ao_progredir:
+                ao_progredir(linhas)
+
+        if self.progresso:
+            self.progresso.iniciar('gravacao', self.estatisticas.linhas)
+        self._gravar(self.dados, caminho_saida, motor_escrita, progredir)
+        if self.progresso:
+            self.progresso.concluir()
+        self.estatisticas.marcar('gravacao', inicio)
+        self.estatisticas.saida = str(caminho_saida)
+        if self._ao_salvar:
+            self._ao_salvar()
+
+    def descartar(self):
+        if self.em_disco:
+            self.dados.descartar()
+
+
+def ler_origem_indexada(trabalho, ao_progredir=None):
+    """Leitor padrão da origem: índice da chave pelo cache (memória e disco)"""
+    return cache_indices.obter(trabalho.arquivo_origem, trabalho.chaves_origem, trabalho.colunas,
+                               trabalho.skip_origem, motor=trabalho.motor_leitura, planilha=trabalho.planilha_origem,
+                               persistir=trabalho.indice_disco, persistir_leitura=trabalho.persistir,
+                               normalizacao=trabalho.normalizacao, ao_progredir=ao_progredir)
+
+
+def ler_destino_completo(trabalho, ao_progredir=None):
+    """Leitor padrão do destino inteiro, pelo cache de DataFrames"""
+    return cache_dataframes.ler(trabalho.arquivo_destino, trabalho.skip_destino, motor=trabalho.motor_leitura,
+                                persistir=trabalho.persistir, planilha=trabalho.planilha_destino,
+                                ao_progredir=ao_progredir)
+
+
+def ler_destino_em_blocos(trabalho):
+    """Leitor padrão do destino em blocos (xlsx no leitor streaming)"""
+    return ler_em_blocos(trabalho.arquivo_destino, trabalho.skip_destino, motor=trabalho.motor_leitura,
+                         planilha=trabalho.planilha_destino)
+
+
+def gravar_resultado(dados, caminho_saida, motor_escrita='auto', ao_progredir=None):
+    """Gravador padrão: move o CSV temporário ou grava o DataFrame em CSV/xlsx"""
+    if isinstance(dados, ResultadoStreaming):
+        dados.salvar(caminho_saida, motor_escrita, ao_progredir)
+    else:
+        salvar_dataframe(dados, caminho_saida, motor_escrita, ao_progredir)
+
+
+def linhas_destino(trabalho):
+    """Linhas previstas no destino, total da barra de progresso (None quando não dá para contar)"""
+    try:
+        return contar_linhas(trabalho.arquivo_destino, trabalho.skip_destino, trabalho.planilha_destino)
+    except Exception:
+        return None
+
+
+def vincular_ordenados(vinculador, trabalho, estatisticas):
+    """Estratégia por intercalação, para arquivos já ordenados pela chave de uma coluna"""
+    if (not trabalho.ordenados or len(trabalho.chaves) > 1 or trabalho.normalizacao
+            or trabalho.similaridade is not None):
+        return None
+    vinculador.informar("⚙️ Intercalando arquivos ordenados pela chave...")
+    vinculador.progresso.iniciar('vinculacao', linhas_destino(trabalho))
+    try:
+        resultado, estatisticas.duplicadas = merge_ordenado(
+            trabalho.arquivo_origem, trabalho.skip_origem, trabalho.arquivo_destino, trabalho.skip_destino,
+            trabalho.chaves_origem[0], trabalho.chaves[0], trabalho.colunas, trabalho.politica,
+            trabalho.planilha_origem, trabalho.planilha_destino, ao_progredir=vinculador.progresso.atualizar)
+    except ForaDeOrdem as aviso:
+        # Sem a ordem garantida, segue para as demais estratégias
+        vinculador.informar(f"⚠️ {aviso}; usando o índice da origem...")
+        return None
+    estatisticas.correspondidas = resultado.correspondidas
+    estatisticas.sem_correspondencia = resultado.sem_correspondencia
+    return resultado
+
+
+def vincular_particionado(vinculador, trabalho, estatisticas):
+    """Estratégia por partições em disco, quando nem a origem cabe no limite de memória"""
+    if trabalho.motor_vinculacao != 'disco' or trabalho.similaridade is not None:
+        return None
+    vinculador.informar("⚙️ Arquivos acima do limite de memória: vinculando por partições em disco...")
+    vinculador.progresso.iniciar('vinculacao', linhas_destino(trabalho))
+    resultado, estatisticas.duplicadas = merge_particionado(
+        trabalho.arquivo_origem, trabalho.skip_origem, trabalho.arquivo_destino, trabalho.skip_destino,
+        trabalho.chaves_origem, trabalho.chaves, trabalho.colunas, trabalho.politica, trabalho.planilha_origem,
+        trabalho.planilha_destino, trabalho.normalizacao, trabalho.limite_mb, particoes=trabalho.particoes,
+        ao_progredir=vinculador.progresso.atualizar)
+    estatisticas.correspondidas = resultado.correspondidas
+    estatisticas.sem_correspondencia = resultado.sem_correspondencia
+    return resultado
+
+
+def vincular_pelo_indice(vinculador, trabalho, estatisticas):
+    """Estratégia padrão: índice da origem com o destino inteiro ou lido em blocos"""
+    em_blocos = trabalho.motor_vinculacao not in ('auto', 'memoria')
+    # Destinos xlsx no leitor streaming alimentam o merge bloco a bloco
+    blocos_destino = not em_blocos and escolher_motor(trabalho.arquivo_destino, trabalho.motor_leitura) == 'streaming'
+
+    # Origem e destino são carregados ao mesmo tempo; nos modos em blocos o
+    # destino é lido durante o merge
+    vinculador.informar("⚙️ Carregando origem e destino...")
+    (indice, estatisticas.duplicadas), df_destino = vinculador.carregar(
+        trabalho, destino=not (em_blocos or blocos_destino))
+    if df_destino is None:
+        colunas_destino = obter_metadados(trabalho.arquivo_destino).cabecalho(trabalho.skip_destino,
+                                                                             trabalho.planilha_destino)
+    else:
+        colunas_destino = df_destino.columns
+    for coluna in trabalho.chaves:
+        if coluna not in colunas_destino:
+            raise ValueError(f"Coluna-chave '{coluna}' não encontrada em um dos arquivos")
+
+    # O índice pode vir do cache e já ter atendido outras vinculações
+    correspondidas_antes = indice.correspondidas
+    sem_correspondencia_antes = indice.sem_correspondencia
+    vinculador.informar("⚙️ Processando vinculação...")
+    progresso = vinculador.progresso
+    if em_blocos:
+        estatisticas.motor = 'blocos'
+        progresso.iniciar('vinculacao', linhas_destino(trabalho))
+        resultado = merge_csv_em_blocos(trabalho.arquivo_destino, trabalho.skip_destino, indice,
+                                        planilha=trabalho.planilha_destino, motor=trabalho.motor_leitura,
+                                        ao_progredir=progresso.atualizar)
+    elif blocos_destino:
+        progresso.iniciar('vinculacao', linhas_destino(trabalho))
+        resultado = merge_blocos(vinculador.ler_blocos_destino(trabalho), indice, progresso.atualizar)
+    else:
+        # Destino já na memória: o join é uma única operação vetorizada
+        progresso.iniciar('vinculacao', len(df_destino))
+        resultado = indice.enriquecer(df_destino)
+        progresso.atualizar(len(df_destino))
+    estatisticas.correspondidas = indice.correspondidas - correspondidas_antes
+    estatisticas.sem_correspondencia = indice.sem_correspondencia - sem_correspondencia_antes
+    return resultado
+
+
+# Estratégias tentadas em ordem; cada uma devolve None quando não se aplica ao trabalho
+ESTRATEGIAS = {
+    'intercalacao': vincular_ordenados,
+    'disco': vincular_particionado,
+    'memoria': vincular_pelo_indice,
+}
+
+
+class Vinculador:
+    """Executa trabalhos de vinculação sem depender da interface.
+
+    Os leitores recebem o `TrabalhoVinculacao`: `ler_origem(trabalho,
+    ao_progredir)` devolve o `IndiceOrigem`, `ler_destino(trabalho,
+    ao_progredir)` o DataFrame do destino, informando o acumulado da leitura
+    (veja `ler_arquivo`), e `ler_blocos_destino` os blocos do destino. `gravar(dados, caminho,
+    motor_escrita, ao_progredir)` grava o resultado. `estrategias` é um
+    dicionário nome → função(vinculador, trabalho, estatisticas), tentadas
+    em ordem até uma devolver os dados vinculados. `ao_informar` recebe as
+    mensagens de andamento e `ao_andamento` o `Andamento` de cada etapa
+    (leitura, vinculação e gravação), com fração, velocidade e tempo
+    restante; os dois podem ser chamados de outras threads.
+    """
+
+    def __init__(self, ler_origem=ler_origem_indexada, ler_destino=ler_destino_completo,
+                 ler_blocos_destino=ler_destino_em_blocos, gravar=gravar_resultado, estrategias=None,
+                 ao_informar=None, ao_andamento=None):
+        self.ler_origem = ler_origem
+        self.ler_destino = ler_destino
+        self.ler_blocos_destino = ler_blocos_destino
+        self.gravar = gravar
+        self.estrategias = dict(ESTRATEGIAS if estrategias is None else estrategias)
+        self.ao_informar = ao_informar
+        self.progresso = Progresso(ao_andamento)
+        # Índice da origem já preparado, reaproveitado pelo modo em lote
+        self._indice_preparado = None
+
+    def informar(self, mensagem):
+        if self.ao_informar:
+            self.ao_informar(mensagem)
+
+    def com_indice(self, indice, duplicadas=None):
+        """Vinculador que usa um índice da origem já preparado, sem ler a origem de novo.
+
+        Usado pelo modo em lote, que aplica o mesmo índice a vários destinos.
+        Cada vinculação recebe uma cópia rasa do índice (a tabela é a mesma),
+        para que as contagens de destinos vinculados ao mesmo tempo não se
+        misturem.
+        """
+        vinculador = Vinculador(self.ler_origem, self.ler_destino, self.ler_blocos_destino, self.gravar,
+                                self.estrategias, self.ao_informar)
+        vinculador._indice_preparado = (indice, duplicadas)
+        return vinculador
+
+    def carregar(self, trabalho, destino=True):
+        """Prepara o índice da origem e lê o destino inteiro ao mesmo tempo, na etapa de leitura.
+
+        Devolve `(indice, duplicadas)` e o DataFrame do destino (None sem
+        `destino`, quando ele é lido em blocos durante o merge). O total da
+        etapa soma o tamanho previsto de cada arquivo (`medida_leitura`):
+        bytes para CSV e linhas para xlsx; com as duas unidades na mesma
+        etapa, as linhas do xlsx viram bytes na proporção do tamanho do
+        arquivo. A barra só fica indeterminada quando nenhum arquivo tem
+        previsão. Um arquivo atendido pelo cache conta como lido ao terminar.
+        """
+        lidos = [(trabalho.arquivo_origem, trabalho.skip_origem, trabalho.planilha_origem)
+                 if self._indice_preparado is None else None,
+                 (trabalho.arquivo_destino, trabalho.skip_destino, trabalho.planilha_destino) if destino else None]
+        medidas = []
+        for lido in lidos:
+            try:
+                medidas.append(medida_leitura(*lido) if lido else None)
+            except Exception:
+                medidas.append(None)
+        unidades = {medida[1] for medida in medidas if medida}
+        unidade = unidades.pop() if len(unidades) == 1 else 'bytes'
+        total = 0
+        partes = []
+        for lido, medida in zip(lidos, medidas):
+            if medida is None:
+                partes.append((None, None))
+                continue
+            tamanho, unidade_arquivo = medida
+            fator = 1 if unidade_arquivo == unidade else os.path.getsize(lido[0]) / tamanho
+            total += tamanho * fator
+            partes.append((self.progresso.parcela(fator), tamanho))
+        self.progresso.iniciar('leitura', total, unidade)
+
+        def tarefa(ler, parte):
+            progredir, tamanho = parte
+
+            def executar():
+                resultado = ler(progredir)
+                if progredir:
+                    progredir(tamanho)
+                return resultado
+            return executar
+
+        return executar_em_paralelo(
+            tarefa(lambda progredir: self.preparar_indice(trabalho, progredir), partes[0]),
+            tarefa(lambda progredir: self.ler_destino(trabalho, progredir) if destino else None, partes[1]))
+
+    def preparar_indice(self, trabalho, ao_progredir=None):
+        """Índice da origem pronto para o join: chave do destino, repetidas tratadas e busca aproximada.
+
+        Devolve o índice e o `RelatorioDuplicadas` (ou None). O modo em lote
+        prepara o índice uma vez e o reaproveita por `com_indice`.
+        `ao_progredir` acompanha a leitura da origem.
+        """
+        if self._indice_preparado is not None:
+            indice, duplicadas = self._indice_preparado
+            return copy.copy(indice), duplicadas
+        indice = self.ler_origem(trabalho, ao_progredir)
+        if trabalho.chaves_origem != trabalho.chaves:
+            # Renomeia a chave da origem para corresponder ao destino
+            indice = indice.renomear_chave(trabalho.chaves)
+        for coluna in trabalho.colunas:
+            if coluna not in trabalho.chaves and coluna not in indice.colunas:
+                raise ValueError(f"Coluna '{coluna}' não encontrada no arquivo origem")
+        # Chaves repetidas na origem são resolvidas antes do join, sem multiplicar o destino
+        indice, duplicadas = indice.tratar_duplicadas(trabalho.politica)
+        if trabalho.similaridade is not None:
+            indice = CorrespondenciaAproximada(indice, trabalho.similaridade)
+        return indice, duplicadas
+
+    def vincular(self, trabalho):
+        """Vincula o destino à origem sem gravar; devolve o `ResultadoVinculacao`"""
+        estatisticas = Estatisticas(trabalho.colunas)
+        if trabalho.motor_vinculacao == 'auto':
+            inicio = time.perf_counter()
+            try:
+                self.informar(f"📐 {trabalho.planejar()}")
+            except Exception:
+                # Sem a estimativa, a vinculação segue pelo caminho em memória
+                trabalho.motor_vinculacao = 'memoria'
+            estatisticas.marcar('estimativa', inicio)
+
+        inicio = time.perf_counter()
+        ao_salvar = None
+        if self._incremental(trabalho):
+            # O estado só é guardado depois que a saída foi gravada
+            estatisticas.motor = 'incremental'
+            incremental = VinculacaoIncremental(trabalho)
+            dados = incremental.vincular(self, estatisticas)
+            ao_salvar = incremental.registrar
+        else:
+            for nome, estrategia in self.estrategias.items():
+                estatisticas.motor = nome
+                dados = estrategia(self, trabalho, estatisticas)
+                if dados is not None:
+                    break
+            else:
+                raise ValueError("Nenhuma estratégia de vinculação se aplica a este trabalho")
+        self.progresso.concluir()
+        estatisticas.marcar('vinculacao', inicio)
+        estatisticas.linhas = dados.total_linhas if isinstance(dados, ResultadoStreaming) else len(dados)
+        return ResultadoVinculacao(dados, estatisticas, self.gravar, ao_salvar, self.progresso)
+
+    def _incremental(self, trabalho):
+        """Se a vinculação incremental se aplica: join exato com a origem e o destino em memória"""
+        if not trabalho.incremental:
+            return False
+        if trabalho.similaridade is not None or trabalho.motor_vinculacao not in ('auto', 'memoria'):
+            self.informar("⚠️ Vinculação incremental indisponível para este motor; vinculando tudo...")
+            return False
+        return True
+
+    def executar(self, trabalho, ao_progredir=None):
+        """Vincula e grava em `trabalho.saida`; devolve o `ResultadoVinculacao`"""
+        inicio = time.perf_counter()
+        resultado = self.vincular(trabalho)
+        self.informar("💾 Gravando arquivo...")
+        try:
+            resultado.salvar(trabalho.saida, trabalho.motor_escrita, ao_progredir)
+        except Exception:
+            resultado.descartar()
+            raise
+        resultado.estatisticas.marcar('total', inicio)
+        return resultado